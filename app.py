@@ -1,28 +1,36 @@
 import dash
 from dash import dcc, html, Output, Input
-import pandas as pd
 import plotly.express as px
 import folium
-from folium.plugins import MarkerCluster
-import base64
 import json
-from geopy.distance import geodesic
-import numpy as np
-import matplotlib.pyplot as plt
-import mpld3
-
-# Load the data
-data_path = '/Users/jaskiratkaur/Documents/HPC/elec-transit-y/data/ev_stations_v1.csv'
-ev_data = pd.read_csv(data_path, low_memory=False)
-
-# Process the data
-ev_data['open_date'] = pd.to_datetime(ev_data['open_date'], errors='coerce')
-ev_data['year'] = ev_data['open_date'].dt.year
+import os
+from elec_transit_y import bundle
+from elec_transit_y.background import background_manager, slow_callback
+from elec_transit_y.cache import LRUCache, data_hash
+from elec_transit_y.spatial_index import StationIndex, KM_PER_MILE
+from elec_transit_y.map_layers import VectorTileLayer
+from elec_transit_y.metrics import register_metrics_routes, stage, watch_cache
+from elec_transit_y.neighbor_graph import NeighborGraph, graph_figure
+from elec_transit_y.station_layer import POPUP_FIELDS, station_layer
+from elec_transit_y.tiles import TileSource, register_tile_routes, station_tile_layer
+
+# Load the data (from the prebuilt bundle when available, see elec_transit_y/bundle.py)
+ev_data = bundle.load('ev_stations')
+
+# Keep stations with a known opening year
 ev_data = ev_data.dropna(subset=['year'])
 ev_data['year'] = ev_data['year'].astype(int)
 
+# Build the station index once so map clicks don't scan every station
+with stage('app.station_index'):
+    station_index = StationIndex(ev_data['latitude'], ev_data['longitude'])
+
+# Run the click analysis as a background job (see elec_transit_y/background.py), with
+# results memoized per click for this station data
+callback_manager = background_manager(namespace=data_hash(ev_data[['latitude', 'longitude']]))
+
 # Create scatter plot
-data_for_plotting = ev_data.groupby(['year', 'state']).size().reset_index(name='count')
+data_for_plotting = ev_data.groupby(['year', 'state'], observed=True).size().reset_index(name='count')
 scatter_fig = px.scatter(data_for_plotting, x='year', y='count', color='state',
                          title='Growth of EV Charging Stations Over Time by State')
 
@@ -52,37 +60,23 @@ latitudes = ev_data['latitude']
 longitudes = ev_data['longitude']
 mean_lat, mean_lon = latitudes.mean(), longitudes.mean()
 ev_map = folium.Map(location=[mean_lat, mean_lon], zoom_start=5)
-marker_cluster = MarkerCluster().add_to(ev_map)
-
-# Add charging station locations to the map with popups
-for idx, row in ev_data.iterrows():
-    popup_text = f"""
-    <b>Station Name:</b> {row['station_name']}<br>
-    <b>Street Address:</b> {row['street_address']}<br>
-    <b>City:</b> {row['city']}<br>
-    <b>State:</b> {row['state']}<br>
-    <b>ZIP Code:</b> {row['zip']}<br>
-    <b>Fuel Type:</b> {row['fuel_type_code']}<br>
-    <b>Access Code:</b> {row['access_code']}
-    """
-    iframe = folium.IFrame(html=popup_text, width=300, height=200)
-    popup = folium.Popup(iframe, max_width=500)
-    folium.Marker(
-        location=[row['latitude'], row['longitude']],
-        popup=popup
-    ).add_to(marker_cluster)
+
+# Add charging station locations to the map with popups; with VECTOR_TILES=1 they are
+# drawn from the /tiles endpoint rather than embedded as one marker per station
+vector_tiles = os.environ.get('VECTOR_TILES', '0') == '1'
+if vector_tiles:
+    tile_source = TileSource([station_tile_layer(ev_data)])
+    VectorTileLayer(f'/tiles/stations/{tile_source.version("stations")}/{{z}}/{{x}}/{{y}}.pbf', 'stations', popup_fields=POPUP_FIELDS).add_to(ev_map)
+else:
+    with stage('app.station_markers'):
+        station_layer(ev_data).add_to(ev_map)
 
 # Add LatLngPopup to display latitude and longitude on click
 ev_map.add_child(folium.LatLngPopup())
 
-# Save the map as an HTML file
-ev_map.save('ev_map.html')
-
-# Read the map HTML and encode it as a base64 string
-with open('ev_map.html', 'r') as file:
-    ev_map_html = file.read()
-
-encoded_map = base64.b64encode(ev_map_html.encode()).decode()
+# Render the map HTML in memory
+with stage('app.map_html'):
+    ev_map_html = ev_map.get_root().render()
 
 # Initialize the Dash app
 app = dash.Dash(__name__, external_stylesheets=[
@@ -90,6 +84,16 @@ app = dash.Dash(__name__, external_stylesheets=[
     '/assets/styles.css'
 ])
 
+# Expose the Flask server for gunicorn (see gunicorn.conf.py)
+server = app.server
+if vector_tiles:
+    register_tile_routes(server, tile_source)
+    watch_cache('tiles', tile_source.cache)
+
+# Serve request latencies, payload sizes, stage timings and cache hit rates at /metrics
+# (see elec_transit_y/metrics.py)
+register_metrics_routes(server)
+
 # Define the app layout
 app.layout = html.Div(className='container', children=[
     html.H1('Electric Vehicle Charging Stations Dashboard'),
@@ -117,11 +121,14 @@ app.layout = html.Div(className='container', children=[
     ]),
 
     html.H2('EV Charging Stations Map'),
-    html.Iframe(id='map', srcDoc=base64.b64decode(encoded_map).decode(), width='100%', height='600'),
+    html.Iframe(id='map', srcDoc=ev_map_html, width='100%', height='600'),
 
     dcc.Input(id='map_click_data', type='hidden', value=''),
     html.Div(id='output', style={'margin-top': '20px'}),
 
+    # Progress of the click analysis while it runs in the background
+    html.Div(id='graph-progress', style={'margin-top': '20px', 'display': 'none'}),
+
     # Graph output placeholder
     html.Div(id='graph-output', style={'width': '100%', 'height': '600px'}),  # Adding this line
 
@@ -134,8 +141,9 @@ app.clientside_callback(
         var mapFrame = document.getElementById('map').contentWindow;
         mapFrame.document.querySelectorAll('.leaflet-container').forEach((container) => {
             container.addEventListener('click', function(e) {
-                var lat = e.latlng.lat;
-                var lon = e.latlng.lng;
+                // Rounded like quantize_click, so nearby clicks reuse a memoized result
+                var lat = Math.round(e.latlng.lat * 1000) / 1000;
+                var lon = Math.round(e.latlng.lng * 1000) / 1000;
                 document.getElementById('map_click_data').value = JSON.stringify({lat: lat, lon: lon});
                 document.getElementById('map_click_data').dispatchEvent(new Event('input'));
             });
@@ -149,85 +157,86 @@ app.clientside_callback(
 
 def generate_graphs(lat, lon, ev_data, radius=0.5):  # radius in kilometers
     # Filter data for nearby stations
-    selected_data = ev_data[ev_data.apply(lambda row: geodesic((lat, lon), (row['latitude'], row['longitude'])).km <= radius, axis=1)]
-    coordinates = np.column_stack((selected_data['longitude'], selected_data['latitude']))
-    
-    # Create graphs
-    knn_graph = weights.KNN.from_array(coordinates, k=3).to_networkx()
-    dist_graph = weights.DistanceBand.from_array(coordinates, threshold=50).to_networkx()
-
-    # Generate plots
-    fig, ax = plt.subplots(1, 2, figsize=(10, 5))
-    positions = dict(zip(knn_graph.nodes, coordinates))
-    nx.draw(knn_graph, positions, ax=ax[0], node_color='blue', node_size=50, with_labels=True)
-    nx.draw(dist_graph, positions, ax=ax[1], node_color='red', node_size=50, with_labels=True)
-    ax[0].set_title('3-Nearest Neighbor Graph')
-    ax[1].set_title('50-meter Distance Band Graph')
-
-    # Convert plot to HTML
-    plt.tight_layout()
-    graph_html = mpld3.fig_to_html(fig)
-    return graph_html
-
-# Function to get stations within a given radius
+    with stage('click.radius_query'):
+        positions, _ = station_index.query_radius(lat, lon, radius)
+        selected_data = ev_data.iloc[positions]
+
+    # Build the 3-nearest-neighbor and 50-meter distance band graphs in metres around the click
+    with stage('click.neighbor_graphs'):
+        graph = NeighborGraph(selected_data['latitude'], selected_data['longitude'], (lat, lon), k=3, threshold=50)
+        labels = selected_data['station_name'] if 'station_name' in selected_data.columns else None
+        return graph_figure(graph, labels), graph.stats()
+
+# Function to summarize the graph statistics under the graphs
+def graph_summary(stats):
+    return (f"{stats['stations']} stations; 3-NN graph: {stats['knn']['components']} components; "
+            f"50 m band: {stats['band']['components']} components, {stats['band']['isolated']} isolated stations; "
+            f"largest gap to a nearest neighbor: {stats['largest_gap_m']:.0f} m")
+
+# Function to get stations within a given radius (in miles)
 def get_stations_in_radius(lat, lon, radius):
-    stations = []
-    for idx, row in ev_data.iterrows():
-        station_lat = row['latitude']
-        station_lon = row['longitude']
-        distance = geodesic((lat, lon), (station_lat, station_lon)).miles
-        if distance <= radius:
-            stations.append({
-                'name': row['station_name'],
-                'street_address': row['street_address'],
-                'city': row['city'],
-                'state': row['state'],
-                'zip': row['zip'],
-                'latitude': row['latitude'],
-                'longitude': row['longitude']
-            })
-    return stations
+    with stage('click.radius_query'):
+        positions, _ = station_index.query_radius(lat, lon, radius * KM_PER_MILE)
+        return ev_data.iloc[positions]
 
 # Function to update the map with stations in the radius
 def update_stations_in_radius(lat, lon, radius):
     stations = get_stations_in_radius(lat, lon, radius)
-    updated_map = folium.Map(location=[lat, lon], zoom_start=5)
-    marker_cluster = MarkerCluster().add_to(updated_map)
-    for station in stations:
-        popup_text = f"""
-        <b>Station Name:</b> {station['name']}<br>
-        <b>Street Address:</b> {station['street_address']}<br>
-        <b>City:</b> {station['city']}<br>
-        <b>State:</b> {station['state']}<br>
-        <b>ZIP Code:</b> {station['zip']}
-        """
-        iframe = folium.IFrame(html=popup_text, width=300, height=200)
-        popup = folium.Popup(iframe, max_width=500)
-        folium.Marker(
-            location=[station['latitude'], station['longitude']],
-            popup=popup
-        ).add_to(marker_cluster)
-    return updated_map
-
-@app.callback(
+    with stage('click.map_build'):
+        updated_map = folium.Map(location=[lat, lon], zoom_start=5)
+        station_layer(stations).add_to(updated_map)
+        return updated_map
+
+# Clicks are rounded to CLICK_DECIMALS (about 100 m) so nearby clicks share one rendered result.
+# With background callbacks each click runs in a forked job whose copy of the cache is thrown
+# away, and the manager memoizes the job's result per rounded click instead; so the
+# in-process cache only keeps results when the callbacks run inline
+CLICK_DECIMALS = 3
+click_cache = LRUCache(maxsize=int(os.environ.get('CLICK_CACHE_SIZE', '256')) if callback_manager is None else 0)
+if callback_manager is None:
+    watch_cache('click', click_cache)
+
+# Function to round a click to its cache key
+def quantize_click(lat, lon, radius):
+    return round(float(lat), CLICK_DECIMALS), round(float(lon), CLICK_DECIMALS), float(radius)
+
+# Function to render the radius map HTML for a click, in memory and cached per rounded click
+def render_radius_map(lat, lon, radius=0.5):  # radius in miles
+    lat, lon, radius = quantize_click(lat, lon, radius)
+
+    def render():
+        updated_map = update_stations_in_radius(lat, lon, radius)
+        with stage('click.map_html'):
+            return updated_map.get_root().render()
+    return click_cache.get_or_create(('map', lat, lon, radius), render)
+
+# Function to build the neighbor graphs figure and statistics for a click, cached per rounded click
+def render_graphs(lat, lon, radius=0.5):  # radius in kilometers
+    lat, lon, radius = quantize_click(lat, lon, radius)
+    return click_cache.get_or_create(('graphs', lat, lon, radius), lambda: generate_graphs(lat, lon, ev_data, radius))
+
+# A newer click terminates the job of the click it replaces
+@slow_callback(
+    app, callback_manager,
     Output('graph-output', 'children'),
-    [Input('map_click_data', 'value')]
+    [Input('map_click_data', 'value')],
+    progress=Output('graph-progress', 'children'),
+    running=[(Output('graph-progress', 'style'), {'margin-top': '20px', 'display': 'block'},
+              {'margin-top': '20px', 'display': 'none'})]
 )
-def update_graphs(click_data):
+def update_graphs(set_progress, click_data):
     if click_data:
         click_data = json.loads(click_data)
         lat = click_data['lat']
         lon = click_data['lon']
-        print(f"Received click at latitude: {lat}, longitude: {lon}")  # Debugging line
-        graph_html = generate_graphs(lat, lon, ev_data)
-        updated_map = update_stations_in_radius(lat, lon, radius=0.5)
-        updated_map.save('updated_ev_map.html')
-        with open('updated_ev_map.html', 'r') as file:
-            updated_ev_map_html = file.read()
-        encoded_updated_map = base64.b64encode(updated_ev_map_html.encode()).decode()
+        set_progress('Building neighbor graphs for nearby stations...')
+        graph_fig, graph_stats = render_graphs(lat, lon)
+        set_progress('Rendering the map of stations within 0.5 miles...')
+        updated_ev_map_html = render_radius_map(lat, lon, radius=0.5)
         return html.Div([
-            html.Iframe(srcDoc=graph_html, width='100%', height='600'),
-            html.Iframe(srcDoc=base64.b64decode(encoded_updated_map).decode(), width='100%', height='600')
+            dcc.Graph(figure=graph_fig),
+            html.P(graph_summary(graph_stats)),
+            html.Iframe(srcDoc=updated_ev_map_html, width='100%', height='600')
         ])
     return 'Click on the map to generate graphs.'
 
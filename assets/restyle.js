@@ -0,0 +1,17 @@
+// Clientside callbacks that recolor map layers inside folium iframes without reloading them
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    maps: {
+        restyleChoropleth: function(frame, iframeId) {
+            if (!frame) {
+                return window.dash_clientside.no_update;
+            }
+            // Keep the latest frame on the parent page so an iframe that is still loading picks it up
+            window.latestChoroplethFrame = frame;
+            var iframe = document.getElementById(iframeId);
+            if (iframe && iframe.contentWindow && iframe.contentWindow.restyleChoropleth) {
+                iframe.contentWindow.restyleChoropleth(frame);
+            }
+            return frame.caption;
+        }
+    }
+});
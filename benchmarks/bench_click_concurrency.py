@@ -0,0 +1,121 @@
+# Benchmark: many simultaneous map clicks against app.py's click rendering
+#
+# Renders a set of distinct clicks serially as a reference, then replays every click
+# several times from a thread pool and checks that each response is the map for its own
+# click (same centre, same stations) rather than another user's. The original
+# save-to-updated_ev_map.html / read-back path is replayed the same way for comparison.
+# The exit status is 1 if any in-memory response was another click's map or a nearby click
+# missed the cache; the shared file path's wrong maps are only reported.
+#
+# This calls render_radius_map in-process, the way the click callback runs with
+# BACKGROUND_CALLBACKS=0, so app.py is imported with that setting (unless it is set).
+# With background callbacks on (the default) each click is rendered in a forked job and
+# app.py keeps no click_cache; finished jobs are memoized on disk instead (see
+# elec_transit_y/background.py).
+#
+# Usage:
+#   python benchmarks/bench_click_concurrency.py [--clicks 40] [--repeat 5] [--workers 16]
+
+import argparse
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('BACKGROUND_CALLBACKS', '0')
+import app
+
+# folium names every element with a random hex id
+ELEMENT_ID = re.compile(r'_[0-9a-f]{32}\b')
+
+
+def normalize(html):
+    return ELEMENT_ID.sub('_ID', html)
+
+
+def sample_clicks(n, seed=0):
+    # Clicks next to real stations so every map has markers to compare
+    rng = random.Random(seed)
+    rows = app.ev_data[['latitude', 'longitude']].dropna().sample(n, random_state=seed)
+    return [(lat + rng.uniform(-0.005, 0.005), lon + rng.uniform(-0.005, 0.005))
+            for lat, lon in rows.itertuples(index=False)]
+
+
+def file_round_trip(lat, lon, path):
+    # The original update_graphs path: every click writes and reads the same file
+    updated_map = app.update_stations_in_radius(lat, lon, radius=0.5)
+    updated_map.save(path)
+    with open(path, 'r') as file:
+        return file.read()
+
+
+def replay(function, clicks, repeat, workers, seed=0):
+    # Submit every click `repeat` times in random order; returns [(click index, html)]
+    jobs = [index for index in range(len(clicks)) for _ in range(repeat)]
+    random.Random(seed).shuffle(jobs)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda index: function(*clicks[index]), jobs))
+    return list(zip(jobs, results))
+
+
+def count_mismatches(results, expected):
+    return sum(normalize(result) != expected[index] for index, result in results)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clicks', type=int, default=40, help='number of distinct clicks')
+    parser.add_argument('--repeat', type=int, default=5, help='times each click is replayed')
+    parser.add_argument('--workers', type=int, default=16, help='concurrent requests')
+    args = parser.parse_args()
+
+    clicks = sample_clicks(args.clicks)
+    total = args.clicks * args.repeat
+
+    app.click_cache.clear()
+    start = time.perf_counter()
+    expected = [normalize(app.render_radius_map(lat, lon)) for lat, lon in clicks]
+    serial_time = time.perf_counter() - start
+    print(f"Serial render of {args.clicks} clicks: {serial_time * 1000:.0f} ms")
+
+    app.click_cache.clear()
+    renders = len(app.click_cache)
+    start = time.perf_counter()
+    results = replay(app.render_radius_map, clicks, args.repeat, args.workers)
+    concurrent_time = time.perf_counter() - start
+    wrong = count_mismatches(results, expected)
+    print(f"In-memory, cached: {total} requests on {args.workers} threads in {concurrent_time * 1000:.0f} ms, "
+          f"{wrong} wrong maps, {len(app.click_cache) - renders} renders")
+
+    # A click a few metres away rounds to the same key and is served from the cache
+    lat, lon = app.quantize_click(*clicks[0], 0.5)[:2]
+    hits = app.click_cache.hits
+    nearby = app.render_radius_map(lat + 0.0001, lon - 0.0001)
+    nearby_hit = app.click_cache.hits > hits and normalize(nearby) == expected[0]
+    print(f"Nearby click served from cache: {nearby_hit}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'updated_ev_map.html')
+        quantized = [app.quantize_click(lat, lon, 0.5)[:2] for lat, lon in clicks]
+        start = time.perf_counter()
+        results = replay(lambda lat, lon: file_round_trip(lat, lon, path), quantized, args.repeat, args.workers)
+        file_time = time.perf_counter() - start
+    print(f"Shared file:       {total} requests on {args.workers} threads in {file_time * 1000:.0f} ms, "
+          f"{count_mismatches(results, expected)} wrong maps")
+
+    failures = []
+    if wrong:
+        failures.append(f"{wrong} in-memory responses were another click's map")
+    if not nearby_hit:
+        failures.append('the nearby click was not served from the cache')
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
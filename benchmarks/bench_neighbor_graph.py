@@ -0,0 +1,94 @@
+# Benchmark: libpysal/networkx/matplotlib/mpld3 neighbour graphs (old app.py path) vs.
+# elec_transit_y.neighbor_graph for the stations around one click
+#
+# Usage:
+#   python benchmarks/bench_neighbor_graph.py [--stations 100,400] [--repeat 3]
+
+import argparse
+import os
+import sys
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import mpld3
+import networkx as nx
+import numpy as np
+import plotly.io as pio
+from libpysal import weights
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from elec_transit_y.neighbor_graph import NeighborGraph, graph_figure, project_local
+
+# A click in Midtown Manhattan
+CENTER = (40.754, -73.984)
+
+
+def synthetic_click(n, seed=0):
+    # Stations within ~500 m of the click, with some exact duplicates (chargers at one site)
+    rng = np.random.default_rng(seed)
+    lat = CENTER[0] + rng.normal(0, 0.002, n)
+    lon = CENTER[1] + rng.normal(0, 0.0027, n)
+    duplicates = rng.integers(0, n, n // 20)
+    lat[duplicates[1:]] = lat[duplicates[:-1]]
+    lon[duplicates[1:]] = lon[duplicates[:-1]]
+    return lat, lon
+
+
+def libpysal_graphs(lat, lon):
+    # The original app.py implementation, on projected coordinates so the 50 m band is in metres
+    coordinates = project_local(lat, lon, *CENTER)
+    knn_graph = weights.KNN.from_array(coordinates, k=3, silence_warnings=True).to_networkx()
+    dist_graph = weights.DistanceBand.from_array(coordinates, threshold=50, silence_warnings=True).to_networkx()
+    fig, ax = plt.subplots(1, 2, figsize=(10, 5))
+    positions = dict(zip(knn_graph.nodes, coordinates))
+    nx.draw(knn_graph, positions, ax=ax[0], node_color='blue', node_size=50, with_labels=True)
+    nx.draw(dist_graph, positions, ax=ax[1], node_color='red', node_size=50, with_labels=True)
+    plt.tight_layout()
+    graph_html = mpld3.fig_to_html(fig)
+    plt.close(fig)
+    return knn_graph, dist_graph, graph_html
+
+
+def kdtree_graphs(lat, lon):
+    graph = NeighborGraph(lat, lon, CENTER, k=3, threshold=50)
+    return graph, graph.stats(), pio.to_json(graph_figure(graph), validate=False)
+
+
+def edge_set(edges):
+    return {tuple(sorted(edge)) for edge in np.asarray(edges).tolist()}
+
+
+def best_of(repeat, function, *args):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stations', default='100,400', help='comma-separated station counts per click')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per method (best is reported)')
+    args = parser.parse_args()
+
+    for n in [int(value) for value in args.stations.split(',')]:
+        lat, lon = synthetic_click(n)
+        new_time, (graph, stats, payload) = best_of(args.repeat, kdtree_graphs, lat, lon)
+        old_time, (knn_graph, dist_graph, graph_html) = best_of(1, libpysal_graphs, lat, lon)
+
+        # libpysal's sparse weights drop pairs at distance 0 (duplicate coordinates), and its
+        # KNN graph is directed; otherwise the distance bands must match
+        band_match = edge_set(graph.band[graph.band_distances > 0]) == edge_set(dist_graph.edges)
+        print(f"{n:6d} stations: libpysal+mpld3 {old_time * 1000:9.1f} ms ({len(graph_html) / 1e6:.1f} MB), "
+              f"KD-tree+Plotly {new_time * 1000:7.1f} ms ({len(payload) / 1e6:.2f} MB), "
+              f"{old_time / new_time:6.0f}x; band edges match: {band_match}; "
+              f"KNN edges {len(graph.knn)} vs {knn_graph.to_undirected().number_of_edges()}; "
+              f"band components {stats['band']['components']} vs {nx.number_connected_components(dist_graph)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# Benchmark: per-row geodesic filter (old app.py path) vs. StationIndex radius/knn queries
+#
+# Usage:
+#   python benchmarks/bench_spatial_index.py [--stations data/ev_stations_v1.csv] [--n 60000] [--clicks 5]
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from geopy.distance import geodesic
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from elec_transit_y.spatial_index import StationIndex, GEODESIC_TOLERANCE
+
+
+def synthetic_stations(n, seed=0):
+    # Roughly continental-US bounding box, with a dense cluster around NYC
+    rng = np.random.default_rng(seed)
+    lat = rng.uniform(25, 49, n)
+    lon = rng.uniform(-124, -67, n)
+    dense = n // 10
+    lat[:dense] = rng.normal(40.75, 0.05, dense)
+    lon[:dense] = rng.normal(-73.98, 0.05, dense)
+    return pd.DataFrame({'latitude': lat, 'longitude': lon})
+
+
+def geodesic_filter(ev_data, lat, lon, radius_km):
+    # The original app.py implementation
+    mask = ev_data.apply(lambda row: geodesic((lat, lon), (row['latitude'], row['longitude'])).km <= radius_km, axis=1)
+    return np.flatnonzero(mask.to_numpy())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stations', help='CSV with latitude/longitude columns (synthetic data if omitted)')
+    parser.add_argument('--n', type=int, default=60000, help='number of synthetic stations')
+    parser.add_argument('--clicks', type=int, default=5, help='number of simulated map clicks')
+    parser.add_argument('--radius', type=float, default=0.5, help='radius in km')
+    args = parser.parse_args()
+
+    if args.stations:
+        ev_data = pd.read_csv(args.stations, usecols=['latitude', 'longitude']).dropna()
+    else:
+        ev_data = synthetic_stations(args.n)
+    print(f"Stations: {len(ev_data)}")
+
+    start = time.perf_counter()
+    index = StationIndex(ev_data['latitude'], ev_data['longitude'])
+    print(f"Index build: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    rng = np.random.default_rng(1)
+    clicks = ev_data.sample(args.clicks, random_state=1).to_numpy() + rng.normal(0, 0.002, (args.clicks, 2))
+
+    old_times, new_times, knn_times = [], [], []
+    mismatches = 0
+    for lat, lon in clicks:
+        start = time.perf_counter()
+        expected = geodesic_filter(ev_data, lat, lon, args.radius)
+        old_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        positions, _ = index.query_radius(lat, lon, args.radius)
+        new_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        index.query_knn(lat, lon, 10)
+        knn_times.append(time.perf_counter() - start)
+
+        # Any disagreement must come from stations inside the spherical/ellipsoidal tolerance band
+        for pos in set(expected).symmetric_difference(positions):
+            row = ev_data.iloc[pos]
+            distance = geodesic((lat, lon), (row['latitude'], row['longitude'])).km
+            assert abs(distance - args.radius) <= args.radius * GEODESIC_TOLERANCE, (pos, distance)
+            mismatches += 1
+
+    print(f"Geodesic filter: {np.mean(old_times) * 1000:10.2f} ms/click")
+    print(f"Index radius:    {np.mean(new_times) * 1000:10.3f} ms/click")
+    print(f"Index 10-NN:     {np.mean(knn_times) * 1000:10.3f} ms/click")
+    print(f"Speedup:         {np.mean(old_times) / np.mean(new_times):10.0f}x")
+    print(f"Boundary mismatches (within {GEODESIC_TOLERANCE:.1%} tolerance): {mismatches}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# Benchmark: geopandas sjoin vs. elec_transit_y.assign for point-in-zone assignment
+#
+# Assigns synthetic points spread over the taxi zones' bounding box to taxi zones and
+# census tracts with a geopandas sjoin (what notebooks/Taxi_Zone_EV_Merge.ipynb does) and
+# with the prepared STRtree lookups of StationAssigner, checks both give the same ids,
+# then times an incremental update where 1% of the points moved.
+#
+# Usage:
+#   python benchmarks/bench_station_assign.py [--points 1000000] [--repeat 3]
+
+import argparse
+import os
+import sys
+import time
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from elec_transit_y import bundle
+from elec_transit_y.assign import STATION_ASSIGNMENTS, StationAssigner
+
+
+def sjoin_ids(points, layer, id_column):
+    # Reference: sjoin, keeping the first polygon for points on a shared edge
+    layer = layer.to_crs(points.crs).reset_index(drop=True)
+    joined = gpd.sjoin(points, layer[[id_column, 'geometry']], how='left', predicate='intersects')
+    joined = joined.reset_index().sort_values(['index', 'index_right']).drop_duplicates('index')
+    return joined[id_column].to_numpy()
+
+
+def sjoin_assign(stations, layers):
+    points = gpd.GeoDataFrame(geometry=gpd.points_from_xy(stations['longitude'], stations['latitude']),
+                              crs='EPSG:4326')
+    return {column: sjoin_ids(points, layers[layer], id_column)
+            for column, (layer, id_column) in STATION_ASSIGNMENTS.items()}
+
+
+def best_of(repeat, function, *args, **kwargs):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--points', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    layers = {'taxi_zones': bundle.load('taxi_zones'), 'census_tracts': bundle.load('census_tracts')}
+    min_lon, min_lat, max_lon, max_lat = layers['taxi_zones'].to_crs('EPSG:4326').total_bounds
+    rng = np.random.default_rng(0)
+    stations = pd.DataFrame({
+        'id': np.arange(args.points),
+        'latitude': rng.uniform(min_lat, max_lat, args.points),
+        'longitude': rng.uniform(min_lon, max_lon, args.points)
+    })
+
+    sjoin_time, expected = best_of(1, sjoin_assign, stations, layers)
+    index_time, assigner = best_of(args.repeat, StationAssigner, layers['taxi_zones'], layers['census_tracts'])
+    assign_time, (assigned, _) = best_of(args.repeat, assigner.assign, stations)
+    for column in STATION_ASSIGNMENTS:
+        ours = assigned[column].astype(object).where(assigned[column].notna(), None).to_numpy()
+        theirs = pd.Series(expected[column], dtype=object)
+        theirs = theirs.where(theirs.notna(), None).to_numpy()
+        mismatches = sum(a != b for a, b in zip(ours, theirs))
+        print(f"{column}: {assigned[column].notna().sum()} points assigned, {mismatches} differ from sjoin")
+
+    moved = stations.copy()
+    changed = rng.choice(args.points, args.points // 100, replace=False)
+    moved.loc[changed, 'latitude'] += 0.001
+    previous = assigned[['id', 'latitude', 'longitude'] + list(STATION_ASSIGNMENTS)]
+    update_time, (_, looked_up) = best_of(args.repeat, assigner.assign, moved, previous)
+
+    print(f"geopandas sjoin (both layers):    {sjoin_time:8.2f} s")
+    print(f"build STRtree indexes:            {index_time:8.2f} s")
+    print(f"StationAssigner.assign:           {assign_time:8.2f} s  ({sjoin_time / assign_time:.1f}x faster)")
+    print(f"incremental, {looked_up} moved:     {update_time:8.2f} s")
@@ -0,0 +1,165 @@
+# Benchmark: pandas chunked groupby vs. elec_transit_y.taxi_aggregate on synthetic trip files
+#
+# Generates yellow-taxi-schema CSV files (all 18 columns of the 2019 files, so the reader
+# has to skip the columns it does not need) totalling --rows trips, about BAD_SHARE of
+# them with an empty or malformed pickup datetime, then builds the
+# pickup/dropoff by hour and zone tables with a chunked pandas groupby and with the
+# streaming aggregation, checks the tables are identical (so both skip the same bad rows)
+# and reports time and peak memory of each in a fresh process.
+#
+# Usage:
+#   python benchmarks/bench_taxi_aggregate.py [--rows 20000000] [--files 4] [--workers 4] [--dir /tmp/trips]
+
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from elec_transit_y import taxi_aggregate
+
+YEAR_START = np.datetime64('2019-01-01T00:00:00', 's')
+YEAR_SECONDS = 365 * 24 * 3600
+CHUNK = 1_000_000
+# Share of trips with a bad pickup datetime, and the bad values besides an empty field
+BAD_SHARE = 0.001
+MALFORMED = ['N/A', '2019-01-01', '2019-01-01 xx:15:00', '2019-0x-01 10:15:00', '01/01/2019 10:15:00 AM']
+
+
+def bad_datetimes(rng, pickup):
+    # Formatted pickup datetimes with BAD_SHARE of them empty or malformed
+    text = pc.strftime(pa.array(pickup), format='%Y-%m-%d %H:%M:%S')
+    rows = len(pickup)
+    bad = rng.random(rows) < BAD_SHARE
+    choice = rng.integers(0, len(MALFORMED) + 1, rows)
+    values = np.array(MALFORMED + [None], dtype=object)[choice]
+    return pc.if_else(pa.array(bad), pa.array(values, pa.string()), text)
+
+
+def trips_chunk(rng, rows):
+    # Yellow 2019 schema with plausible values; zones skewed like the real pickups
+    pickup = YEAR_START + rng.integers(0, YEAR_SECONDS, rows).astype('timedelta64[s]')
+    dropoff = pickup + rng.integers(60, 3600, rows).astype('timedelta64[s]')
+    zones = np.minimum(rng.zipf(1.3, (2, rows)), 265).astype(np.int32)
+    distance = np.round(rng.exponential(3, rows), 2)
+    fare = np.round(2.5 + distance * 2.5, 2)
+    return pa.table({
+        'VendorID': rng.integers(1, 3, rows).astype(np.int8),
+        'tpep_pickup_datetime': bad_datetimes(rng, pickup),
+        'tpep_dropoff_datetime': dropoff,
+        'passenger_count': rng.integers(1, 7, rows).astype(np.int8),
+        'trip_distance': distance,
+        'RatecodeID': np.ones(rows, dtype=np.int8),
+        'store_and_fwd_flag': np.full(rows, 'N'),
+        'PULocationID': zones[0],
+        'DOLocationID': zones[1],
+        'payment_type': rng.integers(1, 5, rows).astype(np.int8),
+        'fare_amount': fare,
+        'extra': np.full(rows, 0.5),
+        'mta_tax': np.full(rows, 0.5),
+        'tip_amount': np.round(fare * 0.15, 2),
+        'tolls_amount': np.zeros(rows),
+        'improvement_surcharge': np.full(rows, 0.3),
+        'total_amount': np.round(fare * 1.15 + 1.3, 2),
+        'congestion_surcharge': np.full(rows, 2.5)
+    })
+
+
+def generate(directory, rows, files, seed=0):
+    rng = np.random.default_rng(seed)
+    paths = []
+    for number in range(files):
+        path = os.path.join(directory, f'yellow_tripdata_synthetic_bad_{number:02d}.csv')
+        paths.append(path)
+        if os.path.exists(path):
+            continue
+        remaining = rows // files + (number < rows % files)
+        with pa_csv.CSVWriter(path + '.tmp', trips_chunk(rng, 1).schema,
+                              write_options=pa_csv.WriteOptions(quoting_style='none')) as writer:
+            while remaining > 0:
+                writer.write_table(trips_chunk(rng, min(CHUNK, remaining)))
+                remaining -= CHUNK
+        os.replace(path + '.tmp', path)
+    return paths
+
+
+def pandas_tables(paths):
+    # Reference: what the Spark queries compute, with pandas reading one chunk at a time;
+    # trips whose pickup datetime does not parse are left out
+    pickups, dropoffs = [], []
+    for path in paths:
+        for chunk in pd.read_csv(path, usecols=['tpep_pickup_datetime', 'PULocationID', 'DOLocationID'],
+                                 chunksize=CHUNK):
+            pickup = pd.to_datetime(chunk['tpep_pickup_datetime'], format='%Y-%m-%d %H:%M:%S', errors='coerce')
+            chunk = chunk[pickup.notna()]
+            hour = pickup[pickup.notna()].dt.hour.rename('hour_of_day')
+            pickups.append(chunk.groupby([hour, 'PULocationID']).size())
+            dropoffs.append(chunk.groupby([hour, 'DOLocationID']).size())
+    tables = []
+    for parts, location, count in [(pickups, 'PULocationID', 'pickup_count'),
+                                   (dropoffs, 'DOLocationID', 'dropoff_count')]:
+        table = pd.concat(parts).groupby(level=[0, 1]).sum().rename(count).reset_index()
+        table['_location'] = table[location].astype(str)
+        tables.append(table.sort_values(['hour_of_day', '_location']).drop(columns='_location')
+                      .reset_index(drop=True))
+    return tables
+
+
+def streaming_tables(paths, workers):
+    result = taxi_aggregate.aggregate_files(paths, workers=workers, verbose=False)
+    return [taxi_aggregate.counts_table(result['pickups'], 'PULocationID', 'pickup_count'),
+            taxi_aggregate.counts_table(result['dropoffs'], 'DOLocationID', 'dropoff_count')]
+
+
+def _measure(queue, function, args):
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+    # Peak resident memory of this process and of its largest worker, in MB (Linux: KB)
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+    queue.put((elapsed, peak, result))
+
+
+def measured(function, *args):
+    # Run in a fresh process so each method's peak memory is its own
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_measure, args=(queue, function, args))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=20_000_000)
+    parser.add_argument('--files', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--dir', default=os.path.join('/tmp', 'elec_transit_y_trips'))
+    args = parser.parse_args()
+
+    os.makedirs(args.dir, exist_ok=True)
+    start = time.perf_counter()
+    paths = generate(args.dir, args.rows, args.files)
+    size = sum(os.path.getsize(path) for path in paths) / 1e9
+    print(f"{args.rows} trips in {len(paths)} files, {size:.2f} GB ({time.perf_counter() - start:.0f} s to generate)")
+
+    pandas_time, pandas_peak, expected = measured(pandas_tables, paths)
+    streaming_time, streaming_peak, tables = measured(streaming_tables, paths, args.workers)
+    for table, reference in zip(tables, expected):
+        pd.testing.assert_frame_equal(table, reference, check_dtype=False)
+
+    print(f"pandas chunked groupby: {pandas_time:7.1f} s  peak {pandas_peak:7.0f} MB")
+    print(f"streaming aggregation:  {streaming_time:7.1f} s  peak {streaming_peak:7.0f} MB  "
+          f"({pandas_time / streaming_time:.1f}x faster, {size / streaming_time:.2f} GB/s)")
+    print(f"Identical tables: {len(tables[0])} pickup rows, {len(tables[1])} dropoff rows")
+    print(f"Trips skipped for a bad datetime: {args.rows - int(tables[0]['pickup_count'].sum())}")
@@ -0,0 +1,101 @@
+# Benchmark: string CTLabel/borough key join (old nyc_app.py path) vs. integer GEOID join
+#
+# Generates a national-scale set of synthetic tracts and census population rows
+# (a few of each left unmatched) and times both joins.
+#
+# Usage:
+#   python benchmarks/bench_tract_join.py [--tracts 85000] [--repeat 3]
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from elec_transit_y.tracts import join_tracts
+
+
+def synthetic_tracts(n, seed=0):
+    # Tracts spread over 56 state codes and up to 200 counties each; tract codes are
+    # 6 digits with an optional 2-digit suffix, as in real CT labels (e.g. 9202 -> "92.02")
+    rng = np.random.default_rng(seed)
+    state = rng.integers(1, 57, n)
+    county = rng.integers(1, 200, n) * 2 - 1
+    tract = rng.integers(100, 999900, n)
+    tracts = pd.DataFrame({'state': state, 'county': county, 'tract': tract}).drop_duplicates()
+    tracts['GEOID'] = (tracts['state'].map('{:02d}'.format) + tracts['county'].map('{:03d}'.format)
+                       + tracts['tract'].map('{:06d}'.format))
+    label = tracts['tract'] / 100
+    tracts['CTLabel'] = np.where(tracts['tract'] % 100 == 0, (tracts['tract'] // 100).astype(str), label.astype(str))
+    tracts['CountyCode'] = tracts['county'].astype(str)
+
+    population = tracts[['state', 'county', 'tract', 'CTLabel']].copy()
+    population['P1_001N'] = rng.integers(0, 10000, len(population))
+    population['NAME'] = ('Census Tract ' + population['CTLabel'] + ', County ' + population['county'].astype(str)
+                          + ', State ' + population['state'].astype(str))
+    population = population.drop(columns='CTLabel')
+
+    # Leave ~0.5% of each side without a partner
+    drop = len(tracts) // 200
+    tracts = tracts.drop(columns=['state', 'county', 'tract']).iloc[drop:].reset_index(drop=True)
+    population = population.iloc[:len(population) - drop].sample(frac=1, random_state=seed).reset_index(drop=True)
+    return tracts, population
+
+
+def string_key_join(gdf, pop_df):
+    # The original nyc_app.py implementation, with the county code standing in for BoroCode
+    gdf = gdf.copy()
+    pop_df = pop_df.copy()
+    gdf['CTLabel'] = gdf['CTLabel'].astype(str)
+    gdf['CTLabel'] = gdf['CTLabel'].apply(lambda x: f"{float(x):.2f}")
+    gdf['Key'] = gdf['CTLabel'] + '-' + gdf['CountyCode']
+
+    pop_df[['CTLabel', 'County', 'StateName']] = pop_df['NAME'].str.split(',', expand=True)
+    pop_df['CountyCode'] = pop_df['County'].str.strip().str.replace('County ', '')
+    pop_df['CTLabelNumeric'] = pop_df['CTLabel'].str.extract(r'(\d+\.\d+|\d+)')
+    pop_df['CTLabelNumeric'] = pd.to_numeric(pop_df['CTLabelNumeric'])
+    pop_df['CTLabelNumeric'] = pop_df['CTLabelNumeric'].apply(lambda x: f"{x:.2f}")
+    pop_df['Key'] = pop_df['CTLabelNumeric'] + '-' + pop_df['CountyCode']
+    return gdf.merge(pop_df, on='Key', how='inner')
+
+
+def best_of(repeat, function, *args):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tracts', type=int, default=85000, help='number of synthetic tracts')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per method (best is reported)')
+    args = parser.parse_args()
+
+    tracts, population = synthetic_tracts(args.tracts)
+    print(f"Tracts: {len(tracts)}, population rows: {len(population)}")
+
+    old_time, old = best_of(args.repeat, string_key_join, tracts, population)
+    new_time, (new, report) = best_of(args.repeat, lambda t, p: join_tracts(t, p, verbose=False), tracts, population)
+
+    print(f"String key join: {old_time * 1000:10.1f} ms, {len(old)} rows")
+    print(f"GEOID join:      {new_time * 1000:10.1f} ms, {len(new)} rows")
+    print(f"Speedup:         {old_time / new_time:10.1f}x")
+    print(f"Unmatched: {len(report['unmatched_tracts'])} tracts, {len(report['unmatched_rows'])} population rows")
+
+    # The string key ignores the state, so it also pairs tracts with population rows of
+    # other states; on the correctly paired rows both joins must agree
+    same_state = old['GEOID'].str[:2] == old['StateName'].str.replace('State', '').str.strip().str.zfill(2)
+    expected = old[same_state].set_index('GEOID')['P1_001N']
+    actual = new.set_index('GEOID')['P1_001N'].reindex(expected.index)
+    print(f"String key pairs across states: {int((~same_state).sum())}")
+    print(f"Population mismatches on correct pairs: {int((actual != expected).sum())}")
+
+
+if __name__ == '__main__':
+    main()
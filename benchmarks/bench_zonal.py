@@ -0,0 +1,69 @@
+# Benchmark: tiled zonal statistics of census tract population density over taxi zones
+# across process counts
+#
+# Rasterizes the bundled census tracts and taxi zones at the given resolution once, then
+# times zonal_stats() with 1, 2, 4, ... workers and checks every run is bit-identical to
+# the serial one and to a single bincount over the whole raster.
+#
+# Usage:
+#   python benchmarks/bench_zonal.py [--resolution 5] [--tile-size 1024] [--workers 1,2,4,8]
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from elec_transit_y import bundle
+from elec_transit_y.zonal import RasterGrid, rasterize_layer, zonal_stats, zone_raster
+
+
+def whole_raster_sums(value_path, zone_path, n_zones):
+    # Reference: the whole raster in memory, one bincount
+    values = np.load(value_path).astype(np.float64)
+    zones = np.load(zone_path).astype(np.intp)
+    valid = np.isfinite(values) & (zones > 0)
+    return np.bincount(zones[valid], weights=values[valid], minlength=n_zones + 1)[1:]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--resolution', type=float, default=5.0, help='pixel size in metres')
+    parser.add_argument('--tile-size', type=int, default=1024)
+    parser.add_argument('--workers', default='1,2,4,8', help='comma-separated process counts')
+    args = parser.parse_args()
+
+    zones = bundle.load('taxi_zones')
+    tracts = bundle.load('census_tracts')
+    grid = RasterGrid.covering(zones, args.resolution)
+    print(f"Grid: {grid.height} x {grid.width} pixels ({grid.height * grid.width / 1e6:.0f}M), "
+          f"{len(grid.windows(args.tile_size))} tiles, {os.cpu_count()} CPUs")
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        value_path = rasterize_layer(tracts, tracts['Population_Density'].to_numpy(dtype=float), grid,
+                                     os.path.join(directory, 'population_density.npy'), tile_size=args.tile_size)
+        zone_path = zone_raster(zones, grid, os.path.join(directory, 'zones.npy'), tile_size=args.tile_size)
+        print(f"Rasterize: {time.perf_counter() - start:8.2f} s")
+
+        serial = None
+        for workers in [int(value) for value in args.workers.split(',')]:
+            start = time.perf_counter()
+            stats = zonal_stats(value_path, zone_path, len(zones), args.tile_size, workers)
+            elapsed = time.perf_counter() - start
+            if serial is None:
+                serial, serial_time = stats, elapsed
+            identical = all(np.array_equal(stats[key], serial[key], equal_nan=True) for key in stats)
+            print(f"{workers:3d} workers: {elapsed:8.2f} s, speedup {serial_time / elapsed:5.2f}x, "
+                  f"identical to serial: {identical}")
+
+        reference = whole_raster_sums(value_path, zone_path, len(zones))
+        print(f"Max relative difference from a whole-raster bincount: "
+              f"{np.max(np.abs(reference - serial['sum']) / np.maximum(np.abs(reference), 1)):.2e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+# Round-trip check of the hand-written MVT encoder in elec_transit_y/tiles.py against
+# mapbox-vector-tile's reference decoder
+#
+# Features are placed at whole tile coordinates of one tile, so the decoded geometry
+# must come back exactly:
+#   - points, with their ids and properties of every value type (string, negative and
+#     positive integers, floats, booleans, missing values); points on the same tile
+#     coordinate are drawn once
+#   - a point inside the tile buffer left of the tile, whose x is negative (zigzag
+#     encoding), while a point beyond the buffer is left out
+#   - each distinct property value stored once in the layer's value table
+#   - no properties below the layer's properties_min_zoom
+#   - a polygon with a hole crossing the tile edge, clipped at the edge of the buffer,
+#     with the exterior ring clockwise and the hole counter-clockwise
+#   - a two-part multipolygon, whose second part starts from the cursor of the first
+#   - an empty tile, and the gzipped tile served by TileSource
+# The exit status is 1 if any check failed, so the script can gate CI.
+#
+# Usage:
+#   python benchmarks/check_tiles.py
+
+import gzip
+import os
+import sys
+
+import geopandas as gpd
+import mapbox_vector_tile
+import numpy as np
+import pandas as pd
+import shapely
+from mapbox_vector_tile.Mapbox import vector_tile_pb2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from elec_transit_y.tiles import BUFFER, EXTENT, TileLayer, TileSource, tile_bounds
+
+TILE = (10, 301, 384)
+
+
+def to_mercator(geometry, tile=TILE):
+    '''
+    Place a geometry drawn in tile coordinates (y pointing down) in web mercator.
+    '''
+    minx, miny, maxx, maxy = tile_bounds(*tile)
+    scale = EXTENT / (maxx - minx)
+    return shapely.transform(geometry, lambda coords: np.column_stack(
+        [minx + coords[:, 0] / scale, maxy - coords[:, 1] / scale]))
+
+
+def layer(geometries, name, columns=None, **kwargs):
+    frame = pd.DataFrame(columns or {})
+    gdf = gpd.GeoDataFrame(frame, geometry=[to_mercator(geometry) for geometry in geometries], crs='EPSG:3857')
+    return TileLayer(gdf, name, list(frame.columns), **kwargs)
+
+
+def decode(data, name):
+    '''
+    Returns: list of decoded features of a layer, in tile coordinates
+    '''
+    tile = mapbox_vector_tile.decode(data, default_options={'y_coord_down': True})
+    return tile[name]['features'] if name in tile else []
+
+
+def ring_area(coords):
+    # Shoelace area in tile coordinates; positive for a clockwise ring with y pointing down
+    coords = np.asarray(coords)
+    return float(np.sum(coords[:-1, 0] * coords[1:, 1] - coords[1:, 0] * coords[:-1, 1])) / 2
+
+
+def run_checks():
+    '''
+    Encode and decode the test tiles.
+
+    Returns: list of (check description, passed)
+    '''
+    checks = []
+
+    points = layer(
+        [shapely.Point(100, 200), shapely.Point(4000, 50), shapely.Point(-30, 10), shapely.Point(-100, 10),
+         shapely.Point(100, 200)], 'points',
+        {'name': ['a', 'a', 'b', 'c', 'd'], 'count': [-5, 7, 300000, 1, 1],
+         'score': [1.5, None, 2.5, 0.0, 0.0], 'open': [True, False, True, True, True]})
+    data = points.encode(*TILE)
+    features = decode(data, 'points')
+    got = [(feature['id'], feature['geometry']['coordinates']) for feature in features]
+    expected = [(1, [100, 200]), (2, [4000, 50]), (3, [-30, 10])]
+    checks.append((f"points decoded at their tile coordinates, buffer point negative (got {got})", got == expected))
+    got = [feature['properties'] for feature in features]
+    expected = [{'name': 'a', 'count': -5, 'score': 1.5, 'open': True},
+                {'name': 'a', 'count': 7, 'open': False},
+                {'name': 'b', 'count': 300000, 'score': 2.5, 'open': True}]
+    checks.append((f"point properties of every type decoded, missing values left out (got {got})", got == expected))
+
+    message = vector_tile_pb2.tile()
+    message.ParseFromString(data)
+    values = [str(value).strip() for value in message.layers[0].values]
+    checks.append((f"each distinct value stored once (got {len(values)} values)",
+                   len(values) == len(set(values)) == 9))
+    checks.append((f"layer extent and version (got {message.layers[0].extent}, {message.layers[0].version})",
+                   message.layers[0].extent == EXTENT and message.layers[0].version == 2))
+
+    bare = layer([shapely.Point(100, 200)], 'bare', {'name': ['a']}, properties_min_zoom=TILE[0] + 1)
+    got = [feature['properties'] for feature in decode(bare.encode(*TILE), 'bare')]
+    checks.append((f"no properties below properties_min_zoom (got {got})", got == [{}]))
+
+    square = shapely.Polygon([(3000, 1000), (6000, 1000), (6000, 3000), (3000, 3000)],
+                             [[(3500, 1500), (3800, 1500), (3800, 1800), (3500, 1800)]])
+    pair = shapely.MultiPolygon([shapely.box(100, 100, 200, 200), shapely.box(300, 300, 400, 400)])
+    outside = shapely.box(-1000, -1000, -500, -500)
+    polygons = layer([square, pair, outside], 'polygons', {'zone': ['edge', 'pair', 'outside']})
+    features = decode(polygons.encode(*TILE), 'polygons')
+    got = {feature['properties']['zone']: shapely.geometry.shape(feature['geometry']) for feature in features}
+    clipped = shapely.clip_by_rect(square, -BUFFER, -BUFFER, EXTENT + BUFFER, EXTENT + BUFFER)
+    checks.append((f"polygon outside the buffer left out (got {sorted(got)})", sorted(got) == ['edge', 'pair']))
+    checks.append((f"polygon with a hole clipped at the buffer edge (got {got.get('edge')})",
+                   'edge' in got and got['edge'].normalize().equals(clipped.normalize())))
+    checks.append((f"multipolygon parts at their tile coordinates (got {got.get('pair')})",
+                   'pair' in got and got['pair'].normalize().equals(pair.normalize())))
+    rings = [feature['geometry']['coordinates'] for feature in features if feature['properties']['zone'] == 'edge']
+    areas = [ring_area(ring) for ring in rings[0]] if rings else []
+    checks.append((f"exterior ring clockwise, hole counter-clockwise (got areas {areas})",
+                   len(areas) == 2 and areas[0] > 0 > areas[1]))
+
+    checks.append(("tile without features is empty", polygons.encode(TILE[0], TILE[1] + 3, TILE[2]) == b''))
+    source = TileSource([points], mbtiles_dir=None)
+    checks.append(("TileSource serves the gzipped tile", gzip.decompress(source.tile('points', *TILE)) == data))
+    return checks
+
+
+if __name__ == '__main__':
+    checks = run_checks()
+    for description, passed in checks:
+        print(f"{'ok  ' if passed else 'FAIL'} {description}")
+    failed = [description for description, passed in checks if not passed]
+    print(f"{len(failed)} of {len(checks)} checks failed")
+    sys.exit(1 if failed else 0)
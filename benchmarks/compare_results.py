@@ -0,0 +1,99 @@
+# Compare two benchmark suite runs (see benchmarks/run_suite.py) and flag regressions
+#
+# Each argument is a results JSON file or a commit; a commit is looked up as
+# benchmarks/results/<first 12 characters of its hash>.json. Cases present in both runs
+# are compared on their median time (or --stat min), and on peak RSS and payload size
+# where the suite records them. A case is a regression when the new value exceeds the
+# old one by more than --threshold; the exit status is 1 if any case regressed, so the
+# script can gate CI.
+#
+# Usage:
+#   python benchmarks/compare_results.py BASE NEW [--threshold 1.2] [--stat median]
+#   python benchmarks/compare_results.py main HEAD
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# Measurements compared besides the time, with the format of their values
+EXTRA_METRICS = {'peak_rss_mb': '{:.1f} MB', 'payload_bytes': '{:,.0f} B'}
+
+
+def load_run(name):
+    '''
+    Read a run from a results file, or from the results of a commit.
+
+    Returns: dict (the run_suite.py results JSON)
+    '''
+    if not os.path.exists(name):
+        try:
+            commit = subprocess.run(['git', 'rev-parse', name], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            sys.exit(f"{name} is neither a results file nor a commit")
+        name = os.path.join(RESULTS_DIR, f'{commit[:12]}.json')
+        if not os.path.exists(name):
+            sys.exit(f"No results for {commit[:12]}; run benchmarks/run_suite.py on that commit first")
+    with open(name) as file:
+        return json.load(file)
+
+
+def format_seconds(seconds):
+    for unit, factor in [('s', 1), ('ms', 1e-3), ('us', 1e-6)]:
+        if seconds >= factor:
+            break
+    return f'{seconds / factor:.2f} {unit}'
+
+
+def compare(base, new, threshold=1.2, stat='median'):
+    '''
+    Inputs:
+      base, new (dicts): runs read by load_run
+      threshold (float): ratio new / base above which a case regressed
+      stat (string): 'median' or 'min' of the timed calls
+
+    Returns: list of rows (case, base value, new value, ratio, status)
+    '''
+    rows = []
+    for case in sorted(set(base['results']) & set(new['results'])):
+        old_summary, new_summary = base['results'][case], new['results'][case]
+        metrics = [(case, old_summary[stat], new_summary[stat], format_seconds)]
+        metrics += [(f'{case} {metric}', old_summary[metric], new_summary[metric], form.format)
+                    for metric, form in EXTRA_METRICS.items() if metric in old_summary and metric in new_summary]
+        for name, old_value, new_value, form in metrics:
+            ratio = new_value / old_value if old_value else float('inf') if new_value else 1.0
+            status = 'REGRESSION' if ratio > threshold else 'improved' if ratio < 1 / threshold else ''
+            rows.append((name, form(old_value), form(new_value), ratio, status))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('base', help='results file or commit to compare against')
+    parser.add_argument('new', help='results file or commit')
+    parser.add_argument('--threshold', type=float, default=1.2, help='ratio new / base counted as a regression')
+    parser.add_argument('--stat', choices=['median', 'min'], default='median')
+    args = parser.parse_args()
+
+    base, new = load_run(args.base), load_run(args.new)
+    print(f"base: {base['commit'][:12]}{' (dirty)' if base['dirty'] else ''} {base['date']}")
+    print(f"new:  {new['commit'][:12]}{' (dirty)' if new['dirty'] else ''} {new['date']}")
+    for field in ['python', 'platform', 'cpu_count', 'versions']:
+        if base[field] != new[field]:
+            print(f"warning: {field} differs ({base[field]} vs {new[field]})")
+
+    rows = compare(base, new, args.threshold, args.stat)
+    width = max([len(row[0]) for row in rows] + [4])
+    for name, old_value, new_value, ratio, status in rows:
+        print(f"{name:{width}s} {old_value:>14s} {new_value:>14s} {ratio:7.2f}x  {status}")
+    for case in sorted(set(base['results']) ^ set(new['results'])):
+        print(f"{case:{width}s} only in {'base' if case in base['results'] else 'new'}")
+    for case, error in new['errors'].items():
+        print(f"{case:{width}s} failed: {error}")
+
+    regressions = [row[0] for row in rows if row[4] == 'REGRESSION']
+    print(f"{len(regressions)} regression{'s' if len(regressions) != 1 else ''} above {args.threshold:.2f}x")
+    sys.exit(1 if regressions else 0)
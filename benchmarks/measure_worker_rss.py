@@ -0,0 +1,87 @@
+# Measure per-worker memory of a gunicorn deployment with and without preload_app
+#
+# Starts gunicorn (using gunicorn.conf.py) once per mode, waits for every worker to
+# finish loading, and reports RSS, PSS (shared pages split between processes) and
+# USS (pages private to the worker) for each worker.
+#
+# Usage:
+#   python benchmarks/measure_worker_rss.py [--app nyc_app:server] [--workers 4]
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+import psutil
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MB = 1024 * 1024
+
+
+def wait_until_ready(master, workers, port, timeout):
+    # Ready once all workers exist, the app answers, and worker memory has stopped growing
+    deadline = time.time() + timeout
+    previous = None
+    while time.time() < deadline:
+        time.sleep(2)
+        children = master.children()
+        if len(children) < workers:
+            continue
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=60).read()
+        except OSError:
+            continue
+        current = [child.memory_info().rss for child in children]
+        if current == previous:
+            return children
+        previous = current
+    raise TimeoutError('gunicorn workers did not become ready in time')
+
+
+def measure(app, workers, port, preload, timeout):
+    env = dict(os.environ, GUNICORN_WORKERS=str(workers), GUNICORN_BIND=f'127.0.0.1:{port}',
+               GUNICORN_PRELOAD='1' if preload else '0')
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', app],
+                               cwd=repo_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        master = psutil.Process(process.pid)
+        children = wait_until_ready(master, workers, port, timeout)
+        rows = []
+        for child in children:
+            info = child.memory_full_info()
+            rows.append((child.pid, info.rss / MB, info.pss / MB, info.uss / MB))
+        master_info = master.memory_full_info()
+        return rows, master_info.pss / MB
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--app', default='nyc_app:server')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--timeout', type=int, default=600)
+    args = parser.parse_args()
+
+    totals = {}
+    for preload in (False, True):
+        label = 'preload_app' if preload else 'no preload'
+        rows, master_pss = measure(args.app, args.workers, args.port, preload, args.timeout)
+        print(f"\n{label}: {args.workers} workers running {args.app}")
+        print(f"{'pid':>8} {'RSS MB':>10} {'PSS MB':>10} {'USS MB':>10}")
+        for pid, rss, pss, uss in rows:
+            print(f"{pid:>8} {rss:>10.1f} {pss:>10.1f} {uss:>10.1f}")
+        total = sum(row[2] for row in rows) + master_pss
+        totals[label] = total
+        print(f"Total PSS including master: {total:.1f} MB")
+
+    print(f"\nMemory saved by preload_app: {totals['no preload'] - totals['preload_app']:.1f} MB "
+          f"({1 - totals['preload_app'] / totals['no preload']:.0%})")
+
+
+if __name__ == '__main__':
+    main()
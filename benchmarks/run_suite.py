@@ -0,0 +1,441 @@
+# Benchmark suite: the dashboards and data paths on synthetic data at 1x/10x/100x
+#
+# Generates synthetic data at each scale (see benchmarks/synthetic.py) and times:
+#   bundle        building the data bundle from the raw files
+#   app, nyc_app  startup (importing the app module: loading data and rendering the initial
+#                 maps) with its peak RSS, the layout request and each server callback,
+#                 posted through the Flask test client the way the browser posts them.
+#                 Callbacks run inline (BACKGROUND_CALLBACKS=0); .cold is the first call for
+#                 each input and .warm the same inputs again (for nyc_app.update_region, .cold
+#                 loads and prepares the second region of the synthetic regions.json)
+#   query_radius  StationIndex.query_radius for clicks around NYC
+#   census_merge  join_tracts of the tract polygons with the census population table
+#   demand_cube   DemandCube.from_tables and zone_values on the taxi aggregates
+#   ingestion     the NREL Lambda handler against a local HTTP stub of the NREL API and
+#                 moto's in-memory S3 (or S3_ENDPOINT_URL, e.g. MinIO, when set)
+# Every app and the ingestion handler run in a fresh process with the persistent caches
+# (FRAME_CACHE_DIR, DEMAND_CUBE_DIR, ...) unset, so startup is always measured cold.
+#
+# Results are written as JSON, one file per commit, with the timings of every case and
+# the environment they were measured in. Compare two runs with
+# benchmarks/compare_results.py.
+#
+# Usage:
+#   python benchmarks/run_suite.py [--scales 1 10 100] [--groups app nyc_app ...] [--repeat 3]
+#                                  [--output benchmarks/results/<commit>.json] [--env VECTOR_TILES=1]
+
+import argparse
+import contextlib
+import datetime
+import functools
+import importlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+import synthetic
+from elec_transit_y.demand_cube import DemandCube
+from elec_transit_y.spatial_index import KM_PER_MILE, StationIndex
+from elec_transit_y.taxi_aggregate import N_ZONES
+from elec_transit_y.tracts import join_tracts
+
+GROUPS = ['bundle', 'app', 'nyc_app', 'query_radius', 'census_merge', 'demand_cube', 'ingestion']
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, 'results')
+WORK_DIR = os.path.join(tempfile.gettempdir(), 'elec_transit_y_bench')
+
+# Settings that would let a run reuse another run's work
+CACHE_VARIABLES = ['FRAME_CACHE_DIR', 'DEMAND_CUBE_DIR', 'GEOMETRY_CACHE_DIR', 'AREAL_CACHE_DIR',
+                   'TILE_MBTILES_DIR', 'ELEC_TRANSIT_Y_STATION_DATASET']
+
+# Siting options solved by the siting callback, one new combination per cold call
+SITING_OPTIONS = [('hex', 800, 0.5), ('zones', 800, 0.5), ('hex', 400, 0.5), ('hex', 800, 1.0), ('zones', 400, 0.0)]
+
+
+def summarize(times, **extra):
+    '''
+    Returns: dict with the individual times (seconds), their min and median,
+    and any extra measurements (e.g. payload_bytes)
+    '''
+    return dict({'times': [round(t, 9) for t in times], 'min': round(min(times), 9),
+                 'median': round(float(np.median(times)), 9)}, **extra)
+
+
+def format_seconds(seconds):
+    for unit, factor in [('s', 1), ('ms', 1e-3), ('us', 1e-6)]:
+        if seconds >= factor:
+            break
+    return f'{seconds / factor:8.2f} {unit}'
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def repeated(repeat, function, *args):
+    return [timed(function, *args)[0] for _ in range(repeat)]
+
+
+def clicks_near_nyc(n, seed=1):
+    # Map clicks spread over the NYC station cluster, rounded like the app's clicks
+    rng = np.random.default_rng(seed)
+    (lat_min, lat_max), (lon_min, lon_max) = synthetic.NYC_LAT_LON
+    return np.round(np.column_stack([rng.uniform(lat_min, lat_max, n), rng.uniform(lon_min, lon_max, n)]), 3)
+
+
+# Function to post one callback the way the Dash renderer does
+def post_callback(client, outputs, inputs, state=()):
+    '''
+    Inputs:
+      client (flask test client)
+      outputs (list of (component id, property))
+      inputs, state (lists of (component id, property, value)); the first
+        input is reported as the one that changed
+
+    Returns: response body (bytes)
+    '''
+    output_list = [{'id': id_, 'property': prop} for id_, prop in outputs]
+    body = {
+        'output': '..' + '...'.join(f'{id_}.{prop}' for id_, prop in outputs) + '..' if len(outputs) > 1
+                  else f'{outputs[0][0]}.{outputs[0][1]}',
+        'outputs': output_list if len(outputs) > 1 else output_list[0],
+        'inputs': [{'id': id_, 'property': prop, 'value': value} for id_, prop, value in inputs],
+        'state': [{'id': id_, 'property': prop, 'value': value} for id_, prop, value in state],
+        'changedPropIds': [f'{inputs[0][0]}.{inputs[0][1]}']
+    }
+    response = client.post('/_dash-update-component', json=body)
+    if response.status_code not in (200, 204):
+        raise RuntimeError(f"{body['output']} returned {response.status_code}: {response.data[:500]!r}")
+    return response.data
+
+
+def time_calls(results, name, calls, passes=2):
+    # calls is a list of functions returning a response body; the first pass is cold and
+    # the second warm, so caches keyed by the inputs show up as the difference
+    for label in ['.cold', '.warm'] if passes == 2 else ['']:
+        times, size = [], 0
+        for call in calls:
+            seconds, payload = timed(call)
+            times.append(seconds)
+            size = len(payload)
+        results[name + label] = summarize(times, payload_bytes=size)
+
+
+def run_app(module_name, repeat):
+    '''
+    Import an app module and time its startup and callbacks. Runs in the
+    child process started by app_group.
+
+    Returns: dict of case -> summary
+    '''
+    import warnings
+    warnings.simplefilter('ignore')
+    startup, module = timed(importlib.import_module, module_name)
+    results = {f'{module_name}.startup': summarize(
+        [startup], peak_rss_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1))}
+    client = module.server.test_client()
+    layout_calls = [lambda: client.get('/_dash-layout').data] * repeat
+    time_calls(results, f'{module_name}.layout', layout_calls, passes=1)
+
+    if module_name == 'app':
+        clicks = clicks_near_nyc(repeat)
+        time_calls(results, 'app.update_graphs', [
+            functools.partial(post_callback, client, [('graph-output', 'children')],
+                              [('map_click_data', 'value', json.dumps({'lat': lat, 'lon': lon}))])
+            for lat, lon in clicks])
+    else:
+        buttons = [('play-button', 'n_clicks', 0), ('pause-button', 'n_clicks', 0)]
+        time_calls(results, 'nyc_app.toggle_interval', [
+            functools.partial(post_callback, client, [('interval-component', 'disabled')],
+                              buttons)] * repeat, passes=1)
+        map_output = ('pickup-dropoff-frame', 'data') if module.clientside_restyle else ('pickup-dropoff-map', 'srcDoc')
+        time_calls(results, 'nyc_app.update_output', [
+            functools.partial(post_callback, client,
+                              [('hour-slider', 'value'), map_output, ('text-content', 'children')],
+                              [('data-type-dropdown', 'value', module.data_types[call % len(module.data_types)]),
+                               ('hour-slider', 'value', call % 24), ('interval-component', 'n_intervals', 0)],
+                              buttons + [('region-dropdown', 'value', module.DEFAULT_REGION)])
+            for call in range(repeat)])
+        time_calls(results, 'nyc_app.update_siting', [
+            functools.partial(post_callback, client, [('siting-map', 'srcDoc'), ('siting-summary', 'children')],
+                              [('siting-candidates', 'value', candidates), ('siting-radius', 'value', radius),
+                               ('siting-trip-share', 'value', trip_share), ('siting-sites', 'value', 25),
+                               ('region-dropdown', 'value', module.DEFAULT_REGION)])
+            for candidates, radius, trip_share in SITING_OPTIONS[:repeat]])
+        # The region callback is keyed with a hash for its allow_duplicate output
+        region_callback = next(dependency['output'] for dependency in client.get('/_dash-dependencies').json
+                               if dependency['inputs'] == [{'id': 'region-dropdown', 'property': 'value'}])
+        region_outputs = [tuple(output.split('.', 1)) for output in region_callback.strip('.').split('...')]
+        time_calls(results, 'nyc_app.update_region', [
+            functools.partial(post_callback, client, region_outputs, [('region-dropdown', 'value', synthetic.REGION)])])
+    return results
+
+
+class NRELStub(BaseHTTPRequestHandler):
+    '''
+    Serves the stations and last-updated endpoints of the NREL API from a
+    list of station dicts (set as NRELStub.stations).
+    '''
+    stations = []
+    last_updated = '2024-01-01T00:00:00Z'
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def page(cls, offset, limit):
+        return json.dumps({'fuel_stations': cls.stations[offset:offset + limit],
+                           'total_results': len(cls.stations)}).encode()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path.endswith('/last-updated.json'):
+            body = json.dumps({'last_updated': self.last_updated}).encode()
+        else:
+            body = self.page(int(query.get('offset', ['0'])[0]), int(query.get('limit', ['1000'])[0]))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_ingestion(scale, repeat):
+    '''
+    Time the Lambda handler's full and incremental modes for one state against
+    the NREL stub. Runs in the child process started by ingestion_group.
+
+    Returns: dict of case -> summary
+    '''
+    NRELStub.stations = synthetic.nrel_stations(synthetic.BASE_SIZES['ingest_stations'] * scale)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), NRELStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ['NREL_API_URL'] = f'http://127.0.0.1:{server.server_port}/api/alt-fuel-stations/v1.json'
+    sys.path.insert(0, os.path.join(REPO_DIR, 'ev_nrel', 'ingestion', 'lambda'))
+
+    if os.environ.get('S3_ENDPOINT_URL'):
+        s3_context = contextlib.nullcontext()
+    else:
+        from moto import mock_aws
+        for variable in ['AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SESSION_TOKEN']:
+            os.environ[variable] = 'testing'
+        s3_context = mock_aws()
+
+    def handle(event):
+        response = lambda_function.lambda_handler(dict(event, api_key='benchmark'), None)
+        if response['statusCode'] != 200:
+            raise RuntimeError(f"Lambda handler failed: {response['body']}")
+        return response
+
+    with s3_context:
+        import lambda_function
+        results = {'ingestion.full': summarize(repeated(repeat, handle, {'state': 'NY'}),
+                                               stations=len(NRELStub.stations))}
+        # The first incremental sync compares every station with the uploaded partitions;
+        # later ones find the dataset unchanged and skip the state
+        results['ingestion.incremental'] = summarize(repeated(1, handle, {'state': 'NY', 'mode': 'incremental'}))
+        results['ingestion.incremental_unchanged'] = summarize(
+            repeated(repeat, handle, {'state': 'NY', 'mode': 'incremental'}))
+    server.shutdown()
+    return results
+
+
+def child_environment(data_dir, overrides):
+    env = {name: value for name, value in os.environ.items() if name not in CACHE_VARIABLES}
+    env.update({
+        'ELEC_TRANSIT_Y_DATA_DIR': data_dir,
+        'ELEC_TRANSIT_Y_BUNDLE_DIR': os.path.join(data_dir, 'bundle'),
+        'ELEC_TRANSIT_Y_REGIONS_FILE': os.path.join(data_dir, 'regions.json'),
+        'BACKGROUND_CALLBACKS': '0',
+        'PYTHONPATH': os.pathsep.join(filter(None, [REPO_DIR, os.environ.get('PYTHONPATH')]))
+    })
+    env.update(overrides)
+    return env
+
+
+def run_child(args, data_dir, child, scale):
+    # Run one app (or the ingestion handler) in a fresh interpreter
+    with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as file:
+        output = file.name
+    try:
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--child', child, '--scales', str(scale),
+                        '--repeat', str(args.repeat), '--output', output],
+                       cwd=REPO_DIR, env=child_environment(data_dir, args.env), check=True, timeout=args.timeout,
+                       stdout=subprocess.DEVNULL if not args.verbose else None)
+        with open(output) as file:
+            return json.load(file)
+    finally:
+        os.remove(output)
+
+
+def build_bundle(data_dir, env):
+    bundle_dir = os.path.join(data_dir, 'bundle')
+    shutil.rmtree(bundle_dir, ignore_errors=True)
+    subprocess.run([sys.executable, '-m', 'elec_transit_y.bundle', '--data-dir', data_dir, '--bundle-dir', bundle_dir],
+                   cwd=REPO_DIR, env=child_environment(data_dir, env), check=True, stdout=subprocess.DEVNULL)
+
+
+def bundle_group(args, scale, data_dir):
+    seconds, _ = timed(build_bundle, data_dir, args.env)
+    return {'bundle.build': summarize([seconds])}
+
+
+def app_group(args, scale, data_dir):
+    return run_child(args, data_dir, 'app', scale)
+
+
+def nyc_app_group(args, scale, data_dir):
+    return run_child(args, data_dir, 'nyc_app', scale)
+
+
+def ingestion_group(args, scale, data_dir):
+    return run_child(args, data_dir, 'ingestion', scale)
+
+
+def query_radius_group(args, scale, data_dir):
+    stations = synthetic.synthetic_stations(synthetic.BASE_SIZES['stations'] * scale)
+    build_time, index = timed(StationIndex, stations['latitude'], stations['longitude'])
+    clicks = clicks_near_nyc(100)
+
+    def query_all():
+        for lat, lon in clicks:
+            index.query_radius(lat, lon, 0.5 * KM_PER_MILE)
+    # Seconds per query, best of 100 clicks per repeat
+    times = [seconds / len(clicks) for seconds in repeated(args.repeat, query_all)]
+    return {'query_radius.build': summarize([build_time]), 'query_radius.query': summarize(times)}
+
+
+def census_merge_group(args, scale, data_dir):
+    tracts, population = synthetic.synthetic_tracts(synthetic.BASE_SIZES['tracts'] * scale)
+    return {'census_merge.join_tracts': summarize(
+        repeated(args.repeat, lambda: join_tracts(tracts, population, verbose=False)), tracts=len(tracts))}
+
+
+def demand_cube_group(args, scale, data_dir):
+    periods = synthetic.taxi_periods(scale)
+    pickups, dropoffs = synthetic.synthetic_taxi_counts(periods)
+    zones = np.ones(N_ZONES)
+    build_times = repeated(args.repeat, DemandCube.from_tables, pickups, dropoffs, zones, zones * 1000)
+    cube = DemandCube.from_tables(pickups, dropoffs, zones, zones * 1000)
+    selection = {name: 1 for name in periods}
+
+    def slice_all():
+        for hour in range(24):
+            cube.zone_values('pickups_per_station', hour, **selection)
+    return {'demand_cube.from_tables': summarize(build_times, rows=len(pickups) + len(dropoffs)),
+            'demand_cube.zone_values': summarize([seconds / 24 for seconds in repeated(args.repeat, slice_all)])}
+
+
+GROUP_RUNNERS = {
+    'bundle': bundle_group,
+    'app': app_group,
+    'nyc_app': nyc_app_group,
+    'query_radius': query_radius_group,
+    'census_merge': census_merge_group,
+    'demand_cube': demand_cube_group,
+    'ingestion': ingestion_group
+}
+
+
+def git(*args):
+    try:
+        return subprocess.run(['git', *args], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    '''
+    Returns: dict describing the commit, machine and library versions of a run
+    '''
+    versions = {}
+    for package in ['numpy', 'pandas', 'pyarrow', 'shapely', 'geopandas', 'scipy', 'dash', 'folium']:
+        try:
+            versions[package] = importlib.import_module(package).__version__
+        except ImportError:
+            versions[package] = None
+    return {
+        'commit': git('rev-parse', 'HEAD'),
+        'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'versions': versions
+    }
+
+
+def default_output(env):
+    name = (env['commit'] or 'unknown')[:12] + ('-dirty' if env['dirty'] else '')
+    return os.path.join(RESULTS_DIR, f'{name}.json')
+
+
+def run_suite(args):
+    run = dict(environment(), scales=args.scales, repeat=args.repeat, env=args.env, results={}, errors={})
+    for scale in args.scales:
+        data_dir = synthetic.write_data_dir(os.path.join(args.work_dir, f'{scale}x'), scale)
+        if not os.path.exists(os.path.join(data_dir, 'bundle')) and set(args.groups) & {'app', 'nyc_app'}:
+            build_bundle(data_dir, args.env)
+        for group in args.groups:
+            print(f"{group} at {scale}x...", flush=True)
+            try:
+                results = GROUP_RUNNERS[group](args, scale, data_dir)
+            except Exception as error:
+                run['errors'][f'{group}[{scale}x]'] = f'{type(error).__name__}: {error}'
+                print(f"  failed: {error}")
+                continue
+            for case, summary in results.items():
+                run['results'][f'{case}[{scale}x]'] = summary
+                print(f"  {case:40s} {format_seconds(summary['median'])}")
+    return run
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scales', type=int, nargs='+', default=synthetic.SCALES,
+                        help='multiples of the current data sizes')
+    parser.add_argument('--groups', nargs='+', choices=GROUPS, default=GROUPS)
+    parser.add_argument('--repeat', type=int, default=3, help='calls per timed case')
+    parser.add_argument('--output', help='results JSON (default: benchmarks/results/<commit>.json)')
+    parser.add_argument('--work-dir', default=WORK_DIR, help='where the synthetic data is generated')
+    parser.add_argument('--env', nargs='*', default=[], metavar='NAME=VALUE',
+                        help='environment variables for the apps, e.g. VECTOR_TILES=1')
+    parser.add_argument('--timeout', type=float, default=3600, help='seconds allowed per app process')
+    parser.add_argument('--verbose', action='store_true', help="show the apps' own output")
+    parser.add_argument('--child', choices=['app', 'nyc_app', 'ingestion'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.env = dict(setting.split('=', 1) for setting in args.env)
+
+    if args.child:
+        if args.child == 'ingestion':
+            results = run_ingestion(args.scales[0], args.repeat)
+        else:
+            results = run_app(args.child, args.repeat)
+        with open(args.output, 'w') as file:
+            json.dump(results, file)
+        sys.exit()
+
+    run = run_suite(args)
+    output = args.output or default_output(run)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(run, file, indent=1)
+    print(f"Results written to {output}")
@@ -0,0 +1,260 @@
+# Synthetic data for the benchmark suite, at multiples of the current data sizes
+#
+# Writes a data directory in the same layout and formats as data/ (see
+# elec_transit_y/data.py), so the dashboards and the bundle builder run on it unchanged
+# through ELEC_TRANSIT_Y_DATA_DIR:
+#   - ev_stations_v1.csv: BASE_SIZES['stations'] * scale stations, a quarter of them in
+#     NYC and the rest spread over the continental US
+#   - nyct2020_24b/: BASE_SIZES['tracts'] * scale square census tracts tiling the NYC
+#     bounding box, with a matching nyc_census_tract_population.csv
+#   - zone_shape_files/: 263 square taxi zones (LocationID 1 is EWR, as in the real file)
+#   - the pickup/dropoff tables by zone and hour
+#   - regions.json: a second region (REGION) read from the tract files themselves, with
+#     the tracts as its zones and no trip data (see elec_transit_y/regions.py)
+# The taxi zone count is fixed by the LocationID axis of the aggregates, so the taxi
+# tables scale by adding the period axes of taxi_aggregate.py instead (TAXI_PERIODS):
+# 12x rows by month and 84x by month and day of week.
+#
+# Usage:
+#   python benchmarks/synthetic.py --scale 10 [--out /tmp/elec_transit_y_bench/10x] [--seed 0]
+
+import argparse
+import json
+import math
+import os
+import sys
+import tempfile
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from elec_transit_y.taxi_aggregate import HOURS, PERIODS
+
+# Row counts of the current data at 1x
+BASE_SIZES = {
+    'stations': 60000,
+    'tracts': 2325,
+    'ingest_stations': 5000  # NY stations returned by the NREL API stub
+}
+SCALES = [1, 10, 100]
+
+# Period axes added to the taxi tables at each scale
+TAXI_PERIODS = {1: (), 10: ('month',), 100: ('month', 'day_of_week')}
+
+
+def taxi_periods(scale):
+    # Period axes of the largest TAXI_PERIODS scale not above scale
+    return TAXI_PERIODS[max(key for key in TAXI_PERIODS if key <= max(scale, 1))]
+
+
+# Bump whenever the generated data changes, so cached data directories are rebuilt
+VERSION = 2
+
+N_TAXI_ZONES = 263
+# Name of the region defined in regions.json
+REGION = 'nyc_tracts'
+# Extent of the taxi zones in EPSG:2263 (NY Long Island state plane, feet)
+NYC_BOUNDS = (913175.0, 120121.0, 1067383.0, 272844.0)
+NYC_LAT_LON = ((40.50, 40.91), (-74.25, -73.70))
+US_LAT_LON = ((25.0, 49.0), (-124.0, -67.0))
+
+# Borough -> county FIPS code, west to east across the bounding box
+BOROUGHS = {'Staten Island': 85, 'Brooklyn': 47, 'Manhattan': 61, 'Bronx': 5, 'Queens': 81}
+STATES = ['CA', 'TX', 'FL', 'WA', 'IL', 'MA', 'CO', 'GA', 'NJ', 'PA', 'OH', 'MI', 'AZ', 'OR', 'MD', 'VA', 'NC', 'MN']
+FUEL_TYPES = ['ELEC', 'ELEC', 'ELEC', 'ELEC', 'ELEC', 'ELEC', 'ELEC', 'ELEC', 'CNG', 'E85', 'LPG', 'BD']
+CONNECTORS = ["['J1772']", "['J1772', 'J1772COMBO']", "['CHADEMO', 'J1772COMBO']", "['TESLA']", "['NEMA515']"]
+
+
+def grid_boxes(n, bounds=NYC_BOUNDS):
+    '''
+    n square-ish boxes tiling bounds row by row (the last row may be partial).
+
+    Returns: (shapely polygons, column of each box, number of columns)
+    '''
+    min_x, min_y, max_x, max_y = bounds
+    columns = max(1, math.ceil(math.sqrt(n * (max_x - min_x) / (max_y - min_y))))
+    rows = math.ceil(n / columns)
+    width, height = (max_x - min_x) / columns, (max_y - min_y) / rows
+    position = np.arange(n)
+    column, row = position % columns, position // columns
+    x, y = min_x + column * width, min_y + row * height
+    return shapely.box(x, y, x + width, y + height), column, columns
+
+
+def _borough(column, columns):
+    names = list(BOROUGHS)
+    return np.array(names)[column * len(names) // columns]
+
+
+def synthetic_zones():
+    '''
+    Square taxi zones in the taxi_zones.shp schema, in EPSG:2263.
+
+    Returns: geopandas dataframe
+    '''
+    boxes, column, columns = grid_boxes(N_TAXI_ZONES)
+    location_id = np.arange(1, N_TAXI_ZONES + 1)
+    borough = _borough(column, columns)
+    borough[0] = 'EWR'
+    zones = gpd.GeoDataFrame({
+        'OBJECTID': location_id,
+        'Shape_Leng': shapely.length(boxes),
+        'Shape_Area': shapely.area(boxes),
+        'zone': [f'Zone {number}' for number in location_id],
+        'LocationID': location_id,
+        'borough': borough
+    }, geometry=boxes, crs='EPSG:2263')
+    return zones
+
+
+def synthetic_tracts(n):
+    '''
+    n square census tracts in the nyct2020.shp schema (EPSG:2263) and the
+    census population rows for every tract.
+
+    Returns: (geopandas dataframe, pandas dataframe)
+    '''
+    boxes, column, columns = grid_boxes(n)
+    boro_name = _borough(column, columns)
+    county = pd.Series(boro_name).map(BOROUGHS).to_numpy()
+    # Tract codes numbered within each borough, 6 digits as in the real GEOIDs
+    tract = pd.Series(boro_name).groupby(boro_name).cumcount().to_numpy() + 100
+    boro_code = pd.Series(boro_name).map({name: code for code, name in enumerate(BOROUGHS, 1)}).to_numpy()
+    tracts = gpd.GeoDataFrame({
+        'CTLabel': [f'{code / 100:g}' for code in tract],
+        'BoroCode': boro_code.astype(str),
+        'BoroName': boro_name,
+        'CT2020': [f'{code:06d}' for code in tract],
+        'GEOID': [f'36{fips:03d}{code:06d}' for fips, code in zip(county, tract)],
+        'Shape_Leng': shapely.length(boxes),
+        'Shape_Area': shapely.area(boxes)
+    }, geometry=boxes, crs='EPSG:2263')
+    rng = np.random.default_rng(n)
+    population = pd.DataFrame({
+        'P1_001N': rng.integers(0, 8000, n),
+        'NAME': [f'Census Tract {label}, {name} County, New York' for label, name in zip(tracts['CTLabel'], boro_name)],
+        'state': 36,
+        'county': county,
+        'tract': tract
+    })
+    return tracts, population
+
+
+def synthetic_stations(n, seed=0):
+    '''
+    n stations in the ev_stations_v1.csv schema: a quarter in NYC, the rest
+    spread over the continental US.
+
+    Returns: pandas dataframe
+    '''
+    rng = np.random.default_rng(seed)
+    nyc = n // 4
+    (lat_min, lat_max), (lon_min, lon_max) = US_LAT_LON
+    latitude, longitude = rng.uniform(lat_min, lat_max, n), rng.uniform(lon_min, lon_max, n)
+    (lat_min, lat_max), (lon_min, lon_max) = NYC_LAT_LON
+    latitude[:nyc], longitude[:nyc] = rng.uniform(lat_min, lat_max, nyc), rng.uniform(lon_min, lon_max, nyc)
+    state = np.array(STATES)[rng.integers(0, len(STATES), n)]
+    state[:nyc] = 'NY'
+    city = np.char.add('City ', rng.integers(0, 2000, n).astype(str))
+    city[:nyc] = np.array(list(BOROUGHS))[rng.integers(0, len(BOROUGHS), nyc)]
+    number = np.arange(n)
+    return pd.DataFrame({
+        'id': number + 1,
+        'station_name': np.char.add('Station ', number.astype(str)),
+        'street_address': np.char.add(number.astype(str), ' Main St'),
+        'city': city,
+        'state': state,
+        'zip': rng.integers(10000, 99999, n).astype(str),
+        'fuel_type_code': np.array(FUEL_TYPES)[rng.integers(0, len(FUEL_TYPES), n)],
+        'access_code': np.where(rng.random(n) < 0.8, 'public', 'private'),
+        'latitude': latitude.round(6),
+        'longitude': longitude.round(6),
+        'open_date': pd.to_datetime('2010-01-01') + pd.to_timedelta(rng.integers(0, 5400, n), unit='D'),
+        'updated_at': '2024-01-01T00:00:00Z',
+        'ev_connector_types': np.array(CONNECTORS)[rng.integers(0, len(CONNECTORS), n)]
+    })
+
+
+def nrel_stations(n, state='NY', seed=0):
+    '''
+    n stations as returned in the fuel_stations list of the NREL API.
+
+    Returns: list of dicts
+    '''
+    stations = synthetic_stations(n, seed)
+    stations['state'] = state
+    stations['open_date'] = stations['open_date'].dt.strftime('%Y-%m-%d')
+    stations['ev_connector_types'] = stations['ev_connector_types'].map(lambda value: json.loads(value.replace("'", '"')))
+    stations['ev_level2_evse_num'] = 2
+    return stations.to_dict('records')
+
+
+def synthetic_taxi_counts(periods=(), seed=0):
+    '''
+    Pickup and dropoff counts per taxi zone, period and hour in the
+    taxi_aggregate.py schema, with about 5% of the combinations missing
+    (no trips).
+
+    Inputs:
+      periods (tuple of strings): period columns from taxi_aggregate.PERIODS
+
+    Returns: (pickups, dropoffs) pandas dataframes
+    '''
+    rng = np.random.default_rng(seed)
+    axes = [np.arange(1, N_TAXI_ZONES + 1)] + [np.arange(1, PERIODS[name] + 1) for name in periods] + [np.arange(HOURS)]
+    grid = [values.ravel() for values in np.meshgrid(*axes, indexing='ij')]
+    tables = []
+    for location_column, count_column in [('PULocationID', 'pickup_count'), ('DOLocationID', 'dropoff_count')]:
+        keep = rng.random(len(grid[0])) >= 0.05
+        table = pd.DataFrame(dict(zip([location_column, *periods, 'hour_of_day'], [values[keep] for values in grid])))
+        table[count_column] = rng.lognormal(6, 2, keep.sum()).astype(np.int64) + 1
+        tables.append(table[['hour_of_day', location_column, *periods, count_column]])
+    return tables[0], tables[1]
+
+
+def write_data_dir(directory, scale, seed=0):
+    '''
+    Write the synthetic data directory for a scale, unless one for the same
+    scale, seed and VERSION is already there.
+
+    Returns: directory
+    '''
+    marker = os.path.join(directory, 'synthetic.json')
+    spec = {'scale': scale, 'seed': seed, 'version': VERSION}
+    if os.path.exists(marker):
+        with open(marker) as file:
+            if json.load(file) == spec:
+                return directory
+    os.makedirs(os.path.join(directory, 'zone_shape_files'), exist_ok=True)
+    os.makedirs(os.path.join(directory, 'nyct2020_24b'), exist_ok=True)
+
+    synthetic_stations(BASE_SIZES['stations'] * scale, seed).to_csv(
+        os.path.join(directory, 'ev_stations_v1.csv'), index=False, date_format='%Y-%m-%d')
+    synthetic_zones().to_file(os.path.join(directory, 'zone_shape_files', 'taxi_zones.shp'))
+    tracts, population = synthetic_tracts(BASE_SIZES['tracts'] * scale)
+    tracts.to_file(os.path.join(directory, 'nyct2020_24b', 'nyct2020.shp'))
+    population.to_csv(os.path.join(directory, 'nyc_census_tract_population.csv'), index=False)
+    pickups, dropoffs = synthetic_taxi_counts(seed=seed)
+    pickups.to_csv(os.path.join(directory, 'nyc_taxi_rides_2019_aggByPUandHour.csv'), index=False)
+    dropoffs.to_csv(os.path.join(directory, 'nyc_taxi_rides_2019_aggByDOandHour.csv'), index=False)
+    with open(os.path.join(directory, 'regions.json'), 'w') as file:
+        json.dump({REGION: {'title': 'NYC census tracts', 'tracts': os.path.join('nyct2020_24b', 'nyct2020.shp'),
+                            'population': 'nyc_census_tract_population.csv', 'states': ['NY']}}, file)
+
+    with open(marker, 'w') as file:
+        json.dump(spec, file)
+    return directory
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', type=int, default=1, help='multiple of the current data sizes')
+    parser.add_argument('--out', help='data directory (default: /tmp/elec_transit_y_bench/<scale>x)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    out = args.out or os.path.join(tempfile.gettempdir(), 'elec_transit_y_bench', f'{args.scale}x')
+    print(f"Synthetic data at {args.scale}x written to {write_data_dir(out, args.scale, args.seed)}")
@@ -0,0 +1 @@
+# Shared data, indexing and map-building helpers for the elec-transit-y dashboards
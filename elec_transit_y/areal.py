@@ -0,0 +1,211 @@
+# Areal-weighted interpolation of census tract values to taxi zones (or any two polygon layers)
+#
+# The overlay of the two layers is computed once: an STRtree finds the (zone, tract)
+# pairs that intersect, their intersection areas are measured in a projected CRS and
+# stored as a sparse zones x tracts matrix. Reallocating any tract column is then one
+# sparse matrix-vector product:
+#
+#   * extensive values (counts such as P1_001N population) are split by the share of each
+#     tract's area that falls in the zone;
+#   * intensive values (rates such as Population_Density) are averaged over the zone,
+#     weighted by the area each tract covers.
+#
+# Matrices are cached in memory and, if AREAL_CACHE_DIR is set, on disk with
+# scipy.sparse.save_npz, keyed by a hash of both layers' geometry, so new variables or
+# census years on the same geometry skip the overlay entirely.
+#
+# Usage:
+#   python -m elec_transit_y.areal [--extensive P1_001N] [--intensive Population_Density] [--out path.csv]
+import argparse
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import shapely
+from scipy import sparse
+
+from elec_transit_y.cache import LRUCache
+
+AREAL_CACHE_DIR = os.environ.get('AREAL_CACHE_DIR')
+
+_weights_cache = LRUCache(maxsize=8)
+
+
+def geometry_hash(gdf):
+    '''
+    Hash of a layer's geometries (in row order) and CRS, ignoring its
+    attribute columns.
+
+    Returns: hex digest string
+    '''
+    digest = hashlib.sha1(str(gdf.crs).encode())
+    digest.update(b''.join(gdf.geometry.to_wkb()))
+    return digest.hexdigest()
+
+
+def _valid(geometries):
+    # Overlay operations raise on self-intersecting rings; repair only the invalid ones
+    geometries = np.array(geometries, dtype=object)
+    invalid = ~shapely.is_valid(geometries)
+    if invalid.any():
+        geometries[invalid] = shapely.make_valid(geometries[invalid])
+    return geometries
+
+
+def overlay_areas(sources, targets, crs=None):
+    '''
+    Intersection areas between every target and source polygon.
+
+    Inputs:
+      sources (geopandas dataframe): e.g. census tracts
+      targets (geopandas dataframe): e.g. taxi zones
+      crs: projected CRS to measure areas in (default: the targets' UTM zone)
+
+    Returns: (targets x sources scipy CSR matrix of intersection areas,
+    source areas, target areas), areas in CRS units squared
+    '''
+    crs = crs or targets.estimate_utm_crs()
+    source_geometries = _valid(sources.to_crs(crs).geometry.values)
+    target_geometries = _valid(targets.to_crs(crs).geometry.values)
+
+    tree = shapely.STRtree(source_geometries)
+    target_index, source_index = tree.query(target_geometries, predicate='intersects')
+    areas = shapely.area(shapely.intersection(target_geometries[target_index], source_geometries[source_index]))
+    keep = areas > 0
+    matrix = sparse.csr_matrix((areas[keep], (target_index[keep], source_index[keep])),
+                               shape=(len(target_geometries), len(source_geometries)))
+    return matrix, shapely.area(source_geometries), shapely.area(target_geometries)
+
+
+def _areas_path(path):
+    # Polygon areas are stored next to the matrix
+    return path[:-len('.npz')] + '_areas.npz' if path.endswith('.npz') else path + '_areas.npz'
+
+
+class ArealWeights:
+    '''
+    Sparse overlay of a source layer (e.g. census tracts) onto a target
+    layer (e.g. taxi zones), reusable for any number of source columns.
+
+    Inputs:
+      intersections (scipy sparse matrix): targets x sources intersection areas
+      source_areas, target_areas (numpy arrays): polygon areas
+    '''
+
+    def __init__(self, intersections, source_areas, target_areas):
+        self.intersections = sparse.csr_matrix(intersections)
+        self.source_areas = np.asarray(source_areas, dtype=float)
+        self.target_areas = np.asarray(target_areas, dtype=float)
+        # Share of each source's area falling in each target
+        with np.errstate(divide='ignore'):
+            self.extensive_weights = self.intersections @ sparse.diags(
+                np.where(self.source_areas > 0, 1 / self.source_areas, 0))
+
+    @classmethod
+    def from_layers(cls, sources, targets, crs=None):
+        return cls(*overlay_areas(sources, targets, crs))
+
+    @property
+    def shape(self):
+        return self.intersections.shape
+
+    def save(self, path):
+        '''
+        Write the overlay as path (scipy .npz) plus path's areas alongside.
+        '''
+        sparse.save_npz(path, self.intersections)
+        np.savez(_areas_path(path), source_areas=self.source_areas, target_areas=self.target_areas)
+
+    @classmethod
+    def load(cls, path):
+        areas = np.load(_areas_path(path))
+        return cls(sparse.load_npz(path), areas['source_areas'], areas['target_areas'])
+
+    def extensive(self, values):
+        '''
+        Reallocate counts by area share; missing values count as zero.
+
+        Returns: numpy array with one value per target
+        '''
+        values = np.nan_to_num(np.asarray(values, dtype=float))
+        return self.extensive_weights @ values
+
+    def intensive(self, values):
+        '''
+        Area-weighted mean of rates over each target, ignoring sources with
+        missing values; NaN where no source with a value overlaps.
+
+        Returns: numpy array with one value per target
+        '''
+        values = np.asarray(values, dtype=float)
+        present = ~np.isnan(values)
+        covered = self.intersections @ present.astype(float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(covered > 0, (self.intersections @ np.where(present, values, 0)) / covered, np.nan)
+
+    def coverage(self):
+        '''
+        Share of each target's area covered by sources.
+
+        Returns: numpy array
+        '''
+        return np.asarray(self.intersections.sum(axis=1)).ravel() / self.target_areas
+
+    def interpolate(self, frame, extensive=(), intensive=(), index=None):
+        '''
+        Reallocate several source columns at once.
+
+        Inputs:
+          frame (pandas dataframe): source rows, in the order the weights were built
+          extensive, intensive (lists of strings): columns of each kind
+          index (array-like): index for the result, e.g. the target ids
+
+        Returns: pandas dataframe with one row per target
+        '''
+        result = pd.DataFrame(index=index if index is not None else pd.RangeIndex(self.shape[0]))
+        for column in extensive:
+            result[column] = self.extensive(frame[column])
+        for column in intensive:
+            result[column] = self.intensive(frame[column])
+        return result
+
+
+def areal_weights(sources, targets, crs=None, cache_dir=AREAL_CACHE_DIR):
+    '''
+    ArealWeights for two layers, built once per distinct pair of geometries.
+
+    Returns: ArealWeights
+    '''
+    key = hashlib.sha1(f'{geometry_hash(sources)} {geometry_hash(targets)} {crs}'.encode()).hexdigest()
+
+    def build():
+        path = os.path.join(cache_dir, f'areal_{key}.npz') if cache_dir else None
+        if path and os.path.exists(path):
+            return ArealWeights.load(path)
+        weights = ArealWeights.from_layers(sources, targets, crs)
+        if path:
+            os.makedirs(cache_dir, exist_ok=True)
+            weights.save(path)
+        return weights
+
+    return _weights_cache.get_or_create(key, build)
+
+
+if __name__ == '__main__':
+    from elec_transit_y import bundle
+
+    parser = argparse.ArgumentParser(description='Census tract columns reallocated to taxi zones')
+    parser.add_argument('--extensive', action='append', help='count column (default: P1_001N)')
+    parser.add_argument('--intensive', action='append', help='rate column (default: Population_Density)')
+    parser.add_argument('--out', default=os.path.join('data', 'taxi_zone_census.csv'))
+    args = parser.parse_args()
+
+    tracts = bundle.load('census_tracts')
+    zones = bundle.load('taxi_zones')
+    weights = areal_weights(tracts, zones)
+    table = weights.interpolate(tracts, args.extensive or ['P1_001N'], args.intensive or ['Population_Density'],
+                                index=pd.Index(zones['LocationID'], name='LocationID'))
+    table['tract_coverage'] = weights.coverage()
+    table.to_csv(args.out)
+    print(f"Wrote {len(table.columns)} columns for {len(table)} zones to {args.out}")
@@ -0,0 +1,185 @@
+# Point-in-polygon assignment of stations (or any points) to taxi zones and census tracts
+#
+# Each polygon layer is indexed once: its geometries are reprojected to the points' CRS,
+# prepared, and put in a shapely STRtree. A batch of points is then assigned with two
+# bulk calls, an STRtree bounding-box query giving (point, candidate polygon) pairs and a
+# vectorized shapely.intersects_xy over those pairs against the prepared polygons, so a
+# million points take seconds instead of a geopandas sjoin per refresh. Points on an
+# edge shared by two polygons go to the first of them; points outside every polygon get
+# a missing id.
+#
+# StationAssigner adds taxi_zone_id and GEOID columns to the station table when the
+# bundle is built (see elec_transit_y/bundle.py) and can reuse a previous assignment,
+# so only new or moved stations are looked up.
+#
+# Usage:
+#   python -m elec_transit_y.assign [--out data/station_zones.csv]
+import argparse
+import hashlib
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from elec_transit_y.areal import geometry_hash
+
+# Points looked up per batch, bounding the size of the candidate pair arrays
+CHUNK_SIZE = 1 << 18
+
+# Station columns added by StationAssigner: column -> (layer, id column in the layer)
+STATION_ASSIGNMENTS = {'taxi_zone_id': ('taxi_zones', 'LocationID'), 'GEOID': ('census_tracts', 'GEOID')}
+
+
+def data_key(values):
+    # Hash of an array of ids
+    return hashlib.sha1(pd.util.hash_array(np.asarray(values, dtype=object)).tobytes()).hexdigest()
+
+
+def point_chunks(x, y, chunk_size=CHUNK_SIZE):
+    '''
+    Split point coordinates into batches, skipping missing coordinates.
+
+    Yields: (row numbers, shapely points, x, y) per batch
+    '''
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    for start in range(0, len(x), chunk_size):
+        chunk_x, chunk_y = x[start:start + chunk_size], y[start:start + chunk_size]
+        rows = start + np.flatnonzero(np.isfinite(chunk_x) & np.isfinite(chunk_y))
+        yield rows, shapely.points(x[rows], y[rows]), x[rows], y[rows]
+
+
+class PolygonIndex:
+    '''
+    Prepared STRtree over a polygon layer for bulk point lookups.
+
+    Inputs:
+      gdf (geopandas dataframe): polygons, in any CRS
+      id_column (string): column returned for the polygon containing a point
+        (default: the polygon's row number)
+      crs: CRS of the points that will be looked up
+    '''
+
+    def __init__(self, gdf, id_column=None, crs='EPSG:4326'):
+        gdf = gdf.to_crs(crs)
+        self.geometries = np.asarray(gdf.geometry.values, dtype=object)
+        shapely.prepare(self.geometries)
+        self.tree = shapely.STRtree(self.geometries)
+        self.ids = pd.array(gdf[id_column].to_numpy() if id_column else np.arange(len(gdf)))
+        # Changes whenever the polygons, their ids or the CRS change
+        self.key = hashlib.sha1(f'{geometry_hash(gdf)} {data_key(self.ids)}'.encode()).hexdigest()
+
+    def positions(self, x, y, chunk_size=CHUNK_SIZE):
+        '''
+        Row of the polygon containing each point.
+
+        Inputs:
+          x, y (array-like): point coordinates (longitude, latitude in EPSG:4326)
+
+        Returns: numpy int array, -1 for points outside every polygon
+        '''
+        result = np.full(len(x), -1, dtype=np.intp)
+        for rows, points, chunk_x, chunk_y in point_chunks(x, y, chunk_size):
+            result[rows] = self.chunk_positions(points, chunk_x, chunk_y)
+        return result
+
+    def chunk_positions(self, points, x, y):
+        '''
+        positions() of one batch of points, given as shapely points and their
+        coordinates (see point_chunks()), so several layers can share them.
+        '''
+        result = np.full(len(x), -1, dtype=np.intp)
+        candidates, polygons = self.tree.query(points)
+        hit = shapely.intersects_xy(self.geometries[polygons], x[candidates], y[candidates])
+        candidates, polygons = candidates[hit], polygons[hit]
+        # Sorted by point then polygon, the first pair of each point is its lowest polygon row
+        order = np.lexsort((polygons, candidates))
+        candidates, polygons = candidates[order], polygons[order]
+        first = np.ones(len(candidates), dtype=bool)
+        first[1:] = candidates[1:] != candidates[:-1]
+        result[candidates[first]] = polygons[first]
+        return result
+
+    def lookup(self, x, y, chunk_size=CHUNK_SIZE):
+        '''
+        Id of the polygon containing each point.
+
+        Returns: pandas array (nullable), missing for points outside every polygon
+        '''
+        return self.ids.take(self.positions(x, y, chunk_size), allow_fill=True)
+
+
+class StationAssigner:
+    '''
+    Taxi zone and census tract lookups for the station table.
+
+    Inputs:
+      taxi_zones (geopandas dataframe): with LocationID
+      census_tracts (geopandas dataframe): with GEOID
+    '''
+
+    def __init__(self, taxi_zones, census_tracts):
+        layers = {'taxi_zones': taxi_zones, 'census_tracts': census_tracts}
+        self.indexes = {column: PolygonIndex(layers[layer], id_column)
+                        for column, (layer, id_column) in STATION_ASSIGNMENTS.items()}
+        # Assignments made under the same key can be reused
+        self.key = hashlib.sha1(' '.join(index.key for index in self.indexes.values()).encode()).hexdigest()
+
+    def assign(self, stations, previous=None):
+        '''
+        Add taxi_zone_id and GEOID columns to the stations.
+
+        Inputs:
+          stations (pandas dataframe): with id, latitude and longitude
+          previous (pandas dataframe): an earlier assignment made with the
+            same key (id, latitude, longitude and the assigned columns);
+            its stations with unchanged coordinates are not looked up again
+
+        Returns: (stations with the assigned columns, number of stations looked up)
+        '''
+        latitudes = stations['latitude'].to_numpy(dtype=float)
+        longitudes = stations['longitude'].to_numpy(dtype=float)
+        todo = np.ones(len(stations), dtype=bool)
+        columns = {column: index.ids.take(np.full(len(stations), -1), allow_fill=True)
+                   for column, index in self.indexes.items()}
+        if previous is not None:
+            matched = previous.drop_duplicates('id').set_index('id').reindex(stations['id'])
+            todo = ~((matched['latitude'].to_numpy(dtype=float) == latitudes)
+                     & (matched['longitude'].to_numpy(dtype=float) == longitudes))
+            for column in columns:
+                columns[column] = pd.array(matched[column].to_numpy(), dtype=columns[column].dtype)
+        todo = np.flatnonzero(todo)
+        positions = {column: np.full(len(todo), -1, dtype=np.intp) for column in columns}
+        # Every batch of points is built once and looked up in both layers
+        for rows, points, x, y in point_chunks(longitudes[todo], latitudes[todo]):
+            for column, index in self.indexes.items():
+                positions[column][rows] = index.chunk_positions(points, x, y)
+        for column, index in self.indexes.items():
+            columns[column][todo] = index.ids.take(positions[column], allow_fill=True)
+        return stations.assign(**columns), len(todo)
+
+
+def assign_stations(stations, taxi_zones, census_tracts):
+    '''
+    Add taxi_zone_id and GEOID columns to stations that do not have them yet
+    (e.g. loaded from the raw CSV or the partitioned station dataset rather
+    than the bundle).
+
+    Returns: stations (pandas dataframe)
+    '''
+    if all(column in stations.columns for column in STATION_ASSIGNMENTS):
+        return stations
+    return StationAssigner(taxi_zones, census_tracts).assign(stations)[0]
+
+
+if __name__ == '__main__':
+    from elec_transit_y import bundle
+
+    parser = argparse.ArgumentParser(description='Taxi zone and census tract of every station')
+    parser.add_argument('--out', default='data/station_zones.csv')
+    args = parser.parse_args()
+
+    stations = assign_stations(bundle.load('ev_stations'), bundle.load('taxi_zones'), bundle.load('census_tracts'))
+    stations[['id', 'latitude', 'longitude'] + list(STATION_ASSIGNMENTS)].to_csv(args.out, index=False)
+    print(f"{stations['taxi_zone_id'].notna().sum()} of {len(stations)} stations are in a taxi zone, "
+          f"{stations['GEOID'].notna().sum()} in a census tract; wrote {args.out}")
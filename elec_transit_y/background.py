@@ -0,0 +1,92 @@
+# Background execution for the dashboards' slow callbacks
+#
+# With a background manager, a slow callback runs as a Dash background callback: the
+# request returns at once and the job runs in its own process forked from the worker,
+# so a slow click never ties up a gunicorn worker that fast callbacks need. The browser
+# polls for the job's progress messages; when the same callback fires again (a newer
+# click or hour) Dash terminates the job it replaces; and finished results are memoized
+# on disk in BACKGROUND_CACHE_DIR, keyed by the callback's arguments and a hash of the
+# app's data. Set BACKGROUND_CALLBACKS=0, or leave out diskcache/multiprocess/psutil,
+# to run the callbacks inline as before.
+#
+# A job writes its metrics (see metrics.py) when it finishes, so its stages show up on
+# the workers' /metrics.
+import functools
+import os
+import tempfile
+
+from elec_transit_y.metrics import flush
+
+BACKGROUND_CALLBACKS = os.environ.get('BACKGROUND_CALLBACKS', '1') == '1'
+BACKGROUND_CACHE_DIR = os.environ.get('BACKGROUND_CACHE_DIR',
+                                      os.path.join(tempfile.gettempdir(), 'elec_transit_y_callbacks'))
+# Seconds a memoized result is kept
+BACKGROUND_EXPIRE = int(os.environ.get('BACKGROUND_EXPIRE', 24 * 3600))
+
+
+def background_manager(namespace='', cache_dir=BACKGROUND_CACHE_DIR, expire=BACKGROUND_EXPIRE):
+    '''
+    Diskcache-backed manager for background callbacks.
+
+    Inputs:
+      namespace (string): e.g. a data_hash() of the app's data; results
+        memoized under another namespace are never reused
+      cache_dir (string): directory of the job and result cache
+      expire (int): seconds memoized results are kept
+
+    Returns: dash DiskcacheManager, or None when background callbacks are
+    disabled or their dependencies are missing
+    '''
+    if not BACKGROUND_CALLBACKS:
+        return None
+    try:
+        import diskcache
+        import multiprocess  # noqa: F401 (runs the jobs)
+        import psutil  # noqa: F401 (terminates replaced jobs)
+        from dash import DiskcacheManager
+    except ImportError as error:
+        print(f"Background callbacks disabled, running callbacks inline: {error}")
+        return None
+    cache = diskcache.Cache(os.path.join(cache_dir, namespace) if namespace else cache_dir)
+    return DiskcacheManager(cache, cache_by=[lambda: namespace], expire=expire)
+
+
+def slow_callback(app, manager, outputs, inputs, state=(), progress=None, running=None, interval=500, **kwargs):
+    '''
+    Register a callback that runs in the background when manager is set
+    and inline otherwise.
+
+    With progress, the decorated function takes a set_progress function as
+    its first argument; inline, set_progress does nothing.
+
+    Inputs:
+      app (dash app)
+      manager (DiskcacheManager or None): see background_manager()
+      outputs, inputs, state (lists of dash dependencies)
+      progress (Output or list of Outputs): set by set_progress(...)
+      running (list of tuples): (Output, value while running, value after)
+      interval (int): milliseconds between the browser's progress polls
+      kwargs: passed to app.callback
+
+    Returns: decorator
+    '''
+    def decorator(function):
+        if manager is not None:
+            @functools.wraps(function)
+            def job(*args):
+                # The job process exits without running atexit handlers or timers
+                try:
+                    return function(*args)
+                finally:
+                    flush(force=True)
+            return app.callback(outputs, inputs, list(state), background=True, manager=manager,
+                                progress=progress, running=running, interval=interval, **kwargs)(job)
+        if progress is None:
+            return app.callback(outputs, inputs, list(state), **kwargs)(function)
+
+        @functools.wraps(function)
+        def inline(*args):
+            return function(lambda *values: None, *args)
+        return app.callback(outputs, inputs, list(state), **kwargs)(inline)
+
+    return decorator
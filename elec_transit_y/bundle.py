@@ -0,0 +1,206 @@
+# Prebuilt binary data bundle: cleaned, typed tables written once so the apps start quickly
+#
+# Build it with:
+#   python -m elec_transit_y.bundle [--data-dir data] [--bundle-dir data/bundle]
+#
+# Plain tables are stored as uncompressed Feather (Arrow IPC) files so they can be
+# memory-mapped; geometries are stored as GeoParquet. manifest.json records a content
+# hash of every source file and every bundle file. load() falls back to the raw
+# CSV/shapefile loaders whenever a table is missing or its sources have changed.
+# Stations are bundled with their taxi zone and census tract (see assign.py).
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import geopandas as gpd
+import numpy as np
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from elec_transit_y.assign import STATION_ASSIGNMENTS, StationAssigner
+from elec_transit_y.data import DATA_DIR, LOADER_VERSIONS, LOADERS, SOURCES
+from elec_transit_y.metrics import stage
+
+BUNDLE_DIR = os.environ.get('ELEC_TRANSIT_Y_BUNDLE_DIR', os.path.join(DATA_DIR, 'bundle'))
+MANIFEST = 'manifest.json'
+
+# Tables holding geometries are written as GeoParquet, everything else as Feather
+GEO_TABLES = {'taxi_zones', 'census_tracts'}
+
+
+def file_hash(path, chunk_size=1 << 20):
+    '''
+    SHA-1 of a file's contents, read in chunks.
+    '''
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def to_arrow(frame):
+    '''
+    Convert a dataframe to an Arrow table for the bundle. Float columns keep
+    NaN as a value rather than turning it into a null, so that reading them
+    back from a memory-mapped file needs no copy and the pages can be shared
+    between processes.
+    '''
+    frame = frame.reset_index(drop=True)
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    for position, column in enumerate(frame.columns):
+        if frame[column].dtype.kind == 'f':
+            values = pa.array(np.ascontiguousarray(frame[column].to_numpy()), from_pandas=False)
+            table = table.set_column(position, table.field(position).name, values)
+    return table
+
+
+def _table_path(name, bundle_dir):
+    extension = 'parquet' if name in GEO_TABLES else 'feather'
+    return os.path.join(bundle_dir, f'{name}.{extension}')
+
+
+def _source_info(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': file_hash(path)}
+
+
+def read_manifest(bundle_dir=BUNDLE_DIR):
+    path = os.path.join(bundle_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+def _assign_stations(stations, data_dir, bundle_dir, manifest):
+    # Add taxi_zone_id and GEOID to the stations, only looking up the stations that are new
+    # or moved since the bundled table when the zones and tracts are unchanged
+    assigner = StationAssigner(load('taxi_zones', data_dir, bundle_dir), load('census_tracts', data_dir, bundle_dir))
+    previous = None
+    entry = manifest['tables'].get('ev_stations', {})
+    path = _table_path('ev_stations', bundle_dir)
+    if entry.get('assignment') == assigner.key and os.path.exists(path):
+        columns = ['id', 'latitude', 'longitude'] + list(STATION_ASSIGNMENTS)
+        # Copied out of the memory map, since the file is about to be overwritten
+        previous = feather.read_table(path, columns=columns, memory_map=False).to_pandas()
+    stations, looked_up = assigner.assign(stations, previous)
+    print(f"Assigned taxi zones and census tracts to {looked_up} of {len(stations)} stations")
+    return stations, assigner.key
+
+
+def build_bundle(data_dir=DATA_DIR, bundle_dir=BUNDLE_DIR, tables=None):
+    '''
+    Load every table from the raw sources and write it to the bundle.
+
+    Inputs:
+      data_dir (string): directory with the raw data files
+      bundle_dir (string): output directory
+      tables (list of strings): subset of tables to build (default: all
+        tables whose sources exist)
+
+    Returns: manifest (dict)
+    '''
+    os.makedirs(bundle_dir, exist_ok=True)
+    manifest = read_manifest(bundle_dir) or {'tables': {}}
+    for name in tables or LOADERS:
+        sources = [os.path.join(data_dir, source) for source in SOURCES[name]]
+        if not all(os.path.exists(source) for source in sources):
+            print(f"Skipping {name}: source files not found in {data_dir}")
+            continue
+
+        start_time = time.time()
+        table = LOADERS[name](data_dir)
+        path = _table_path(name, bundle_dir)
+        extra = {}
+        if name == 'ev_stations':
+            table, extra['assignment'] = _assign_stations(table, data_dir, bundle_dir, manifest)
+        if name in GEO_TABLES:
+            table.to_parquet(path, index=False)
+        else:
+            feather.write_feather(to_arrow(table), path, compression='uncompressed')
+
+        manifest['tables'][name] = {
+            'file': os.path.basename(path),
+            'rows': len(table),
+            'version': LOADER_VERSIONS.get(name, 1),
+            'sha1': file_hash(path),
+            'sources': {source: _source_info(os.path.join(data_dir, source)) for source in SOURCES[name]},
+            **extra
+        }
+        print(f"Bundled {name}: {len(table)} rows in {time.time() - start_time:.2f} seconds")
+
+    manifest['built_at'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    manifest['content_hash'] = hashlib.sha1(
+        ''.join(manifest['tables'][name]['sha1'] for name in sorted(manifest['tables'])).encode()
+    ).hexdigest()
+    with open(os.path.join(bundle_dir, MANIFEST), 'w') as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+def is_current(name, manifest, data_dir=DATA_DIR):
+    '''
+    Check that a bundled table exists and was built from the current sources
+    by the current version of its loader.
+    Sources whose size and modification time are unchanged are trusted
+    without rehashing; otherwise their content hash is compared.
+    '''
+    entry = (manifest or {}).get('tables', {}).get(name)
+    if entry is None or entry.get('version', 1) != LOADER_VERSIONS.get(name, 1):
+        return False
+    for source, info in entry['sources'].items():
+        path = os.path.join(data_dir, source)
+        if not os.path.exists(path):
+            # The bundle can be shipped without the raw sources
+            continue
+        stat = os.stat(path)
+        if stat.st_size == info['size'] and stat.st_mtime == info['mtime']:
+            continue
+        if stat.st_size != info['size'] or file_hash(path) != info['sha1']:
+            return False
+    return True
+
+
+def read_table(name, bundle_dir=BUNDLE_DIR):
+    '''
+    Read one table from the bundle. Feather files are memory-mapped and
+    numeric columns without nulls are returned as read-only views of the
+    mapping, so every process reading the bundle shares one resident copy
+    through the page cache.
+    '''
+    path = _table_path(name, bundle_dir)
+    if name in GEO_TABLES:
+        return gpd.read_parquet(path)
+    return feather.read_table(path, memory_map=True).to_pandas(split_blocks=True)
+
+
+def load(name, data_dir=DATA_DIR, bundle_dir=BUNDLE_DIR):
+    '''
+    Load a table from the bundle if it is present and current, otherwise from
+    the raw CSV/shapefile sources.
+
+    Inputs:
+      name (string): one of the keys of elec_transit_y.data.LOADERS
+
+    Returns: pandas or geopandas dataframe
+    '''
+    with stage(f'load.{name}'):
+        manifest = read_manifest(bundle_dir)
+        if is_current(name, manifest, data_dir) and os.path.exists(_table_path(name, bundle_dir)):
+            return read_table(name, bundle_dir)
+        if manifest is not None:
+            print(f"Bundle for {name} is missing or stale, loading from the raw sources")
+        return LOADERS[name](data_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the prebuilt data bundle for the dashboards')
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--bundle-dir', default=BUNDLE_DIR)
+    parser.add_argument('tables', nargs='*', help='tables to build (default: all)')
+    args = parser.parse_args()
+    manifest = build_bundle(args.data_dir, args.bundle_dir, args.tables or None)
+    print(f"Bundle content hash: {manifest['content_hash']}")
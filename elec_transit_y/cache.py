@@ -0,0 +1,134 @@
+# Bounded in-memory caches for rendered maps and other expensive results
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from elec_transit_y.metrics import stage
+
+
+def data_hash(*frames):
+    '''
+    Content hash of one or more DataFrames/GeoDataFrames, used to key caches
+    so persisted results are only reused when the input data is unchanged.
+
+    Inputs:
+      frames (pandas or geopandas dataframes)
+
+    Returns: hex digest string
+    '''
+    digest = hashlib.sha1()
+    for frame in frames:
+        geometry = getattr(frame, 'geometry', None) if isinstance(frame, pd.DataFrame) else None
+        if geometry is not None:
+            digest.update(b''.join(geometry.to_wkb()))
+            frame = pd.DataFrame(frame.drop(columns=geometry.name))
+        digest.update(','.join(map(str, frame.columns)).encode())
+        digest.update(pd.util.hash_pandas_object(frame, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+class LRUCache:
+    '''
+    Thread-safe least-recently-used cache with a fixed number of entries.
+
+    If persist_dir is given, values are also pickled to
+    persist_dir/namespace/ so a restarted process can reuse them; pass a
+    data_hash() of the inputs as the namespace so stale entries are ignored.
+    '''
+
+    def __init__(self, maxsize=128, persist_dir=None, namespace=''):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._persist_dir = os.path.join(persist_dir, namespace) if persist_dir else None
+        if self._persist_dir:
+            os.makedirs(self._persist_dir, exist_ok=True)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def _path(self, key):
+        name = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self._persist_dir, f'{name}.pkl')
+
+    def _lookup(self, key, default):
+        # Memory first, then the persisted pickle; hits and misses are counted by the callers
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                return self._data[key]
+        if self._persist_dir and os.path.exists(self._path(key)):
+            with stage('cache.disk_read'), open(self._path(key), 'rb') as file:
+                value = pickle.load(file)
+            self.put(key, value, persist=False)
+            return value
+        return default
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key, default=None):
+        sentinel = object()
+        value = self._lookup(key, sentinel)
+        self._count(value is not sentinel)
+        return default if value is sentinel else value
+
+    def put(self, key, value, persist=True):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        if persist and self._persist_dir:
+            # Write to a temporary file first so concurrent readers never see a partial pickle
+            path = self._path(key)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with stage('cache.disk_write'), open(tmp_path, 'wb') as file:
+                pickle.dump(value, file)
+            os.replace(tmp_path, path)
+
+    def get_or_create(self, key, create):
+        '''
+        Return the cached value for key, calling create() to build it on a miss.
+        Concurrent misses for the same key only build the value once; callers
+        that waited for it count as hits.
+        '''
+        sentinel = object()
+        value = self._lookup(key, sentinel)
+        if value is not sentinel:
+            self._count(True)
+            return value
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                value = self._lookup(key, sentinel)
+                self._count(value is not sentinel)
+                if value is sentinel:
+                    value = create()
+                    self.put(key, value)
+            return value
+        finally:
+            # Also when create() raised, so the lock of a failed key is not kept forever
+            with self._lock:
+                if self._key_locks.get(key) is key_lock:
+                    del self._key_locks[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,147 @@
+# Loading and cleaning of the raw CSV/shapefile sources used by the dashboards
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from elec_transit_y.tracts import join_tracts
+
+# Directory with the raw data files (defaults to the repository's data/ folder)
+DATA_DIR = os.environ.get(
+    'ELEC_TRANSIT_Y_DATA_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+)
+
+# Raw source files for each table, relative to the data directory
+SOURCES = {
+    'taxi_pickups': ['nyc_taxi_rides_2019_aggByPUandHour.csv'],
+    'taxi_dropoffs': ['nyc_taxi_rides_2019_aggByDOandHour.csv'],
+    'taxi_zones': [os.path.join('zone_shape_files', f'taxi_zones.{ext}') for ext in ['shp', 'shx', 'dbf', 'prj']],
+    'census_tracts': [os.path.join('nyct2020_24b', f'nyct2020.{ext}') for ext in ['shp', 'shx', 'dbf', 'prj']]
+                     + ['nyc_census_tract_population.csv']
+}
+# Bundled stations carry their taxi zone and census tract (see elec_transit_y/assign.py)
+SOURCES['ev_stations'] = ['ev_stations_v1.csv'] + SOURCES['taxi_zones'] + SOURCES['census_tracts']
+
+# Low-cardinality station columns stored as categoricals
+STATION_CATEGORIES = ['state', 'city', 'fuel_type_code', 'access_code']
+
+
+def load_ev_stations(data_dir=DATA_DIR):
+    '''
+    Read the NREL station CSV and apply the dashboards' typing: parsed
+    open_date, nullable integer year, float32 coordinates and categorical
+    enum columns.
+
+    Inputs:
+      data_dir (string): directory with the raw data files
+
+    Returns: ev_data (pandas dataframe)
+    '''
+    ev_data = pd.read_csv(os.path.join(data_dir, 'ev_stations_v1.csv'), low_memory=False)
+    return type_stations(ev_data)
+
+
+def type_stations(ev_data):
+    '''
+    Apply the dashboards' station typing to a dataframe, whether it was read
+    from the CSV or from the partitioned station dataset.
+
+    Returns: ev_data (pandas dataframe)
+    '''
+    ev_data['open_date'] = pd.to_datetime(ev_data['open_date'], errors='coerce')
+    ev_data['year'] = ev_data['open_date'].dt.year.astype('Int64')
+    ev_data['latitude'] = ev_data['latitude'].astype(np.float32)
+    ev_data['longitude'] = ev_data['longitude'].astype(np.float32)
+    for column in STATION_CATEGORIES:
+        if column in ev_data.columns:
+            ev_data[column] = ev_data[column].astype('category')
+    # Columns mixing numbers and strings (e.g. zip) become plain strings so they can be stored columnar
+    for column in ev_data.columns[ev_data.dtypes == object]:
+        values = ev_data[column]
+        ev_data[column] = values.where(values.isna(), values.astype(str))
+    return ev_data
+
+
+def read_taxi_counts(path, location_column, count_column):
+    '''
+    Read a pickup or dropoff table (CSV or Parquet) with compact integer types.
+    '''
+    if path.endswith('.parquet'):
+        data = pd.read_parquet(path)
+    else:
+        data = pd.read_csv(path)
+    return data.astype({'hour_of_day': np.int8, location_column: np.int16, count_column: np.int64})
+
+
+def load_taxi_pickups(data_dir=DATA_DIR):
+    '''
+    2019 yellow taxi pickups aggregated by pickup zone and hour.
+    '''
+    return read_taxi_counts(os.path.join(data_dir, 'nyc_taxi_rides_2019_aggByPUandHour.csv'),
+                             'PULocationID', 'pickup_count')
+
+
+def load_taxi_dropoffs(data_dir=DATA_DIR):
+    '''
+    2019 yellow taxi dropoffs aggregated by dropoff zone and hour.
+    '''
+    return read_taxi_counts(os.path.join(data_dir, 'nyc_taxi_rides_2019_aggByDOandHour.csv'),
+                             'DOLocationID', 'dropoff_count')
+
+
+def load_taxi_zones(data_dir=DATA_DIR):
+    '''
+    NYC taxi zone polygons in EPSG:4326.
+    '''
+    taxi_zones_gdf = gpd.read_file(os.path.join(data_dir, 'zone_shape_files', 'taxi_zones.shp'))
+    return taxi_zones_gdf.to_crs("EPSG:4326")
+
+
+def load_census_tracts(data_dir=DATA_DIR, population_file='nyc_census_tract_population.csv'):
+    '''
+    NYC 2020 census tracts joined with their P1_001N population counts on the
+    integer GEOID, with a Population_Density (people per km^2) column.
+
+    Inputs:
+      data_dir (string): directory with the raw data files
+      population_file (string): census population CSV with state, county and
+        tract columns (e.g. the statewide ny_census_tract_population.csv);
+        rows for tracts outside the shapefile are reported and dropped
+
+    Returns: merged_gdf (geopandas dataframe)
+    '''
+    # Load the census tract shapefile
+    gdf = gpd.read_file(os.path.join(data_dir, 'nyct2020_24b', 'nyct2020.shp'))
+
+    # Clean up the GeoDataFrame (remove gibberish rows manually inspected in the CSV)
+    gdf = gdf[gdf['BoroName'].isin(['Manhattan', 'Brooklyn', 'Queens', 'Bronx', 'Staten Island'])].copy()
+
+    # Change the area to km^2 instead of m^2
+    gdf['Shape_Area'] = gdf['Shape_Area'] / 10**6
+
+    # Read the population csv and join it to the tracts on GEOID
+    pop_df = pd.read_csv(os.path.join(data_dir, population_file))
+    merged_gdf, _ = join_tracts(gdf, pop_df)
+
+    # Calculate population density and add it as a column
+    merged_gdf['Population_Density'] = merged_gdf['P1_001N'] / merged_gdf['Shape_Area']
+    return merged_gdf
+
+
+# Loader for each table, used directly as the fallback when no bundle is available
+LOADERS = {
+    'ev_stations': load_ev_stations,
+    'taxi_pickups': load_taxi_pickups,
+    'taxi_dropoffs': load_taxi_dropoffs,
+    'taxi_zones': load_taxi_zones,
+    'census_tracts': load_census_tracts
+}
+
+# Bump a table's version whenever its loader's output changes, so bundles built by an
+# older loader are treated as stale
+LOADER_VERSIONS = {
+    'ev_stations': 2,
+    'census_tracts': 2
+}
@@ -0,0 +1,197 @@
+# Dense taxi demand cube for the pickup/dropoff maps: one float array indexed
+# [metric, zone, hour], built once from the aggregated taxi tables
+#
+# The zone axis is the taxi zone LocationID itself (0 to N_ZONES - 1 for NYC), so the values
+# of every zone for one metric and hour are a view of the array, not a scan of the tables.
+# Besides the pickup and dropoff counts the cube holds trips per existing charger and per
+# 1,000 residents in each zone (left out for zones under MIN_RESIDENTS, where a handful of
+# trips over an interpolated sliver of population would dominate the color scale), and
+# color bins computed over all hours of each metric so
+# the maps stay comparable from hour to hour. Tables with month or day_of_week columns
+# (see taxi_aggregate.py --by) add those axes between zone and hour.
+#
+# With DEMAND_CUBE_DIR set, the cube is saved there as .npy (plus a .json of its axes and
+# bins), keyed by a hash of its inputs, and later processes memory-map it instead of
+# rebuilding it.
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from elec_transit_y.taxi_aggregate import HOURS, N_ZONES, PERIODS
+
+DEMAND_CUBE_DIR = os.environ.get('DEMAND_CUBE_DIR')
+
+# Zones with fewer residents have no per-resident values
+MIN_RESIDENTS = 100
+
+# Metric -> legend caption
+METRICS = {
+    'pickup_count': 'pickup_count Count',
+    'dropoff_count': 'dropoff_count Count',
+    'pickups_per_station': 'Pickups per Charging Station',
+    'dropoffs_per_station': 'Dropoffs per Charging Station',
+    'pickups_per_1000_residents': 'Pickups per 1,000 Residents',
+    'dropoffs_per_1000_residents': 'Dropoffs per 1,000 Residents'
+}
+
+# Count table columns of each side: (count metric, location column, count column)
+SIDES = [('pickup_count', 'PULocationID', 'pickup_count'), ('dropoff_count', 'DOLocationID', 'dropoff_count')]
+
+
+def color_bins(values, bins=6):
+    '''
+    Quantile bin edges over all values of a metric, ignoring missing values.
+
+    Returns: list of increasing floats
+    '''
+    present = values[~np.isnan(values)]
+    if len(present) == 0:
+        # e.g. a region without trip data
+        present = np.zeros(1)
+    edges = np.unique(np.quantile(present, np.linspace(0, 1, bins + 1)))
+    # folium's Choropleth needs at least three classes
+    if len(edges) < 4:
+        edges = np.linspace(edges[0], max(edges[-1], edges[0] + 1), 4)
+    return edges.tolist()
+
+
+class DemandCube:
+    '''
+    Taxi demand per metric, zone, period and hour.
+
+    Inputs:
+      values (numpy array): shape (metrics, N_ZONES, *period sizes, 24),
+        NaN where a zone had no trips (or no stations/residents)
+      metrics (list of strings): names along the first axis
+      periods (list of strings): period axes from taxi_aggregate.PERIODS
+      bins (dict): metric -> color bin edges
+    '''
+
+    def __init__(self, values, metrics, periods=(), bins=None):
+        self.values = values
+        self.metrics = list(metrics)
+        self.periods = list(periods)
+        self.bins = bins or {metric: color_bins(values[position]) for position, metric in enumerate(self.metrics)}
+        self._metric_index = {metric: position for position, metric in enumerate(self.metrics)}
+
+    @classmethod
+    def from_tables(cls, pickups, dropoffs, stations_per_zone=None, residents_per_zone=None, n_zones=N_ZONES,
+                    min_residents=MIN_RESIDENTS):
+        '''
+        Build the cube from the aggregated pickup and dropoff tables.
+
+        Inputs:
+          pickups, dropoffs (pandas dataframes): in the taxi_aggregate/Spark
+            schema, optionally with month and day_of_week columns
+          stations_per_zone (numpy array): charging stations per LocationID
+            (length n_zones), for the per-station metrics
+          residents_per_zone (numpy array): population per LocationID, for
+            the per-capita metrics
+          n_zones (int): length of the zone axis, one more than the largest
+            LocationID (regions other than NYC can have more zones)
+          min_residents (float): zones with fewer residents get NaN per-capita
+            values
+
+        Returns: DemandCube
+        '''
+        periods = [name for name in PERIODS if name in pickups.columns]
+        shape = (n_zones,) + tuple(PERIODS[name] for name in periods) + (HOURS,)
+        counts = {}
+        for (metric, location_column, count_column), table in zip(SIDES, [pickups, dropoffs]):
+            index = (table[location_column].to_numpy(dtype=np.intp),) \
+                + tuple(table[name].to_numpy(dtype=np.intp) - 1 for name in periods) \
+                + (table['hour_of_day'].to_numpy(dtype=np.intp),)
+            cube = np.full(shape, np.nan)
+            cube[index] = table[count_column].to_numpy(dtype=float)
+            counts[metric] = cube
+
+        metrics, layers = list(counts), list(counts.values())
+        # Zone totals broadcast along the period and hour axes
+        extra_axes = (slice(None),) + (None,) * (len(shape) - 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if stations_per_zone is not None:
+                stations = np.where(np.asarray(stations_per_zone) > 0, stations_per_zone, np.nan)
+                metrics += ['pickups_per_station', 'dropoffs_per_station']
+                layers += [counts['pickup_count'] / stations[extra_axes],
+                           counts['dropoff_count'] / stations[extra_axes]]
+            if residents_per_zone is not None:
+                residents = np.asarray(residents_per_zone, dtype=float)
+                residents = np.where((residents >= min_residents) & (residents > 0), residents, np.nan) / 1000
+                metrics += ['pickups_per_1000_residents', 'dropoffs_per_1000_residents']
+                layers += [counts['pickup_count'] / residents[extra_axes],
+                           counts['dropoff_count'] / residents[extra_axes]]
+        return cls(np.stack(layers), metrics, periods)
+
+    def zone_values(self, metric, hour, **periods):
+        '''
+        Values of every zone for one metric, hour and (if the cube has
+        period axes) period, e.g. month=1.
+
+        Returns: numpy array indexed by LocationID (a view of the cube)
+        '''
+        index = (self._metric_index[metric], slice(None)) + tuple(periods[name] - 1 for name in self.periods)
+        return self.values[index + (hour,)]
+
+    def save(self, path):
+        '''
+        Write the values to path (.npy) and the axes and bins next to it (.json).
+        '''
+        np.save(path, np.ascontiguousarray(self.values))
+        with open(_meta_path(path), 'w') as file:
+            json.dump({'metrics': self.metrics, 'periods': self.periods, 'bins': self.bins}, file)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        '''
+        Read a saved cube, memory-mapping the values by default.
+
+        Returns: DemandCube
+        '''
+        with open(_meta_path(path)) as file:
+            meta = json.load(file)
+        return cls(np.load(path, mmap_mode=mmap_mode), meta['metrics'], meta['periods'], meta['bins'])
+
+
+def _meta_path(path):
+    return path[:-len('.npy')] + '.json' if path.endswith('.npy') else path + '.json'
+
+
+def zone_totals(zone_ids, values=None, n_zones=N_ZONES):
+    '''
+    Sum values (default: one per row) by taxi zone LocationID.
+
+    Returns: numpy array of length n_zones
+    '''
+    zone_ids = np.asarray(zone_ids, dtype=float)
+    keep = ~np.isnan(zone_ids)
+    weights = None if values is None else np.asarray(values, dtype=float)[keep]
+    return np.bincount(zone_ids[keep].astype(np.intp), weights=weights, minlength=n_zones)[:n_zones]
+
+
+def load_or_build(key, build, cache_dir=DEMAND_CUBE_DIR):
+    '''
+    Memory-map the cube saved under key in cache_dir, or build it with
+    build() and save it there.
+
+    Inputs:
+      key (string): e.g. a data_hash() of the cube's inputs
+      build (function): returns a DemandCube; only called when no cube is saved
+      cache_dir (string): where cubes are saved (default: DEMAND_CUBE_DIR;
+        None builds the cube in memory only)
+
+    Returns: DemandCube
+    '''
+    if not cache_dir:
+        return build()
+    name = hashlib.sha1(key.encode()).hexdigest()
+    path = os.path.join(cache_dir, f'demand_cube_{name}.npy')
+    if not (os.path.exists(path) and os.path.exists(_meta_path(path))):
+        os.makedirs(cache_dir, exist_ok=True)
+        # Written under a temporary name first so concurrent workers never map a partial file
+        tmp_path = f'{path[:-len(".npy")]}.{os.getpid()}.tmp.npy'
+        build().save(tmp_path)
+        os.replace(_meta_path(tmp_path), _meta_path(path))
+        os.replace(tmp_path, path)
+    return DemandCube.load(path)
@@ -0,0 +1,181 @@
+# Geometry preparation for the choropleth maps: a dissolved boundary for the world mask and
+# simplified, coordinate-quantized copies of a polygon layer for a few zoom ranges.
+#
+# Simplification runs in a metric CRS with shapely.coverage_simplify, which simplifies the
+# edges shared by neighbouring polygons once so no gaps or slivers open up between them
+# (falling back to per-polygon topology-preserving simplify on older GEOS or invalid
+# coverages). Coordinates are then snapped to a grid matching the tier's tolerance, which
+# shrinks the GeoJSON text without moving shared vertices apart. Prepared tiers are cached
+# in memory and, if GEOMETRY_CACHE_DIR is set, on disk keyed by a hash of the input.
+#
+# Tiers are served at /geometry/<layer>/<version>/<tier>.json, where version is a hash of
+# the layer's GeoJSON, so browsers may cache them for good: changed geometry gets a new URL.
+import hashlib
+import os
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from flask import Response, abort, request
+from shapely.geometry import box
+
+from elec_transit_y.cache import LRUCache, data_hash
+
+# Cache-Control of responses whose URL holds the current version, and of all others
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+# Zoom tiers: (name, minimum zoom, simplification tolerance in metres, decimals kept in lon/lat)
+TIERS = [
+    ('low', 0, 40.0, 4),
+    ('mid', 12, 10.0, 5),
+    ('high', 14, 2.0, 5)
+]
+
+_tier_cache = LRUCache(maxsize=8, persist_dir=os.environ.get('GEOMETRY_CACHE_DIR'), namespace='geometry')
+
+
+def is_coverage(geometries):
+    '''
+    Whether polygons form a valid coverage (no overlaps, neighbours share
+    identical edges), which the coverage operations below require.
+    '''
+    try:
+        return bool(shapely.coverage_is_valid(np.asarray(geometries, dtype=object)))
+    except (AttributeError, shapely.errors.UnsupportedGEOSVersionError):
+        return False
+
+
+def simplify_coverage(geometries, tolerance, coverage=None):
+    '''
+    Simplify polygons that tile an area without moving their shared edges
+    apart.
+
+    Inputs:
+      geometries (array of shapely polygons): in a metric CRS
+      tolerance (float): maximum distance a vertex may move, in CRS units
+      coverage (bool): result of is_coverage(), computed if not given
+
+    Returns: array of shapely geometries
+    '''
+    geometries = np.asarray(geometries, dtype=object)
+    if coverage is None:
+        coverage = is_coverage(geometries)
+    if coverage:
+        return shapely.coverage_simplify(geometries, tolerance)
+    return shapely.simplify(geometries, tolerance, preserve_topology=True)
+
+
+def quantize(geometries, decimals):
+    '''
+    Snap coordinates to a grid of 10^-decimals, dropping the repeated
+    vertices and slivers this creates. Vertices shared by neighbours snap
+    identically; polygons too small to survive are snapped point by point
+    instead of being dropped, so every feature is kept.
+
+    Returns: array of shapely geometries
+    '''
+    geometries = np.asarray(geometries, dtype=object)
+    grid_size = 10.0 ** -decimals
+    snapped = shapely.set_precision(geometries, grid_size)
+    collapsed = shapely.is_empty(snapped) & ~shapely.is_empty(geometries)
+    if collapsed.any():
+        snapped[collapsed] = shapely.set_precision(geometries[collapsed], grid_size, mode='pointwise')
+    return snapped
+
+
+def dissolve(geometries, coverage=None):
+    '''
+    Union of all polygons of a layer (e.g. the outline of NYC from its census
+    tracts), using the much faster coverage union when possible.
+
+    Returns: shapely geometry
+    '''
+    geometries = np.asarray(geometries, dtype=object)
+    if coverage is None:
+        coverage = is_coverage(geometries)
+    if coverage:
+        return shapely.coverage_union_all(geometries)
+    return shapely.union_all(geometries)
+
+
+class GeometryTiers:
+    '''
+    Simplified GeoJSON copies of a polygon layer, one per zoom tier, plus the
+    layer's dissolved outline and a world mask with the outline cut out.
+
+    Every tier has the same features in the same order, each with an
+    '_index' property, so per-feature values can be applied to any tier.
+    version is a short hash of the tiers' GeoJSON, used in their URLs.
+
+    Inputs:
+      gdf (geopandas dataframe): polygons in any CRS
+      columns (list of strings): properties to keep on the features
+      tiers (list of tuples): see TIERS
+    '''
+
+    def __init__(self, gdf, columns=(), tiers=TIERS):
+        self.tiers = list(tiers)
+        metric = gdf.to_crs(gdf.estimate_utm_crs())
+        properties = gdf[list(columns)].reset_index(drop=True)
+        properties['_index'] = np.arange(len(gdf))
+
+        coverage = is_coverage(metric.geometry.values)
+
+        self.geojson = {}
+        for name, _, tolerance, decimals in self.tiers:
+            simplified = gpd.GeoSeries(simplify_coverage(metric.geometry.values, tolerance, coverage), crs=metric.crs)
+            geometries = quantize(simplified.to_crs('EPSG:4326').values, decimals)
+            features = gpd.GeoDataFrame(properties, geometry=geometries, crs='EPSG:4326')
+            self.geojson[name] = features.to_json(drop_id=True)
+        digest = hashlib.sha1()
+        for name in self.geojson:
+            digest.update(name.encode())
+            digest.update(self.geojson[name].encode())
+        self.version = digest.hexdigest()[:12]
+
+        # Outline and mask use the coarsest tier's tolerance
+        _, _, tolerance, decimals = self.tiers[0]
+        outline = gpd.GeoSeries([dissolve(metric.geometry.values, coverage)], crs=metric.crs).simplify(tolerance)
+        self.boundary = quantize(outline.to_crs('EPSG:4326').values, decimals)[0]
+        world = box(-180, -90, 180, 90)
+        self.mask_geojson = gpd.GeoSeries([world.difference(self.boundary)], crs='EPSG:4326').to_json(drop_id=True)
+
+    def zoom_breaks(self):
+        '''
+        Returns: list of [minimum zoom, tier name] pairs for the browser
+        '''
+        return [[min_zoom, name] for name, min_zoom, _, _ in self.tiers]
+
+
+def prepared_tiers(gdf, columns=(), tiers=TIERS):
+    '''
+    GeometryTiers for a layer, built once per distinct input.
+
+    Returns: GeometryTiers
+    '''
+    key = (data_hash(gdf), tuple(columns), tuple(tiers))
+    return _tier_cache.get_or_create(key, lambda: GeometryTiers(gdf, columns, tiers))
+
+
+def register_geometry_routes(server, layers):
+    '''
+    Serve the prepared tiers at /geometry/<layer>/<version>/<tier>.json so
+    maps can fetch a finer tier when the user zooms in. Responses for the
+    layer's current version are cached for good; a page still holding an
+    older version gets the current tiers, revalidated by ETag.
+
+    Inputs:
+      server (flask app): the Dash app's server
+      layers (dict): layer name -> GeometryTiers
+    '''
+    def geometry_tier(layer, version, tier):
+        if layer not in layers or tier not in layers[layer].geojson:
+            abort(404)
+        tiers = layers[layer]
+        response = Response(tiers.geojson[tier], mimetype='application/json')
+        response.set_etag(f'{tiers.version}-{tier}')
+        response.headers['Cache-Control'] = IMMUTABLE if version == tiers.version else REVALIDATE
+        return response.make_conditional(request)
+
+    server.add_url_rule('/geometry/<layer>/<version>/<tier>.json', 'geometry_tier', geometry_tier)
@@ -0,0 +1,281 @@
+# Custom folium layers: choropleths restyled in the browser and vector tile layers
+import json
+
+import numpy as np
+from branca.element import MacroElement
+from branca.utilities import color_brewer
+from folium.elements import JSCSSMixin
+from jinja2 import Template
+
+
+class RestylableChoropleth(MacroElement):
+    '''
+    GeoJSON choropleth that is sent to the browser once and recolored in place.
+
+    The rendered page defines window.restyleChoropleth(frame), where frame is
+    a dict produced by choropleth_frame(): one value per feature (in the
+    order of the GeoDataFrame) plus the bin edges, one color per bin and the
+    legend caption. Fill colors follow folium.Choropleth (linear bins, black
+    for missing values).
+    On load the page also applies window.parent.latestChoroplethFrame, so a
+    frame pushed while the iframe was still loading is not lost.
+
+    With tiers (see elec_transit_y.geometry.GeometryTiers) the layer starts
+    with the coarsest simplified geometry and, on zoomend, fetches the tier
+    for the new zoom from tiers_url and swaps it in, keeping the colors.
+
+    Inputs:
+      gdf (geopandas dataframe): geometries in EPSG:4326 (ignored with tiers)
+      tooltip_field (string): optional column shown on hover
+      tiers (GeometryTiers): optional zoom-dependent geometry
+      tiers_url (string): URL template with a {tier} placeholder
+      follow_parent (bool): apply frames pushed by the parent page
+    '''
+
+    _template = Template(u"""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = L.geoJson({{ this.geojson }}, {
+            style: function(feature) {
+                return {color: 'black', weight: 1, opacity: {{ this.line_opacity }},
+                        fillColor: 'black', fillOpacity: {{ this.fill_opacity }}};
+            },
+            onEachFeature: function(feature, layer) {
+                {% if this.tooltip_field %}
+                layer.bindTooltip(String(feature.properties[{{ this.tooltip_field|tojson }}]));
+                {% endif %}
+                layer.on('mouseover', function() { layer.setStyle({weight: 3}); });
+                layer.on('mouseout', function() { layer.setStyle({weight: 1}); });
+            }
+        }).addTo({{ this._parent.get_name() }});
+
+        var {{ this.get_name() }}_legend = L.control({position: 'topright'});
+        {{ this.get_name() }}_legend.onAdd = function() {
+            this._div = L.DomUtil.create('div', 'info legend');
+            this._div.style.background = 'white';
+            this._div.style.padding = '6px 8px';
+            return this._div;
+        };
+        {{ this.get_name() }}_legend.addTo({{ this._parent.get_name() }});
+
+        var {{ this.get_name() }}_frame = null;
+        window.restyleChoropleth = function(frame) {
+            {{ this.get_name() }}_frame = frame;
+            var colors = frame.colors;
+            var values = frame.values;
+            var bins = frame.bins;
+            function colorFor(value) {
+                if (value === null || value === undefined) { return 'black'; }
+                for (var i = 1; i < bins.length - 1; i++) {
+                    if (value <= bins[i]) { return colors[i - 1]; }
+                }
+                return colors[colors.length - 1];
+            }
+            {{ this.get_name() }}.eachLayer(function(layer) {
+                layer.setStyle({fillColor: colorFor(values[layer.feature.properties._index])});
+            });
+            // Bin edges to three significant digits, so fractional bins stay readable
+            function formatEdge(value) {
+                return Number(value).toLocaleString('en-US', {maximumSignificantDigits: 3});
+            }
+            var html = '<b>' + frame.caption + '</b><br>';
+            for (var i = 0; i < colors.length; i++) {
+                html += '<i style="background:' + colors[i] + ';width:18px;height:12px;display:inline-block"></i> '
+                     + formatEdge(bins[i]) + ' &ndash; ' + formatEdge(bins[i + 1]) + '<br>';
+            }
+            {{ this.get_name() }}_legend._div.innerHTML = html;
+        };
+
+        {% if this.initial_frame %}
+        window.restyleChoropleth({{ this.initial_frame|tojson }});
+        {% endif %}
+        {% if this.follow_parent %}
+        try {
+            if (window.parent && window.parent.latestChoroplethFrame) {
+                window.restyleChoropleth(window.parent.latestChoroplethFrame);
+            }
+        } catch (e) {}
+        {% endif %}
+
+        {% if this.tiers_url %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            var breaks = {{ this.zoom_breaks|tojson }};
+            var current = breaks[0][1];
+            function tierFor(zoom) {
+                var name = breaks[0][1];
+                for (var i = 0; i < breaks.length; i++) {
+                    if (zoom >= breaks[i][0]) { name = breaks[i][1]; }
+                }
+                return name;
+            }
+            function showTier() {
+                var tier = tierFor(map.getZoom());
+                if (tier === current) { return; }
+                current = tier;
+                fetch({{ this.tiers_url|tojson }}.replace('{tier}', tier))
+                    .then(function(response) { return response.json(); })
+                    .then(function(data) {
+                        if (tier !== current) { return; }
+                        {{ this.get_name() }}.clearLayers();
+                        {{ this.get_name() }}.addData(data);
+                        if ({{ this.get_name() }}_frame) { window.restyleChoropleth({{ this.get_name() }}_frame); }
+                    });
+            }
+            map.on('zoomend', showTier);
+            showTier();
+        })();
+        {% endif %}
+        {% endmacro %}
+        """)
+
+    def __init__(self, gdf, tooltip_field=None, fill_opacity=0.7, line_opacity=0.2, initial_frame=None,
+                 tiers=None, tiers_url=None, follow_parent=True):
+        super().__init__()
+        self._name = 'RestylableChoropleth'
+        if tiers is not None:
+            self.geojson = tiers.geojson[tiers.tiers[0][0]]
+            self.zoom_breaks = tiers.zoom_breaks()
+        else:
+            columns = [tooltip_field] if tooltip_field else []
+            features = gdf[columns + [gdf.geometry.name]].copy()
+            features['_index'] = np.arange(len(features))
+            self.geojson = json.dumps(features.__geo_interface__)
+            self.zoom_breaks = None
+        # Keep a '</script>' inside a property from ending the inline script
+        self.geojson = self.geojson.replace('</', '<\\/')
+        self.tiers_url = tiers_url if tiers is not None else None
+        self.follow_parent = follow_parent
+        self.tooltip_field = tooltip_field
+        self.fill_opacity = fill_opacity
+        self.line_opacity = line_opacity
+        self.initial_frame = initial_frame
+
+
+def palette(fill_color, n):
+    '''
+    n colors of a ColorBrewer scheme, which starts at three colors.
+
+    Returns: list of hex colors
+    '''
+    return color_brewer(fill_color, max(n, 3))[-n:] if n > 0 else []
+
+
+def choropleth_frame(values, caption, bins=6, fill_color='OrRd'):
+    '''
+    Build the per-frame payload for RestylableChoropleth.
+
+    Inputs:
+      values (array-like): one value per feature, NaN where there is no data
+      caption (string): legend caption
+      bins (int or list of floats): number of color classes, or fixed bin
+        edges (e.g. shared by every hour of a metric)
+      fill_color (string): ColorBrewer scheme name
+
+    Returns: dict with 'values', 'bins', 'colors' (one per bin) and 'caption'
+    (JSON-serializable)
+    '''
+    values = np.asarray(values, dtype=float)
+    present = values[~np.isnan(values)]
+    if len(present) == 0:
+        present = np.zeros(1)
+    edges = np.histogram_bin_edges(present, bins=bins)
+    return {
+        'values': [None if np.isnan(value) else (int(value) if value.is_integer() else float(value))
+                   for value in values],
+        'bins': edges.tolist(),
+        'colors': palette(fill_color, len(edges) - 1),
+        'caption': caption
+    }
+
+
+class VectorTileLayer(JSCSSMixin, MacroElement):
+    '''
+    Layer drawn from the /tiles/<layer>/<version>/{z}/{x}/{y}.pbf endpoint (see
+    elec_transit_y.tiles) with Leaflet.VectorGrid, so the page only loads the
+    features in view instead of embedding the whole layer.
+
+    Points are drawn as circles; polygons are filled by binning value_field
+    like RestylableChoropleth (black where the value is missing). Clicking a
+    feature opens a popup with popup_fields, when its tile carries them.
+
+    Inputs:
+      url (string): tile URL template with {z}, {x} and {y}
+      layer (string): layer name inside the tiles
+      popup_fields (list of tuples): (label, property) rows for the popup
+      value_field (string): property colored by bins, for polygon layers
+      bins (list of floats): bin edges for value_field
+      fill_color (string): ColorBrewer scheme name
+      color (string): point/outline color
+      max_native_zoom (int): deepest zoom the server generates; the layer
+        overzooms those tiles past it
+    '''
+
+    _template = Template(u"""
+        {% macro script(this, kwargs) %}
+        // Leaflet 1.9 dropped fakeStop, which VectorGrid's click handling still calls
+        L.DomEvent.fakeStop = L.DomEvent.fakeStop || function() { return true; };
+        var {{ this.get_name() }}_style = function(properties, zoom) {
+            {% if this.value_field %}
+            var colors = {{ this.colors|tojson }};
+            var bins = {{ this.bins|tojson }};
+            var value = properties[{{ this.value_field|tojson }}];
+            var fill = 'black';
+            if (value !== null && value !== undefined) {
+                fill = colors[colors.length - 1];
+                for (var i = 1; i < bins.length - 1; i++) {
+                    if (value <= bins[i]) { fill = colors[i - 1]; break; }
+                }
+            }
+            return {fill: true, fillColor: fill, fillOpacity: {{ this.fill_opacity }},
+                    color: 'black', weight: 1, opacity: {{ this.line_opacity }}};
+            {% else %}
+            return {radius: zoom < 8 ? 2 : 5, fill: true, fillColor: {{ this.color|tojson }},
+                    fillOpacity: 0.8, color: {{ this.color|tojson }}, weight: 1};
+            {% endif %}
+        };
+        var {{ this.get_name() }} = L.vectorGrid.protobuf({{ this.url|tojson }}, {
+            rendererFactory: L.canvas.tile,
+            interactive: true,
+            maxNativeZoom: {{ this.max_native_zoom }},
+            vectorTileLayerStyles: {{ '{' }}{{ this.layer|tojson }}: {{ this.get_name() }}_style{{ '}' }}
+        }).addTo({{ this._parent.get_name() }});
+
+        {% if this.popup_fields %}
+        {{ this.get_name() }}.on('click', function(e) {
+            var fields = {{ this.popup_fields|tojson }};
+            var properties = e.layer.properties || {};
+            function escape(value) {
+                return String(value).replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;');
+            }
+            var rows = [];
+            for (var i = 0; i < fields.length; i++) {
+                var value = properties[fields[i][1]];
+                if (value !== undefined) { rows.push('<b>' + fields[i][0] + ':</b> ' + escape(value)); }
+            }
+            var html = rows.length ? rows.join('<br>') : 'Zoom in for details';
+            L.popup({maxWidth: 500}).setLatLng(e.latlng).setContent(html)
+                .openOn({{ this._parent.get_name() }});
+            L.DomEvent.stop(e);
+        });
+        {% endif %}
+        {% endmacro %}
+        """)
+
+    default_js = [
+        ('leaflet_vectorgrid', 'https://unpkg.com/leaflet.vectorgrid@1.3.0/dist/Leaflet.VectorGrid.bundled.js')
+    ]
+
+    def __init__(self, url, layer, popup_fields=(), value_field=None, bins=None, fill_color='OrRd',
+                 fill_opacity=0.7, line_opacity=0.2, color='#3388ff', max_native_zoom=16):
+        super().__init__()
+        self._name = 'VectorTileLayer'
+        self.url = url
+        self.layer = layer
+        self.popup_fields = [list(field) for field in popup_fields]
+        self.value_field = value_field
+        self.bins = [float(edge) for edge in bins] if bins is not None else None
+        self.colors = palette(fill_color, len(self.bins) - 1) if self.bins else None
+        self.fill_opacity = fill_opacity
+        self.line_opacity = line_opacity
+        self.color = color
+        self.max_native_zoom = max_native_zoom
@@ -0,0 +1,467 @@
+# Lightweight timing and metrics for the dashboards, exposed in the Prometheus text format
+#
+#   with stage('click.radius_query'):      time a block (or decorate a function with
+#       ...                                @stage('...')) into a per-stage latency histogram
+#   watch_cache('click', click_cache)      report an LRUCache's hits, misses and size
+#   register_metrics_routes(server)        serve everything at /metrics and time every
+#                                          request, with callbacks labeled by their output
+#
+# Every request is recorded in a latency and a response size histogram. Dash callbacks
+# are all posted to /_dash-update-component, so they are labeled with the callback's
+# output as well as the route. Stage timings recorded at startup (data loading, index
+# builds, initial maps) show up as stages with a count of 1.
+#
+# Every process of the app (gunicorn workers, background callback jobs, see
+# background.py) records into its own memory and writes it to METRICS_DIR/metrics-<pid>.json
+# after each request or job (at most every METRICS_FLUSH_INTERVAL seconds, and before
+# forking), and /metrics merges the files of all processes, so any worker answers a scrape
+# with the totals of the whole app. A forked process starts counting from zero, so what it
+# inherited is not counted twice; files of exited processes are folded into
+# metrics-archive.json at scrape time. Cache entries are a gauge per live process (pid
+# label); everything else is summed. METRICS_DIR defaults to a new temporary directory
+# that forked processes inherit (gunicorn.conf.py creates it in the master).
+# Set METRICS=0 to turn recording and the route off.
+#
+# With METRICS_PROFILE_DIR set, a sampling profiler can record individual requests: any
+# request sent with an "X-Profile: 1" header, and with METRICS_PROFILE_SLOW=<seconds>
+# every request that took longer than that. Profiles are written to the directory as
+# collapsed stacks (one "frame;frame;frame count" line per stack), which flamegraph.pl
+# and speedscope read.
+import collections
+import contextlib
+import fcntl
+import glob
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+METRICS_ENABLED = os.environ.get('METRICS', '1') == '1'
+# Directory of the per-process metrics files (None: created by register_metrics_routes)
+METRICS_DIR = os.environ.get('METRICS_DIR')
+# Least seconds between two writes of a process's metrics file
+FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1))
+PROFILE_DIR = os.environ.get('METRICS_PROFILE_DIR')
+PROFILE_SLOW_SECONDS = float(os.environ.get('METRICS_PROFILE_SLOW', 0))
+# Seconds between the profiler's stack samples
+PROFILE_INTERVAL = float(os.environ.get('METRICS_PROFILE_INTERVAL', 0.005))
+
+PREFIX = 'elec_transit_y'
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# 256 B to 64 MB in factors of 4
+SIZE_BUCKETS = tuple(256 * 4 ** power for power in range(10))
+
+
+class Histogram:
+    '''
+    Thread-safe histogram with labels, in the Prometheus histogram format.
+
+    Inputs:
+      name (string): metric name (without PREFIX)
+      description (string): HELP text
+      labels (list of strings): label names
+      buckets (tuple of floats): upper bounds of the buckets
+    '''
+
+    def __init__(self, name, description, labels, buckets=LATENCY_BUCKETS):
+        self.name = f'{PREFIX}_{name}'
+        self.description = description
+        self.labels = list(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _after_fork(self):
+        # The lock may have been held by another thread of the parent
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        '''
+        Returns: list of [label values, bucket counts, sum, count]
+        '''
+        with self._lock:
+            return [[list(labels), list(counts), total, count]
+                    for labels, (counts, total, count) in self._series.items()]
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][position] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def exposition(self, series):
+        '''
+        Exposition lines of snapshot() series, summing those with the same labels
+        (e.g. the series of several processes).
+        '''
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        for label_values, counts, total, count in sorted(_merge_series(series)):
+            labels = list(zip(self.labels, label_values))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{_labels(labels + [("le", f"{bound:g}")])} {cumulative}')
+            lines.append(f'{self.name}_bucket{_labels(labels + [("le", "+Inf")])} {count}')
+            lines.append(f'{self.name}_sum{_labels(labels)} {total:.6f}')
+            lines.append(f'{self.name}_count{_labels(labels)} {count}')
+        return lines
+
+
+def _merge_series(series):
+    # Sum histogram series [label values, bucket counts, sum, count] with the same labels
+    merged = {}
+    for label_values, counts, total, count in series:
+        entry = merged.get(tuple(label_values))
+        if entry is None:
+            merged[tuple(label_values)] = [list(label_values), list(counts), total, count]
+        else:
+            entry[1] = [merged_count + bucket_count for merged_count, bucket_count in zip(entry[1], counts)]
+            entry[2] += total
+            entry[3] += count
+    return list(merged.values())
+
+
+def _labels(pairs):
+    # {name="value",...} with backslashes, quotes and newlines escaped
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in pairs]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+STAGE_SECONDS = Histogram('stage_seconds', 'Time spent in each instrumented stage.', ['stage'])
+REQUEST_SECONDS = Histogram('request_seconds', 'Time to answer a request, per route and callback output.',
+                            ['route', 'output'])
+RESPONSE_BYTES = Histogram('response_bytes', 'Size of response bodies, per route and callback output.',
+                           ['route', 'output'], buckets=SIZE_BUCKETS)
+
+HISTOGRAMS = [STAGE_SECONDS, REQUEST_SECONDS, RESPONSE_BYTES]
+
+# Cache name -> LRUCache (anything with hits, misses and a length)
+_caches = {}
+# Cache name -> (hits, misses) inherited when this process was forked
+_cache_baselines = {}
+
+
+class stage(contextlib.ContextDecorator):
+    '''
+    Time a block, or every call of a decorated function, into STAGE_SECONDS.
+
+        with stage('nyc.render_map'):
+            ...
+
+        @stage('click.neighbor_graphs')
+        def generate_graphs(...):
+            ...
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self._starts = threading.local()
+
+    def __enter__(self):
+        # A stack per thread, so a decorated function can run in several threads or recursively
+        if not hasattr(self._starts, 'stack'):
+            self._starts.stack = []
+        self._starts.stack.append(time.perf_counter())
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self._starts.stack.pop()
+        if METRICS_ENABLED:
+            STAGE_SECONDS.observe(elapsed, self.name)
+        return False
+
+
+def watch_cache(name, cache):
+    '''
+    Report cache's hits, misses and number of entries on /metrics.
+
+    Inputs:
+      name (string): label of the cache, e.g. 'click'
+      cache (LRUCache)
+    '''
+    _caches[name] = cache
+
+
+def snapshot():
+    '''
+    This process's metrics, as written to its metrics file.
+
+    Returns: dict with the pid, histogram name -> Histogram.snapshot() and
+    cache name -> [hits, misses, entries]
+    '''
+    caches = {}
+    for name, cache in list(_caches.items()):
+        hits, misses = _cache_baselines.get(name, (0, 0))
+        caches[name] = [cache.hits - hits, cache.misses - misses, len(cache)]
+    return {'pid': os.getpid(), 'histograms': {histogram.name: histogram.snapshot() for histogram in HISTOGRAMS},
+            'caches': caches}
+
+
+def _write_json(path, value):
+    # Readers never see a partly written file
+    with open(path + '.tmp', 'w') as file:
+        json.dump(value, file)
+    os.replace(path + '.tmp', path)
+
+
+# Whether this process writes a metrics file (set by register_metrics_routes, inherited by
+# forked processes), when it last did and the timer of a deferred write
+_flush_state = {'shared': False, 'last': 0.0, 'timer': None}
+_flush_lock = threading.Lock()
+
+
+def flush(force=False):
+    '''
+    Write this process's metrics file. A write sooner than FLUSH_INTERVAL
+    after the last one is deferred to a timer, unless force is set.
+    '''
+    if not _flush_state['shared']:
+        return
+    with _flush_lock:
+        wait = _flush_state['last'] + FLUSH_INTERVAL - time.monotonic()
+        if wait > 0 and not force:
+            if _flush_state['timer'] is None:
+                _flush_state['timer'] = threading.Timer(wait, _deferred_flush)
+                _flush_state['timer'].daemon = True
+                _flush_state['timer'].start()
+            return
+        _flush_state['last'] = time.monotonic()
+        _write_json(os.path.join(METRICS_DIR, f'metrics-{os.getpid()}.json'), snapshot())
+
+
+def _deferred_flush():
+    with _flush_lock:
+        _flush_state['timer'] = None
+    flush(force=True)
+
+
+def _after_fork():
+    # The child counts from zero, so what it inherited is only counted in the parent's
+    # file; locks may have been held by other threads of the parent
+    global _flush_lock
+    _flush_lock = threading.Lock()
+    _flush_state.update(last=0.0, timer=None)
+    for histogram in HISTOGRAMS:
+        histogram._after_fork()
+    for name, cache in _caches.items():
+        _cache_baselines[name] = (cache.hits, cache.misses)
+
+
+if METRICS_ENABLED and hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=lambda: flush(force=True), after_in_child=_after_fork)
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_json(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def collect():
+    '''
+    Read the metrics files of all processes, folding those of exited
+    processes into metrics-archive.json.
+
+    Returns: list of metrics dicts (see snapshot()), the archive's first
+    '''
+    flush(force=True)
+    archive_path = os.path.join(METRICS_DIR, 'metrics-archive.json')
+    with open(os.path.join(METRICS_DIR, 'metrics.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        archive = _read_json(archive_path) or {'pid': None, 'histograms': {}, 'caches': {}}
+        live, dead = [], []
+        for path in glob.glob(os.path.join(METRICS_DIR, 'metrics-[0-9]*.json')):
+            metrics = _read_json(path)
+            if metrics is None:
+                continue
+            if _is_alive(metrics['pid']):
+                live.append(metrics)
+            else:
+                dead.append((path, metrics))
+        if dead:
+            for _, metrics in dead:
+                for name, series in metrics['histograms'].items():
+                    archive['histograms'][name] = _merge_series(archive['histograms'].get(name, []) + series)
+                for name, (hits, misses, _) in metrics['caches'].items():
+                    counts = archive['caches'].setdefault(name, [0, 0, 0])
+                    counts[0] += hits
+                    counts[1] += misses
+            _write_json(archive_path, archive)
+            for path, _ in dead:
+                os.remove(path)
+    return [archive] + sorted(live, key=lambda metrics: metrics['pid'])
+
+
+def exposition():
+    '''
+    All metrics in the Prometheus text exposition format: those of every
+    process sharing METRICS_DIR once register_metrics_routes has run, and
+    this process's alone before.
+
+    Returns: string
+    '''
+    processes = collect() if _flush_state['shared'] else [snapshot()]
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines += histogram.exposition([series for metrics in processes
+                                       for series in metrics['histograms'].get(histogram.name, [])])
+    totals = {}
+    for metrics in processes:
+        for name, (hits, misses, _) in metrics['caches'].items():
+            counts = totals.setdefault(name, [0, 0])
+            counts[0] += hits
+            counts[1] += misses
+    for metric, description, position in [
+        ('cache_hits_total', 'Cache lookups that found a value.', 0),
+        ('cache_misses_total', 'Cache lookups that had to build the value.', 1)
+    ]:
+        lines += [f'# HELP {PREFIX}_{metric} {description}', f'# TYPE {PREFIX}_{metric} counter']
+        lines += [f'{PREFIX}_{metric}{_labels([("cache", name)])} {counts[position]}'
+                  for name, counts in sorted(totals.items())]
+    # The archive (pid None) holds no entries: they left with their process
+    lines += [f'# HELP {PREFIX}_cache_entries Values held in memory by each cache of each process.',
+              f'# TYPE {PREFIX}_cache_entries gauge']
+    lines += [f'{PREFIX}_cache_entries{_labels([("cache", name), ("pid", metrics["pid"])])} {entries}'
+              for metrics in processes if metrics['pid'] is not None
+              for name, (_, _, entries) in sorted(metrics['caches'].items())]
+    return '\n'.join(lines) + '\n'
+
+
+class SamplingProfiler:
+    '''
+    Sample the stack of one thread every interval seconds from a background
+    thread, counting how often each stack was seen.
+
+    Inputs:
+      thread_id (int): threading.get_ident() of the thread to profile
+      interval (float): seconds between samples
+    '''
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def write(self, path):
+        '''
+        Write the samples as collapsed stacks.
+        '''
+        with open(path, 'w') as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f'{stack} {count}\n')
+
+
+def _request_labels(request):
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    output = ''
+    if request.path.endswith('/_dash-update-component'):
+        body = request.get_json(silent=True) or {}
+        output = body.get('output', '')
+    return route, output
+
+
+def register_metrics_routes(server, profile_dir=PROFILE_DIR, profile_slow=PROFILE_SLOW_SECONDS):
+    '''
+    Serve the metrics at /metrics and record the latency and response size
+    of every other request, optionally profiling slow ones.
+
+    Inputs:
+      server (flask app): the Dash app's server
+      profile_dir (string): where request profiles are written (None: no profiling)
+      profile_slow (float): profile every request and keep the profiles of
+        those slower than this many seconds (0: only X-Profile requests)
+    '''
+    if not METRICS_ENABLED:
+        return
+    from flask import Response, g, request
+
+    # Share this process's metrics with its workers and background jobs, which inherit
+    # the directory through the environment
+    global METRICS_DIR
+    if not METRICS_DIR:
+        METRICS_DIR = os.environ['METRICS_DIR'] = tempfile.mkdtemp(prefix='elec_transit_y_metrics-')
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    _flush_state['shared'] = True
+
+    def metrics():
+        return Response(exposition(), mimetype='text/plain; version=0.0.4')
+
+    def start_request():
+        if request.path == '/metrics':
+            return
+        g.metrics_start = time.perf_counter()
+        if profile_dir and (profile_slow or request.headers.get('X-Profile') == '1'):
+            g.metrics_profiler = SamplingProfiler(threading.get_ident()).start()
+
+    def finish_request(response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        route, output = _request_labels(request)
+        REQUEST_SECONDS.observe(elapsed, route, output)
+        size = response.content_length
+        if size is None and not response.is_streamed and not response.direct_passthrough:
+            size = len(response.get_data())
+        if size is not None:
+            RESPONSE_BYTES.observe(size, route, output)
+
+        profiler = g.pop('metrics_profiler', None)
+        if profiler is not None:
+            profiler.stop()
+            if request.headers.get('X-Profile') == '1' or (profile_slow and elapsed > profile_slow):
+                os.makedirs(profile_dir, exist_ok=True)
+                name = re.sub(r'[^A-Za-z0-9_.-]+', '_', output or request.path).strip('_')[:80]
+                profiler.write(os.path.join(profile_dir, f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-'
+                                                         f'{name}-{elapsed:.2f}s.folded'))
+        flush()
+        return response
+
+    server.before_request(start_request)
+    server.after_request(finish_request)
+    server.add_url_rule('/metrics', 'metrics', metrics)
@@ -0,0 +1,173 @@
+# Neighbour graphs between nearby EV stations for the click-to-analyze panel
+#
+# Stations around a click are projected to metres east/north of the click (an
+# equirectangular projection, accurate to well under 0.1% over the few kilometres a
+# click covers) and indexed with a KD-tree. k-nearest-neighbour and distance-band edges
+# come straight from the tree as (n, 2) arrays of row numbers, so a dense click with
+# thousands of stations takes milliseconds; the graphs are drawn as one Plotly line
+# trace each instead of a matplotlib figure serialized with mpld3.
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+from elec_transit_y.spatial_index import EARTH_RADIUS_KM
+
+EARTH_RADIUS_M = EARTH_RADIUS_KM * 1000
+
+
+def project_local(latitudes, longitudes, lat0, lon0):
+    '''
+    Project coordinates to metres east and north of (lat0, lon0).
+
+    Returns: (n, 2) numpy array
+    '''
+    lat = np.radians(np.asarray(latitudes, dtype=float))
+    lon = np.radians(np.asarray(longitudes, dtype=float))
+    x = EARTH_RADIUS_M * np.cos(np.radians(lat0)) * (lon - np.radians(lon0))
+    y = EARTH_RADIUS_M * (lat - np.radians(lat0))
+    return np.column_stack((x, y))
+
+
+def knn_edges(tree, k):
+    '''
+    Undirected k-nearest-neighbour edges: i-j is an edge when j is one of the
+    k nearest stations to i or the other way round.
+
+    Inputs:
+      tree (cKDTree): over projected coordinates
+      k (int): number of neighbours per station
+
+    Returns: ((m, 2) int array of row pairs with i < j, (m,) distances in metres)
+    '''
+    n = tree.n
+    k = min(k, n - 1)
+    if k < 1:
+        return np.empty((0, 2), dtype=np.intp), np.empty(0)
+    distances, neighbours = tree.query(tree.data, k=k + 1)
+    rows = np.arange(n)[:, None]
+    # Each row normally finds itself first; with duplicate coordinates it may not, and
+    # then the furthest of the k + 1 results is dropped instead
+    own = neighbours == rows
+    own[~own.any(axis=1), -1] = True
+    pairs = np.column_stack((np.broadcast_to(rows, neighbours.shape)[~own], neighbours[~own]))
+    distances = distances[~own]
+    pairs.sort(axis=1)
+    pairs, first = np.unique(pairs, axis=0, return_index=True)
+    return pairs, distances[first]
+
+
+def band_edges(tree, threshold):
+    '''
+    Edges between every pair of stations at most threshold metres apart.
+
+    Returns: ((m, 2) int array of row pairs with i < j, (m,) distances in metres)
+    '''
+    pairs = tree.query_pairs(threshold, output_type='ndarray').astype(np.intp)
+    distances = np.linalg.norm(tree.data[pairs[:, 0]] - tree.data[pairs[:, 1]], axis=1)
+    return pairs, distances
+
+
+def graph_stats(n, edges):
+    '''
+    Connectivity of a graph on n nodes.
+
+    Returns: dict with 'components', 'largest_component' (node count) and
+    'isolated' (nodes without edges)
+    '''
+    if n == 0:
+        return {'components': 0, 'largest_component': 0, 'isolated': 0}
+    adjacency = coo_matrix((np.ones(len(edges)), (edges[:, 0], edges[:, 1])), shape=(n, n))
+    components, labels = connected_components(adjacency, directed=False)
+    degree = np.bincount(edges.ravel(), minlength=n)
+    return {
+        'components': int(components),
+        'largest_component': int(np.bincount(labels).max()),
+        'isolated': int((degree == 0).sum())
+    }
+
+
+class NeighborGraph:
+    '''
+    k-nearest-neighbour and distance-band graphs over a set of stations.
+
+    Edge arrays hold row numbers into the stations the graph was built from.
+
+    Inputs:
+      latitudes, longitudes (array-like): station coordinates in degrees
+      center (tuple): (lat, lon) the projection is centred on, e.g. the click
+      k (int): neighbours per station for the KNN graph
+      threshold (float): distance band in metres
+    '''
+
+    def __init__(self, latitudes, longitudes, center, k=3, threshold=50.0):
+        self.k = k
+        self.threshold = threshold
+        self.xy = project_local(latitudes, longitudes, *center)
+        tree = cKDTree(self.xy)
+        self.knn, self.knn_distances = knn_edges(tree, k)
+        self.band, self.band_distances = band_edges(tree, threshold)
+        nearest = tree.query(self.xy, k=2)[0][:, 1] if len(self.xy) > 1 else np.empty(0)
+        self.nearest_distances = nearest
+
+    def __len__(self):
+        return len(self.xy)
+
+    def stats(self):
+        '''
+        Component counts of both graphs (isolated stations in the distance
+        band graph are coverage gaps) and the median and largest distance
+        from a station to its nearest neighbour.
+
+        Returns: dict
+        '''
+        return {
+            'stations': len(self),
+            'knn': graph_stats(len(self), self.knn),
+            'band': graph_stats(len(self), self.band),
+            'median_gap_m': float(np.median(self.nearest_distances)) if len(self.nearest_distances) else 0.0,
+            'largest_gap_m': float(self.nearest_distances.max()) if len(self.nearest_distances) else 0.0
+        }
+
+
+def _edge_trace(xy, edges, color, axes):
+    # All edges as one line trace, segments separated by gaps
+    segments = np.full((len(edges), 3, 2), np.nan)
+    segments[:, 0] = xy[edges[:, 0]]
+    segments[:, 1] = xy[edges[:, 1]]
+    segments = segments.reshape(-1, 2)
+    return {'type': 'scatter', 'x': segments[:, 0], 'y': segments[:, 1], 'mode': 'lines',
+            'line': {'color': color, 'width': 1}, 'hoverinfo': 'skip', 'showlegend': False,
+            'xaxis': axes[0], 'yaxis': axes[1]}
+
+
+def graph_figure(graph, labels=None):
+    '''
+    Side-by-side Plotly figure of the KNN and distance-band graphs, built as
+    a plain dict (plotly's validated graph objects cost more than the graphs).
+
+    Inputs:
+      graph (NeighborGraph)
+      labels (array-like): hover text per station, e.g. station names
+
+    Returns: plotly figure dict, usable as a dcc.Graph figure
+    '''
+    text = None if labels is None else [str(label) for label in labels]
+    # Decimetres are plenty on screen and keep the JSON payload small
+    xy = np.round(graph.xy, 1)
+    titles = [f'{graph.k}-Nearest Neighbor Graph', f'{graph.threshold:g}-meter Distance Band Graph']
+    data, layout = [], {'height': 550, 'margin': {'l': 40, 'r': 20, 't': 60, 'b': 40}, 'annotations': []}
+    for col, edges, color, domain in [(1, graph.knn, 'blue', [0, 0.45]), (2, graph.band, 'red', [0.55, 1])]:
+        axes = ('x', 'y') if col == 1 else (f'x{col}', f'y{col}')
+        data.append(_edge_trace(xy, edges, color, axes))
+        data.append({'type': 'scatter', 'x': xy[:, 0], 'y': xy[:, 1], 'mode': 'markers',
+                     'text': text, 'hoverinfo': 'text' if text else 'x+y', 'marker': {'color': color, 'size': 6},
+                     'showlegend': False, 'xaxis': axes[0], 'yaxis': axes[1]})
+        suffix = '' if col == 1 else str(col)
+        layout[f'xaxis{suffix}'] = {'domain': domain, 'anchor': axes[1], 'title': {'text': 'Meters east of click'}}
+        layout[f'yaxis{suffix}'] = {'anchor': axes[0], 'scaleanchor': axes[0],
+                                    'title': {'text': 'Meters north of click'}}
+        layout['annotations'].append({'text': titles[col - 1], 'x': sum(domain) / 2, 'y': 1.0, 'xref': 'paper',
+                                      'yref': 'paper', 'xanchor': 'center', 'yanchor': 'bottom',
+                                      'showarrow': False, 'font': {'size': 16}})
+    return {'data': data, 'layout': layout}
@@ -0,0 +1,302 @@
+# Region definitions for the dashboards and a loader that prepares each region on first use
+#
+# A region names its census tracts, its zones, its taxi pickup/dropoff tables and its
+# station filter. Each source is either a table of the prebuilt bundle (see bundle.py),
+# e.g. 'census_tracts', or a file path (relative paths are read from DATA_DIR):
+#   - tracts: polygons with a GEOID column, joined with the population CSV when one is
+#     given (otherwise the polygons must already have a P1_001N column)
+#   - zones: polygons with LocationID and zone columns; without zones the region's tracts
+#     are used as its zones
+#   - pickups, dropoffs: tables in the taxi_aggregate.py schema; regions without trip
+#     data get empty tables
+#   - states: pushed down to the partitioned station dataset (see stations.py); stations
+#     are also cut to the region's bounds and then to its zones. Only STATION_FUEL_TYPES
+#     stations are kept, whether they come from the dataset or the bundle
+#
+# REGIONS holds NYC, built from the bundle as before; more regions are read from the
+# JSON file at ELEC_TRANSIT_Y_REGIONS_FILE, an object of region name -> Region arguments:
+#   {"boston": {"title": "Boston", "tracts": "ma/tracts.shp",
+#               "population": "ma/ma_census_tract_population.csv", "states": ["MA"]}}
+#
+# RegionLoader prepares a region the first time it is requested and keeps at most
+# REGION_CACHE_SIZE regions in memory (least recently used first out), besides the
+# pinned default region, so one process can offer many regions without loading them at
+# startup.
+import json
+import os
+import threading
+from collections.abc import Mapping
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from elec_transit_y import bundle
+from elec_transit_y.assign import STATION_ASSIGNMENTS, assign_stations
+from elec_transit_y.cache import LRUCache
+from elec_transit_y.data import DATA_DIR, LOADERS, read_taxi_counts
+from elec_transit_y.metrics import stage
+from elec_transit_y.stations import STATION_DATASET, read_stations
+from elec_transit_y.taxi_aggregate import N_ZONES
+from elec_transit_y.tracts import join_tracts
+
+REGIONS_FILE = os.environ.get('ELEC_TRANSIT_Y_REGIONS_FILE')
+REGION_CACHE_SIZE = int(os.environ.get('REGION_CACHE_SIZE', 4))
+DEFAULT_REGION = os.environ.get('DEFAULT_REGION', 'nyc')
+
+# Fuel types of the stations kept in every region
+STATION_FUEL_TYPES = ['ELEC']
+
+# Location and count columns of the pickup and dropoff tables
+TRIP_COLUMNS = {'pickups': ('PULocationID', 'pickup_count'), 'dropoffs': ('DOLocationID', 'dropoff_count')}
+
+
+class Region:
+    '''
+    Where a region's data comes from.
+
+    Inputs:
+      name (string): identifier used in URLs and cache keys (no dots or slashes)
+      title (string): name shown on the dashboard
+      tracts (string): bundle table or polygon file of census tracts
+      population (string): census population CSV joined to the tracts on GEOID
+      zones (string): bundle table or polygon file of zones (None: the tracts)
+      pickups, dropoffs (strings): bundle tables or taxi_aggregate.py tables
+        (None: no trip data)
+      states (list of strings): station states read from the partitioned dataset
+      bounds (tuple): (min lon, min lat, max lon, max lat) stations are cut to
+        (default: the bounds of the zones)
+      center (list): [lat, lon] of the maps (default: the middle of the bounds)
+      zoom (int): initial zoom of the overview map; the zone maps open one
+        level closer
+      excluded_zones (dict): zone column -> values of zones whose stations are
+        left out, e.g. {'borough': ['EWR']}
+    '''
+
+    def __init__(self, name, title=None, tracts='census_tracts', population=None, zones=None, pickups=None,
+                 dropoffs=None, states=None, bounds=None, center=None, zoom=10, excluded_zones=None):
+        if not name or any(character in name for character in './\\'):
+            raise ValueError(f"Region name {name!r} must be non-empty without dots or slashes")
+        self.name = name
+        self.title = title or name
+        self.tracts = tracts
+        self.population = population
+        self.zones = zones
+        self.pickups = pickups
+        self.dropoffs = dropoffs
+        self.states = states
+        self.bounds = tuple(bounds) if bounds else None
+        self.center = list(center) if center else None
+        self.zoom = zoom
+        self.excluded_zones = excluded_zones or {}
+
+    def spec(self):
+        '''
+        Returns: dict of the arguments, e.g. to hash the definition
+        '''
+        return dict(vars(self))
+
+
+def read_regions(path):
+    '''
+    Read region definitions from a JSON object of name -> Region arguments.
+
+    Returns: dict of name -> Region
+    '''
+    with open(path) as file:
+        specs = json.load(file)
+    return {name: Region(name, **spec) for name, spec in specs.items()}
+
+
+REGIONS = {
+    'nyc': Region('nyc', 'NYC', tracts='census_tracts', zones='taxi_zones', pickups='taxi_pickups',
+                  dropoffs='taxi_dropoffs', states=['NY'], center=[40.7128, -74.0060], zoom=10,
+                  excluded_zones={'borough': ['EWR']})
+}
+if REGIONS_FILE:
+    REGIONS.update(read_regions(REGIONS_FILE))
+
+
+def _path(source, data_dir):
+    return source if os.path.isabs(source) else os.path.join(data_dir, source)
+
+
+def _read_polygons(source, data_dir):
+    if source in LOADERS:
+        return bundle.load(source, data_dir)
+    path = _path(source, data_dir)
+    return gpd.read_parquet(path) if path.endswith('.parquet') else gpd.read_file(path)
+
+
+def _read_trips(source, side, data_dir):
+    location_column, count_column = TRIP_COLUMNS[side]
+    if source is None:
+        return pd.DataFrame({'hour_of_day': np.array([], dtype=np.int8),
+                             location_column: np.array([], dtype=np.int16),
+                             count_column: np.array([], dtype=np.int64)})
+    if source in LOADERS:
+        return bundle.load(source, data_dir)
+    return read_taxi_counts(_path(source, data_dir), location_column, count_column)
+
+
+def _read_tracts(region, data_dir):
+    tracts = _read_polygons(region.tracts, data_dir)
+    if region.population:
+        tracts, _ = join_tracts(tracts, pd.read_csv(_path(region.population, data_dir)))
+    if 'Population_Density' not in tracts.columns:
+        km2 = tracts.geometry.to_crs(tracts.estimate_utm_crs()).area / 10**6
+        tracts['Population_Density'] = tracts['P1_001N'] / km2
+    return tracts
+
+
+class RegionData:
+    '''
+    The loaded tables of a region: zones (EPSG:4326), tracts, pickups,
+    dropoffs and the stations inside the region's zones, with their
+    taxi_zone_id and GEOID.
+
+    Inputs:
+      region (Region)
+      data_dir (string): directory of the raw data files and relative sources
+    '''
+
+    def __init__(self, region, data_dir=DATA_DIR):
+        self.region = region
+        self.tracts = _read_tracts(region, data_dir)
+        if region.zones is None:
+            zones = self.tracts[['GEOID', self.tracts.geometry.name]].to_crs('EPSG:4326')
+            self.zones = zones.assign(LocationID=np.arange(1, len(zones) + 1), zone=zones['GEOID'].astype(str))
+        else:
+            self.zones = _read_polygons(region.zones, data_dir).to_crs('EPSG:4326')
+        self.pickups = _read_trips(region.pickups, 'pickups', data_dir)
+        self.dropoffs = _read_trips(region.dropoffs, 'dropoffs', data_dir)
+        self.bounds = region.bounds or tuple(self.zones.total_bounds)
+        min_lon, min_lat, max_lon, max_lat = self.bounds
+        self.center = region.center or [(min_lat + max_lat) / 2, (min_lon + max_lon) / 2]
+
+        # Only the EV partitions of the region's states and its bounding box are read from a
+        # partitioned station dataset, and the bundle's stations are cut to the same EV
+        # stations in the bounding box; the bundle's stations are already assigned to the
+        # bundle's zones and tracts, and are assigned again for regions with their own
+        if STATION_DATASET:
+            stations = read_stations(states=region.states, fuel_types=STATION_FUEL_TYPES, bbox=self.bounds)
+        else:
+            stations = bundle.load('ev_stations', data_dir)
+            stations = stations[stations['fuel_type_code'].isin(STATION_FUEL_TYPES)
+                                & stations['longitude'].between(min_lon, max_lon)
+                                & stations['latitude'].between(min_lat, max_lat)]
+            if (region.zones, region.tracts) != ('taxi_zones', 'census_tracts'):
+                stations = stations.drop(columns=list(STATION_ASSIGNMENTS), errors='ignore')
+        with stage('region.assign_stations'):
+            stations = assign_stations(stations, self.zones, self.tracts)
+        zones = self.zones
+        for column, values in region.excluded_zones.items():
+            zones = zones[~zones[column].isin(values)]
+        self.stations = stations[stations['taxi_zone_id'].isin(zones['LocationID'])]
+
+    @property
+    def n_zones(self):
+        '''
+        Length of a zone axis indexed by LocationID (at least N_ZONES, the
+        NYC taxi zone axis).
+        '''
+        ids = [self.zones['LocationID'], self.pickups['PULocationID'], self.dropoffs['DOLocationID']]
+        return max([N_ZONES] + [int(values.max()) + 1 for values in ids if len(values)])
+
+
+class RegionLoader:
+    '''
+    Prepare regions on first use and keep the most recently used ones in
+    memory. Concurrent first requests for a region prepare it once.
+
+    Inputs:
+      prepare (function): RegionData -> whatever the app keeps per region
+      regions (dict): name -> Region
+      maxsize (int): number of regions kept in memory besides the pinned ones
+      pinned (list of strings): regions prepared once and never evicted
+    '''
+
+    def __init__(self, prepare, regions=None, maxsize=REGION_CACHE_SIZE, pinned=()):
+        self.prepare = prepare
+        self.regions = REGIONS if regions is None else regions
+        self.cache = LRUCache(maxsize=maxsize)
+        self.pinned = {name: None for name in pinned}
+        self._pinned_lock = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self.regions
+
+    def _create(self, name):
+        with stage('region.load'):
+            data = RegionData(self.regions[name])
+        with stage('region.prepare'):
+            return self.prepare(data)
+
+    def get(self, name):
+        '''
+        Returns: the prepared region (KeyError for an unknown region)
+        '''
+        if name not in self.regions:
+            raise KeyError(name)
+        if name in self.pinned:
+            # Pinned regions live outside the LRU cache so they never take one of its slots
+            with self._pinned_lock:
+                if self.pinned[name] is None:
+                    self.pinned[name] = self._create(name)
+            return self.pinned[name]
+        return self.cache.get_or_create(name, lambda: self._create(name))
+
+
+class RegionLayers(Mapping):
+    '''
+    Read-only mapping of '<layer>.<region>' -> an attribute of the prepared
+    region, so routes serving per-layer resources (e.g. register_geometry_routes)
+    serve every region, preparing it on request.
+
+    Inputs:
+      loader (RegionLoader)
+      layers (dict): layer name -> attribute of the prepared region
+    '''
+
+    def __init__(self, loader, layers):
+        self.loader = loader
+        self.layers = layers
+
+    def __getitem__(self, key):
+        layer, _, region = key.partition('.')
+        if layer not in self.layers or region not in self.loader:
+            raise KeyError(key)
+        return getattr(self.loader.get(region), self.layers[layer])
+
+    def __iter__(self):
+        return (f'{layer}.{region}' for layer in self.layers for region in self.loader.regions)
+
+    def __len__(self):
+        return len(self.layers) * len(self.loader.regions)
+
+
+class RegionTileSource:
+    '''
+    Serve the vector tiles of every region from the TileSource of each
+    prepared region, as layers named '<layer>.<region>' (see tiles.py).
+
+    Inputs:
+      loader (RegionLoader)
+      attribute (string): attribute of the prepared region holding its TileSource
+    '''
+
+    def __init__(self, loader, attribute='tile_source'):
+        self.loader = loader
+        self.attribute = attribute
+
+    def version(self, layer):
+        layer, _, region = layer.partition('.')
+        if region not in self.loader:
+            return None
+        return getattr(self.loader.get(region), self.attribute).version(layer)
+
+    def tile(self, layer, z, x, y):
+        layer, _, region = layer.partition('.')
+        if region not in self.loader:
+            return None
+        return getattr(self.loader.get(region), self.attribute).tile(layer, z, x, y)
@@ -0,0 +1,296 @@
+# Where should the next chargers go? Maximal-coverage siting over taxi demand and population
+#
+# Demand is laid out on a hexagonal grid of points (GRID_SPACING_M apart, in a projected
+# CRS) covering the study area. Each demand layer, e.g. taxi trips per zone or population
+# per census tract, is spread evenly over the grid points inside each polygon; polygons
+# too small to hold a grid point keep their demand at a single interior point. Layers are
+# normalized to shares and mixed with the given weights, and demand within the service
+# radius of an existing station counts as covered already.
+#
+# Candidate sites (the grid points themselves or one point per taxi zone) cover the
+# demand points within the service radius. The candidates x demand coverage matrix comes
+# from a KD-tree as a sparse CSR matrix, and K sites are picked by lazy greedy maximal
+# coverage: marginal gains only shrink as sites are added, so a site whose recomputed
+# gain still tops the heap is the best one. Greedy picks are nested, so one run for the
+# largest K answers every smaller K.
+#
+# Usage:
+#   python -m elec_transit_y.siting [--sites 100] [--radius 800] [--trip-share 0.5] [--candidates hex]
+#   python -m elec_transit_y.siting --area tracts.shp --column P1_001N --state NY --spacing 1000
+import argparse
+import heapq
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+from elec_transit_y.assign import PolygonIndex
+
+# Half a mile, a common walking distance to a charger
+SERVICE_RADIUS_M = 800
+GRID_SPACING_M = 250
+
+
+def project(latitudes, longitudes, crs):
+    '''
+    Project EPSG:4326 coordinates.
+
+    Returns: (n, 2) numpy array of x, y in crs units
+    '''
+    points = gpd.GeoSeries(gpd.points_from_xy(np.asarray(longitudes, dtype=float),
+                                              np.asarray(latitudes, dtype=float)), crs='EPSG:4326')
+    points = points.to_crs(crs)
+    return np.column_stack((points.x.to_numpy(), points.y.to_numpy()))
+
+
+def unproject(xy, crs):
+    '''
+    Inverse of project().
+
+    Returns: (latitudes, longitudes) numpy arrays
+    '''
+    points = gpd.GeoSeries(gpd.points_from_xy(xy[:, 0], xy[:, 1]), crs=crs).to_crs('EPSG:4326')
+    return points.y.to_numpy(), points.x.to_numpy()
+
+
+def hex_grid(bounds, spacing):
+    '''
+    Centres of a hexagonal grid covering a bounding box; every point has six
+    neighbours spacing apart.
+
+    Inputs:
+      bounds (tuple): (min_x, min_y, max_x, max_y) in projected units
+      spacing (float): distance between neighbouring points
+
+    Returns: (n, 2) numpy array
+    '''
+    min_x, min_y, max_x, max_y = bounds
+    row_height = spacing * np.sqrt(3) / 2
+    xs = np.arange(min_x, max_x + spacing, spacing)
+    ys = np.arange(min_y, max_y + row_height, row_height)
+    x, y = np.meshgrid(xs, ys)
+    # Every other row is shifted by half a spacing
+    x = x + (np.arange(len(ys))[:, None] % 2) * spacing / 2
+    return np.column_stack((x.ravel(), y.ravel()))
+
+
+def spread(layer, values, grid, crs):
+    '''
+    Spread per-polygon values evenly over the grid points inside each
+    polygon; polygons without a grid point keep their value at one interior
+    point.
+
+    Inputs:
+      layer (geopandas dataframe): polygons
+      values (array-like): one value per polygon, NaN counting as zero
+      grid ((n, 2) numpy array): grid points in crs
+      crs: projected CRS of the grid
+
+    Returns: (per grid point values, (m, 2) extra points, their values)
+    '''
+    values = np.nan_to_num(np.asarray(values, dtype=float))
+    positions = PolygonIndex(layer, crs=crs).positions(grid[:, 0], grid[:, 1])
+    inside = positions >= 0
+    counts = np.bincount(positions[inside], minlength=len(layer))
+    per_point = np.zeros(len(grid))
+    per_point[inside] = values[positions[inside]] / counts[positions[inside]]
+    orphans = np.flatnonzero((counts == 0) & (values > 0))
+    points = layer.iloc[orphans].to_crs(crs).representative_point()
+    return per_point, np.column_stack((points.x.to_numpy(), points.y.to_numpy())), values[orphans]
+
+
+def demand_grid(area, layers, spacing=GRID_SPACING_M, crs=None):
+    '''
+    Demand points over a study area.
+
+    Inputs:
+      area (geopandas dataframe): polygons delimiting the grid, e.g. taxi zones
+      layers (list of tuples): (polygons, values per polygon, weight); each
+        layer is normalized to sum to its weight
+      spacing (float): grid spacing in metres
+      crs: projected CRS (default: the area's UTM zone)
+
+    Returns: ((n, 2) numpy array of demand points in crs, demand per point, crs)
+    '''
+    crs = crs or area.estimate_utm_crs()
+    grid = hex_grid(area.to_crs(crs).total_bounds, spacing)
+    grid = grid[PolygonIndex(area, crs=crs).positions(grid[:, 0], grid[:, 1]) >= 0]
+    points, demand = [grid], [np.zeros(len(grid))]
+    for layer, values, weight in layers:
+        per_point, extra_points, extra_values = spread(layer, values, grid, crs)
+        total = per_point.sum() + extra_values.sum()
+        if total <= 0:
+            continue
+        demand[0] += weight * per_point / total
+        points.append(extra_points)
+        demand.append(weight * extra_values / total)
+    return np.concatenate(points), np.concatenate(demand), crs
+
+
+def coverage_matrix(candidates, demand_points, radius):
+    '''
+    Which demand points each candidate site covers.
+
+    Returns: candidates x demand points scipy CSR matrix of ones
+    '''
+    pairs = cKDTree(candidates).sparse_distance_matrix(cKDTree(demand_points), radius, output_type='ndarray')
+    return sparse.csr_matrix((np.ones(len(pairs)), (pairs['i'], pairs['j'])),
+                             shape=(len(candidates), len(demand_points)))
+
+
+def lazy_greedy(coverage, weights, k):
+    '''
+    Greedy maximal coverage: repeatedly pick the candidate covering the most
+    still-uncovered weight, recomputing a candidate's gain only when it
+    reaches the top of the heap.
+
+    Inputs:
+      coverage (scipy CSR matrix): candidates x demand points
+      weights (numpy array): uncovered demand per point
+      k (int): number of sites
+
+    Returns: (picked candidate rows, demand each one added), fewer than k
+    when every coverable point is covered
+    '''
+    uncovered = np.array(weights, dtype=float)
+    gains = coverage @ uncovered
+    heap = [(-gain, row) for row, gain in enumerate(gains) if gain > 0]
+    heapq.heapify(heap)
+    picks, added = [], []
+    while heap and len(picks) < k:
+        _, row = heapq.heappop(heap)
+        covered = coverage.indices[coverage.indptr[row]:coverage.indptr[row + 1]]
+        gain = uncovered[covered].sum()
+        if gain <= 0:
+            continue
+        # Ties go to the lowest row, as with a full rescoring
+        if heap and (-gain, row) > heap[0]:
+            heapq.heappush(heap, (-gain, row))
+            continue
+        picks.append(row)
+        added.append(gain)
+        uncovered[covered] = 0
+    return np.array(picks, dtype=np.intp), np.array(added)
+
+
+class SitingModel:
+    '''
+    Maximal-coverage siting of new stations.
+
+    Inputs:
+      demand_points ((n, 2) numpy array): in a projected CRS, in metres
+      demand (numpy array): demand per point
+      candidates ((m, 2) numpy array): candidate sites in the same CRS
+      stations ((s, 2) numpy array): existing stations in the same CRS
+      radius (float): service radius in metres
+
+    Raises ValueError when there is no demand to cover, e.g. when every
+    demand layer of demand_grid() was empty or weighted zero.
+    '''
+
+    def __init__(self, demand_points, demand, candidates, stations, radius=SERVICE_RADIUS_M):
+        self.demand = np.asarray(demand, dtype=float)
+        if not self.demand.sum() > 0:
+            raise ValueError('No demand to cover: every demand layer is empty or weighted zero')
+        self.candidates = candidates
+        self.radius = radius
+        self.covered = np.zeros(len(demand_points), dtype=bool)
+        if len(stations):
+            distances = cKDTree(stations).query(demand_points, distance_upper_bound=radius)[0]
+            self.covered = np.isfinite(distances)
+        self.uncovered = np.where(self.covered, 0, self.demand)
+        self.coverage = coverage_matrix(candidates, demand_points, radius)
+
+    def existing_share(self):
+        '''
+        Share of the demand already covered by existing stations.
+        '''
+        return float(self.demand[self.covered].sum() / self.demand.sum())
+
+    def plan(self, k):
+        '''
+        Pick up to k new sites.
+
+        Returns: pandas dataframe with one row per site in the order picked:
+        candidate (row in candidates), x, y, added_share (share of all demand
+        it newly covers) and covered_share (share covered with all sites so far)
+        '''
+        picks, added = lazy_greedy(self.coverage, self.uncovered, k)
+        added_share = added / self.demand.sum()
+        return pd.DataFrame({
+            'candidate': picks,
+            'x': self.candidates[picks, 0],
+            'y': self.candidates[picks, 1],
+            'added_share': added_share,
+            'covered_share': self.existing_share() + np.cumsum(added_share)
+        })
+
+
+def nyc_siting_model(taxi_zones, census_tracts, stations, data_pu, data_do, trip_share=0.5,
+                     candidates='hex', radius=SERVICE_RADIUS_M, spacing=GRID_SPACING_M):
+    '''
+    Siting model for NYC: demand from the 2019 taxi pickups and dropoffs per
+    zone and the census tract population, weighted trip_share to
+    1 - trip_share, over a grid covering the taxi zones.
+
+    Inputs:
+      candidates (string): 'hex' for the grid points, 'zones' for one
+        interior point per taxi zone
+
+    Returns: (SitingModel, crs)
+    '''
+    trips = (data_pu.groupby('PULocationID')['pickup_count'].sum()
+             .add(data_do.groupby('DOLocationID')['dropoff_count'].sum(), fill_value=0))
+    layers = [(taxi_zones, trips.reindex(taxi_zones['LocationID']).to_numpy(dtype=float), trip_share),
+              (census_tracts, census_tracts['P1_001N'].to_numpy(dtype=float), 1 - trip_share)]
+    demand_points, demand, crs = demand_grid(taxi_zones, layers, spacing)
+    if candidates == 'zones':
+        points = taxi_zones.to_crs(crs).representative_point()
+        sites = np.column_stack((points.x.to_numpy(), points.y.to_numpy()))
+    else:
+        sites = demand_points
+    station_points = project(stations['latitude'], stations['longitude'], crs)
+    return SitingModel(demand_points, demand, sites, station_points, radius), crs
+
+
+if __name__ == '__main__':
+    from elec_transit_y import bundle
+
+    parser = argparse.ArgumentParser(description='Pick sites for new chargers by maximal coverage')
+    parser.add_argument('--sites', type=int, default=100)
+    parser.add_argument('--radius', type=float, default=SERVICE_RADIUS_M, help='service radius in metres')
+    parser.add_argument('--spacing', type=float, default=GRID_SPACING_M, help='grid spacing in metres')
+    parser.add_argument('--candidates', choices=['hex', 'zones'], default='hex')
+    parser.add_argument('--trip-share', type=float, default=0.5,
+                        help='weight of taxi trips against population (NYC only)')
+    parser.add_argument('--area', help='polygon file with the demand columns (default: NYC taxi zones and tracts)')
+    parser.add_argument('--column', action='append', help='demand column of --area, weighted equally')
+    parser.add_argument('--state', help='only count existing stations in this state (with --area)')
+    parser.add_argument('--out', default='data/charger_sites.csv')
+    args = parser.parse_args()
+
+    stations = bundle.load('ev_stations').dropna(subset=['latitude', 'longitude'])
+    stations = stations[stations['fuel_type_code'] == 'ELEC']
+    if args.area:
+        area = gpd.read_file(args.area)
+        if args.state:
+            stations = stations[stations['state'] == args.state]
+        columns = args.column or ['P1_001N']
+        layers = [(area, area[column].to_numpy(dtype=float), 1 / len(columns)) for column in columns]
+        demand_points, demand, crs = demand_grid(area, layers, args.spacing)
+        model = SitingModel(demand_points, demand, demand_points,
+                            project(stations['latitude'], stations['longitude'], crs), args.radius)
+    else:
+        model, crs = nyc_siting_model(bundle.load('taxi_zones'), bundle.load('census_tracts'), stations,
+                                      bundle.load('taxi_pickups'), bundle.load('taxi_dropoffs'),
+                                      args.trip_share, args.candidates, args.radius, args.spacing)
+
+    plan = model.plan(args.sites)
+    plan['latitude'], plan['longitude'] = unproject(plan[['x', 'y']].to_numpy(), crs)
+    plan.drop(columns=['x', 'y']).rename_axis('rank').to_csv(args.out)
+    print(f"{len(model.demand)} demand points, {model.coverage.shape[0]} candidates, "
+          f"{model.existing_share():.1%} of demand covered by {len(stations)} existing stations")
+    covered = plan['covered_share'].iloc[-1] if len(plan) else model.existing_share()
+    print(f"{len(plan)} new sites raise coverage to {covered:.1%}; wrote {args.out}")
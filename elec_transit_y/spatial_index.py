@@ -0,0 +1,105 @@
+# Spatial index over EV station coordinates for fast radius and nearest-neighbour queries
+import numpy as np
+from scipy.spatial import cKDTree
+
+# Mean Earth radius (IUGG) used for the spherical distance model
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_MILE = 1.609344
+
+# Spherical distances differ from the WGS84 geodesic distances computed by
+# geopy.distance.geodesic by at most ~0.5%, so only stations sitting within
+# that band of the radius boundary can be classified differently
+GEODESIC_TOLERANCE = 0.005
+
+
+def to_unit_vectors(latitudes, longitudes):
+    '''
+    Convert latitude/longitude in degrees to 3D points on the unit sphere.
+
+    Inputs:
+      latitudes, longitudes (array-like): coordinates in degrees
+
+    Returns: (n, 3) numpy array of unit vectors
+    '''
+    lat = np.radians(np.asarray(latitudes, dtype=float))
+    lon = np.radians(np.asarray(longitudes, dtype=float))
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
+def haversine_km(lat, lon, latitudes, longitudes):
+    '''
+    Great-circle distance in kilometers from one point to an array of points.
+    '''
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lat2 = np.radians(np.asarray(latitudes, dtype=float))
+    lon2 = np.radians(np.asarray(longitudes, dtype=float))
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def _chord_length(distance_km):
+    # Straight-line distance through the unit sphere for a great-circle distance
+    angle = min(distance_km / EARTH_RADIUS_KM, np.pi)
+    return 2 * np.sin(angle / 2)
+
+
+class StationIndex:
+    '''
+    KD-tree over station coordinates projected onto the unit sphere. Built once
+    at startup; radius and k-nearest queries then avoid scanning every station.
+
+    Positions returned by the queries are row positions into the arrays the
+    index was built from (use them with DataFrame.iloc). Rows with missing
+    coordinates are skipped.
+    '''
+
+    def __init__(self, latitudes, longitudes):
+        self.latitudes = np.asarray(latitudes, dtype=float)
+        self.longitudes = np.asarray(longitudes, dtype=float)
+        valid = np.isfinite(self.latitudes) & np.isfinite(self.longitudes)
+        self._positions = np.flatnonzero(valid)
+        self._tree = cKDTree(to_unit_vectors(self.latitudes[valid], self.longitudes[valid]))
+
+    def __len__(self):
+        return len(self._positions)
+
+    def query_radius(self, lat, lon, radius_km):
+        '''
+        Find all stations within radius_km of a point.
+
+        Inputs:
+          lat, lon (float): query point in degrees
+          radius_km (float): search radius in kilometers
+
+        Returns: (positions, distances_km) numpy arrays sorted by distance
+        '''
+        point = to_unit_vectors([lat], [lon])[0]
+        hits = np.asarray(self._tree.query_ball_point(point, _chord_length(radius_km)), dtype=np.intp)
+        positions = self._positions[hits]
+        distances = haversine_km(lat, lon, self.latitudes[positions], self.longitudes[positions])
+        keep = distances <= radius_km
+        positions, distances = positions[keep], distances[keep]
+        order = np.argsort(distances, kind='stable')
+        return positions[order], distances[order]
+
+    def query_knn(self, lat, lon, k):
+        '''
+        Find the k stations nearest to a point.
+
+        Inputs:
+          lat, lon (float): query point in degrees
+          k (int): number of neighbours
+
+        Returns: (positions, distances_km) numpy arrays sorted by distance
+        '''
+        k = min(k, len(self))
+        if k == 0:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        point = to_unit_vectors([lat], [lon])[0]
+        _, hits = self._tree.query(point, k=k)
+        positions = self._positions[np.atleast_1d(hits)]
+        distances = haversine_km(lat, lon, self.latitudes[positions], self.longitudes[positions])
+        order = np.argsort(distances, kind='stable')
+        return positions[order], distances[order]
@@ -0,0 +1,88 @@
+# Shared EV station marker layer for the dashboards, built in one vectorized pass
+import pandas as pd
+from folium.plugins import FastMarkerCluster
+
+from elec_transit_y.cache import LRUCache, data_hash
+
+# Popup rows shown for each station: (label, column)
+POPUP_FIELDS = [
+    ('Station Name', 'station_name'),
+    ('Street Address', 'street_address'),
+    ('City', 'city'),
+    ('State', 'state'),
+    ('ZIP Code', 'zip'),
+    ('Fuel Type', 'fuel_type_code'),
+    ('Access Code', 'access_code')
+]
+
+# Markers are created in the browser from [lat, lon, popup] rows
+MARKER_CALLBACK = """
+function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]));
+    marker.bindPopup(row[2], {maxWidth: 500});
+    return marker;
+}
+"""
+
+# Marker rows per station subset, so rebuilding a map doesn't redo the popup formatting
+_marker_data_cache = LRUCache(maxsize=32)
+
+
+def _escape(values):
+    return (values.astype(str)
+            .str.replace('&', '&amp;', regex=False)
+            .str.replace('<', '&lt;', regex=False)
+            .str.replace('>', '&gt;', regex=False))
+
+
+def popup_html(stations):
+    '''
+    Format the popup HTML for every station at once.
+
+    Inputs:
+      stations (pandas dataframe): station rows; POPUP_FIELDS columns that
+        are missing are skipped
+
+    Returns: pandas series of HTML strings (empty when no POPUP_FIELDS
+    column is present)
+    '''
+    lines = [f'<b>{label}:</b> ' + _escape(stations[column])
+             for label, column in POPUP_FIELDS if column in stations.columns]
+    if not lines:
+        return pd.Series('', index=stations.index)
+    popups = lines[0]
+    for line in lines[1:]:
+        popups = popups + '<br>' + line
+    return popups
+
+
+def station_marker_data(stations):
+    '''
+    [lat, lon, popup] rows for a station subset, memoized by a hash of the
+    positions and popup columns, so changed station data is never served
+    from the cache.
+    '''
+    stations = stations.dropna(subset=['latitude', 'longitude'])
+    columns = [column for _, column in POPUP_FIELDS if column in stations.columns]
+    key = data_hash(stations[['latitude', 'longitude'] + columns])
+
+    def build():
+        rows = stations[['latitude', 'longitude']].astype(float)
+        rows['popup'] = popup_html(stations)
+        return rows.values.tolist()
+
+    return _marker_data_cache.get_or_create(key, build)
+
+
+def station_layer(stations, name='EV Charging Stations'):
+    '''
+    Clustered marker layer with a popup per station, built client-side from
+    a single JSON array instead of one folium Marker/Popup per row.
+
+    Inputs:
+      stations (pandas dataframe): must have latitude/longitude columns
+      name (string): layer name
+
+    Returns: folium FastMarkerCluster, ready to add to a map
+    '''
+    return FastMarkerCluster(station_marker_data(stations), callback=MARKER_CALLBACK, name=name)
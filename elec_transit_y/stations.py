@@ -0,0 +1,84 @@
+# Reader for the Hive-partitioned station dataset written by the NREL ingestion lambda
+# (stations/state={ST}/fuel_type_code={FT}/stations.parquet). Filters on the partition
+# columns skip whole directories, other filters are checked against the row-group
+# statistics, and only the requested columns are read.
+import os
+
+import pyarrow.dataset as ds
+
+from elec_transit_y.data import type_stations
+
+# Location of the dataset's stations/ directory: a local path or an s3://bucket/prefix URI.
+# When unset the dashboards keep reading the station CSV.
+STATION_DATASET = os.environ.get('ELEC_TRANSIT_Y_STATION_DATASET')
+
+# Columns the dashboards use (station markers, popups and charts)
+DASHBOARD_COLUMNS = ['id', 'station_name', 'street_address', 'city', 'state', 'zip', 'fuel_type_code',
+                     'access_code', 'latitude', 'longitude', 'open_date']
+
+
+def open_dataset(source=None):
+    '''
+    Open the partitioned station dataset. Partition values are read as
+    dictionaries, so state and fuel_type_code become categoricals.
+
+    Inputs:
+      source (string): dataset location, defaults to STATION_DATASET
+
+    Returns: pyarrow dataset
+    '''
+    source = source or STATION_DATASET
+    if not source:
+        raise ValueError('No station dataset configured; set ELEC_TRANSIT_Y_STATION_DATASET')
+    return ds.dataset(source, format='parquet',
+                      partitioning=ds.HivePartitioning.discover(infer_dictionary=True))
+
+
+def station_filter(states=None, fuel_types=None, cities=None, bbox=None):
+    '''
+    Build a dataset filter expression from the given constraints; None means
+    no constraint.
+
+    Inputs:
+      states (list of strings): two-letter state codes
+      fuel_types (list of strings): fuel type codes, e.g. ['ELEC']
+      cities (list of strings): city names
+      bbox (tuple): (min_lon, min_lat, max_lon, max_lat)
+
+    Returns: pyarrow dataset expression, or None
+    '''
+    conditions = []
+    if states is not None:
+        conditions.append(ds.field('state').isin(states))
+    if fuel_types is not None:
+        conditions.append(ds.field('fuel_type_code').isin(fuel_types))
+    if cities is not None:
+        conditions.append(ds.field('city').isin(cities))
+    if bbox is not None:
+        min_lon, min_lat, max_lon, max_lat = bbox
+        conditions.append((ds.field('longitude') >= min_lon) & (ds.field('longitude') <= max_lon)
+                          & (ds.field('latitude') >= min_lat) & (ds.field('latitude') <= max_lat))
+    if not conditions:
+        return None
+    expression = conditions[0]
+    for condition in conditions[1:]:
+        expression = expression & condition
+    return expression
+
+
+def read_stations(source=None, columns=DASHBOARD_COLUMNS, states=None, fuel_types=None, cities=None, bbox=None):
+    '''
+    Read the stations matching the constraints, with the same typing as
+    data.load_ev_stations.
+
+    Inputs:
+      source (string): dataset location, defaults to STATION_DATASET
+      columns (list of strings): columns to read, or None for all
+      states, fuel_types, cities, bbox: see station_filter()
+
+    Returns: ev_data (pandas dataframe)
+    '''
+    dataset = open_dataset(source)
+    table = dataset.to_table(columns=columns, filter=station_filter(states, fuel_types, cities, bbox))
+    ev_data = table.to_pandas(date_as_object=False)
+    return type_stations(ev_data)
@@ -0,0 +1,281 @@
+# Single-machine replacement for the EMR Spark job in notebooks/NYC_Taxi_EDA.ipynb that turns
+# the 2019 yellow trip files into nyc_taxi_rides_2019_aggByPUandHour.csv and
+# nyc_taxi_rides_2019_aggByDOandHour.csv
+#
+# Each trip file (CSV or Parquet) is streamed in record batches that only carry the
+# pickup/dropoff datetimes and location IDs. Every batch is reduced to a dense
+# [period, hour, zone] count array with np.bincount, so memory stays bounded by the
+# batch size however large the files are; files are processed in parallel by a
+# multiprocessing pool and their count arrays summed.
+#
+# The outputs reproduce the Spark queries exactly, including two of their quirks:
+# dropoffs are bucketed by the *pickup* hour (query5 grouped on
+# hour(tpep_pickup_datetime)), and rows are ordered by hour and then by the location ID
+# as a string, because Spark read the CSVs without schema inference.
+#
+# Usage:
+#   python -m elec_transit_y.taxi_aggregate yellow_tripdata_2019-*.csv [--workers 8] [--by day_of_week]
+import argparse
+import glob
+import os
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+from elec_transit_y.data import DATA_DIR
+
+# Taxi zone IDs run from 1 to 263, plus 264/265 for unknown locations
+N_ZONES = 266
+HOURS = 24
+# Bytes of CSV parsed per batch; larger blocks parse no faster and hold more memory
+BLOCK_SIZE = 4 << 20
+BATCH_SIZE = 1 << 20
+
+# Extra grouping dimensions: name -> number of values (Spark's month() and dayofweek())
+PERIODS = {'month': 12, 'day_of_week': 7}
+
+# Datetime column names of the yellow, green and for-hire trip files
+PICKUP_COLUMNS = ['tpep_pickup_datetime', 'lpep_pickup_datetime', 'pickup_datetime']
+DROPOFF_COLUMNS = ['tpep_dropoff_datetime', 'lpep_dropoff_datetime', 'dropoff_datetime']
+
+
+def _pick(names, candidates):
+    for name in candidates:
+        if name in names:
+            return name
+    raise KeyError(f"None of {candidates} in the trip file columns")
+
+
+def _columns(names, dropoff_hour):
+    pickup = _pick(names, PICKUP_COLUMNS)
+    columns = [pickup, 'PULocationID', 'DOLocationID']
+    dropoff = _pick(names, DROPOFF_COLUMNS) if dropoff_hour == 'dropoff' else pickup
+    if dropoff != pickup:
+        columns.append(dropoff)
+    return columns, pickup, dropoff
+
+
+def read_batches(path, dropoff_hour='pickup', block_size=BLOCK_SIZE, batch_size=BATCH_SIZE):
+    '''
+    Stream a trip file as record batches holding only the columns the
+    aggregation needs.
+
+    Inputs:
+      path (string): CSV (optionally compressed) or Parquet trip file
+      dropoff_hour (string): 'pickup' to bucket dropoffs by pickup time like
+        the Spark job, 'dropoff' to use the dropoff time
+      block_size (int): bytes of CSV parsed per batch
+      batch_size (int): rows per Parquet batch
+
+    Returns: (generator of pyarrow record batches, pickup column, dropoff column)
+    '''
+    if path.endswith('.parquet'):
+        parquet = pq.ParquetFile(path)
+        columns, pickup, dropoff = _columns(parquet.schema_arrow.names, dropoff_hour)
+        return parquet.iter_batches(batch_size=batch_size, columns=columns), pickup, dropoff
+
+    with pa_csv.open_csv(path, read_options=pa_csv.ReadOptions(block_size=1 << 16)) as probe:
+        names = probe.schema.names
+    columns, pickup, dropoff = _columns(names, dropoff_hour)
+    # Datetimes are read as strings and parsed per batch (see _timestamps), so an empty or
+    # malformed value only nulls its own row instead of failing the file
+    types = {column: pa.string() for column in columns if column.endswith('datetime')}
+    types.update({'PULocationID': pa.int32(), 'DOLocationID': pa.int32()})
+    convert_options = pa_csv.ConvertOptions(include_columns=columns, column_types=types, null_values=[''],
+                                            strings_can_be_null=True)
+    reader = pa_csv.open_csv(path, read_options=pa_csv.ReadOptions(block_size=block_size),
+                             convert_options=convert_options)
+    return reader, pickup, dropoff
+
+
+def _to_numpy(values):
+    # int64 numpy array with -1 for nulls
+    return pc.fill_null(values, -1).to_numpy(zero_copy_only=False).astype(np.int64)
+
+
+# Text form of the trip files' datetimes, e.g. 2019-01-01 00:46:40
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+DATETIME_LENGTH = 19
+
+
+def _timestamps(array):
+    # Datetime strings as timestamps, null where empty or malformed. The cast is the fast
+    # path but fails the whole batch on one bad value; such batches are parsed with
+    # strptime instead, dropping dates it rolled over (e.g. February 30th)
+    text = pc.if_else(pc.equal(pc.utf8_length(array), DATETIME_LENGTH), array, pa.scalar(None, pa.string()))
+    try:
+        return pc.cast(text, pa.timestamp('s'))
+    except pa.ArrowInvalid:
+        parsed = pc.strptime(text, format=DATETIME_FORMAT, unit='s', error_is_null=True)
+        day = pc.if_else(pc.is_valid(parsed), pc.utf8_slice_codeunits(text, 8, 10), pa.scalar(None, pa.string()))
+        day = pc.cast(day, pa.int64())
+        return pc.if_else(pc.equal(pc.day(parsed), day), parsed, pa.scalar(None, parsed.type))
+
+
+def _time_parts(array, periods):
+    # Hour and period values (Spark semantics) of a datetime column; -1 where missing or
+    # malformed, so the row is counted as skipped
+    if not pa.types.is_timestamp(array.type):
+        array = _timestamps(array)
+    parts = {'hour': pc.hour(array)}
+    if 'month' in periods:
+        parts['month'] = pc.month(array)
+    if 'day_of_week' in periods:
+        parts['day_of_week'] = pc.day_of_week(array, count_from_zero=False, week_start=7)
+    return {name: _to_numpy(values) for name, values in parts.items()}
+
+
+def _period_index(parts, periods):
+    # Combined period number (0 without periods) and validity of every row
+    index = np.zeros(len(parts['hour']), dtype=np.int64)
+    valid = (parts['hour'] >= 0) & (parts['hour'] < HOURS)
+    for name in periods:
+        values = parts[name] - 1
+        valid &= (values >= 0) & (values < PERIODS[name])
+        index = index * PERIODS[name] + values
+    return index, valid
+
+
+def _count(period, hour, zones, valid, n_periods):
+    zones = _to_numpy(zones)
+    keep = valid & (zones > 0) & (zones < N_ZONES)
+    keys = (period[keep] * HOURS + hour[keep]) * N_ZONES + zones[keep]
+    return (np.bincount(keys, minlength=n_periods * HOURS * N_ZONES).reshape(n_periods, HOURS, N_ZONES),
+            int((~keep).sum()))
+
+
+def aggregate_file(path, periods=(), dropoff_hour='pickup', block_size=BLOCK_SIZE):
+    '''
+    Count one trip file's pickups and dropoffs by period, hour and zone.
+
+    Inputs:
+      path (string): CSV or Parquet trip file
+      periods (list of strings): extra dimensions from PERIODS
+      dropoff_hour (string): see read_batches()
+      block_size (int): bytes of CSV parsed per batch
+
+    Returns: dict with 'pickups' and 'dropoffs' int64 arrays of shape
+    (periods, 24, N_ZONES), plus 'rows' and 'skipped' (rows with a missing
+    or out-of-range time or zone, per side) counts
+    '''
+    periods = list(periods)
+    n_periods = int(np.prod([PERIODS[name] for name in periods]))
+    shape = (n_periods, HOURS, N_ZONES)
+    result = {'pickups': np.zeros(shape, dtype=np.int64), 'dropoffs': np.zeros(shape, dtype=np.int64),
+              'rows': 0, 'skipped': 0}
+    batches, pickup, dropoff = read_batches(path, dropoff_hour, block_size)
+    for batch in batches:
+        pickup_parts = _time_parts(batch.column(pickup), periods)
+        period, valid = _period_index(pickup_parts, periods)
+        counts, skipped = _count(period, pickup_parts['hour'], batch.column('PULocationID'), valid, n_periods)
+        result['pickups'] += counts
+        result['skipped'] += skipped
+        if dropoff != pickup:
+            dropoff_parts = _time_parts(batch.column(dropoff), periods)
+            period, valid = _period_index(dropoff_parts, periods)
+            hours = dropoff_parts['hour']
+        else:
+            hours = pickup_parts['hour']
+        counts, skipped = _count(period, hours, batch.column('DOLocationID'), valid, n_periods)
+        result['dropoffs'] += counts
+        result['skipped'] += skipped
+        result['rows'] += batch.num_rows
+    return result
+
+
+def _aggregate_file(job):
+    return aggregate_file(*job)
+
+
+def aggregate_files(paths, periods=(), dropoff_hour='pickup', workers=None, block_size=BLOCK_SIZE, verbose=True):
+    '''
+    Count pickups and dropoffs over many trip files, one file per process.
+
+    Returns: dict like aggregate_file() summed over all files
+    '''
+    jobs = [(path, tuple(periods), dropoff_hour, block_size) for path in paths]
+    if workers == 1 or len(jobs) == 1:
+        results = map(_aggregate_file, jobs)
+        pool = None
+    else:
+        pool = Pool(workers)
+        results = pool.imap_unordered(_aggregate_file, jobs)
+    total = None
+    try:
+        for done, result in enumerate(results, 1):
+            if total is None:
+                total = result
+            else:
+                for key in total:
+                    total[key] += result[key]
+            if verbose:
+                print(f"Aggregated {done}/{len(jobs)} files, {total['rows']} trips")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return total
+
+
+def counts_table(counts, location_column, count_column, periods=()):
+    '''
+    Spark-shaped table of the non-zero counts: hour_of_day, the period
+    columns, the location ID and the count, ordered like the Spark job
+    output (location IDs compared as strings).
+
+    Returns: pandas dataframe
+    '''
+    period_index, hours, zones = np.nonzero(counts)
+    table = {'hour_of_day': hours}
+    sizes = [PERIODS[name] for name in periods]
+    for position, name in enumerate(periods):
+        table[name] = period_index // int(np.prod(sizes[position + 1:])) % sizes[position] + 1
+    table[location_column] = zones
+    table[count_column] = counts[period_index, hours, zones]
+    table = pd.DataFrame(table)
+    order = ['hour_of_day'] + list(periods)
+    table['_location'] = table[location_column].astype(str)
+    return table.sort_values(order + ['_location'], kind='stable').drop(columns='_location').reset_index(drop=True)
+
+
+def output_name(side, periods=()):
+    suffix = ''.join('And' + ''.join(part.title() for part in name.split('_')) for name in periods)
+    return f'nyc_taxi_rides_2019_aggBy{side}andHour{suffix}.csv'
+
+
+def write_tables(result, out_dir=DATA_DIR, periods=()):
+    '''
+    Write the pickup and dropoff tables in the Spark job's schema.
+
+    Returns: list of written paths
+    '''
+    paths = []
+    for side, key, location_column, count_column in [('PU', 'pickups', 'PULocationID', 'pickup_count'),
+                                                    ('DO', 'dropoffs', 'DOLocationID', 'dropoff_count')]:
+        path = os.path.join(out_dir, output_name(side, periods))
+        counts_table(result[key], location_column, count_column, periods).to_csv(path, index=False)
+        paths.append(path)
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Aggregate taxi trip files by zone and hour')
+    parser.add_argument('paths', nargs='+', help='trip files or glob patterns (CSV or Parquet)')
+    parser.add_argument('--workers', type=int, default=None, help='processes (default: one per CPU)')
+    parser.add_argument('--by', action='append', default=[], choices=sorted(PERIODS),
+                        help='also group by month and/or day_of_week')
+    parser.add_argument('--dropoff-hour', choices=['pickup', 'dropoff'], default='pickup',
+                        help="time used to bucket dropoffs ('pickup' matches the Spark output)")
+    parser.add_argument('--out-dir', default=DATA_DIR)
+    args = parser.parse_args()
+
+    paths = sorted(path for pattern in args.paths for path in (glob.glob(pattern) or [pattern]))
+    result = aggregate_files(paths, args.by, args.dropoff_hour, args.workers)
+    print(f"Skipped {result['skipped']} pickups/dropoffs with a missing or invalid time or zone")
+    for path in write_tables(result, args.out_dir, args.by):
+        print(f"Wrote {path}")
@@ -0,0 +1,533 @@
+# Mapbox Vector Tile endpoint for the dashboards' point and polygon layers
+#
+# Instead of embedding every feature in the folium page, a map can load
+# /tiles/<layer>/<version>/<z>/<x>/<y>.pbf and the browser only downloads the visible
+# tiles. version is a hash of the layer's features, so tiles can be cached for good.
+# Tiles are cut on demand: an STRtree finds the features touching the tile, shapely
+# clips and simplifies them to the tile's pixel size and they are encoded as MVT
+# (protobuf, written by hand below so no extra dependency is needed). Encoded tiles are
+# gzipped and kept in an LRU cache; optionally they are read from (and can be seeded
+# into) one MBTiles file per layer, {layer}.mbtiles or {layer}.{region}.mbtiles for the
+# layers of a region. The file's metadata records the layer version and region it was
+# seeded from, and a file that does not match the served layer is ignored.
+#
+# Seed MBTiles with:
+#   python -m elec_transit_y.tiles --layer stations --max-zoom 8 [--out-dir data/tiles]
+#   python -m elec_transit_y.tiles --region nyc --max-zoom 10 [--out-dir data/tiles]
+import argparse
+import gzip
+import math
+import os
+import sqlite3
+import struct
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from flask import Response, abort, request
+
+from elec_transit_y.cache import LRUCache, data_hash
+from elec_transit_y.geometry import IMMUTABLE, REVALIDATE
+
+# Half the width of the web mercator world, in metres
+ORIGIN_SHIFT = 2 * math.pi * 6378137 / 2.0
+
+# Tile coordinate resolution and the margin drawn around each tile (in tile units)
+EXTENT = 4096
+BUFFER = 64
+
+# Deepest zoom served; the browser overzooms beyond it
+MAX_ZOOM = 16
+
+# Encoded tiles kept in memory across all layers
+TILE_CACHE_SIZE = int(os.environ.get('TILE_CACHE_SIZE', 4096))
+
+# Directory with pre-seeded {layer}.mbtiles files, if any
+MBTILES_DIR = os.environ.get('TILE_MBTILES_DIR')
+
+# MVT geometry types and commands
+POINT, LINESTRING, POLYGON = 1, 2, 3
+MOVE_TO, LINE_TO, CLOSE_PATH = 1, 2, 7
+
+
+def tile_bounds(z, x, y):
+    '''
+    Web mercator (EPSG:3857) bounds of an XYZ tile.
+
+    Returns: (minx, miny, maxx, maxy) in metres
+    '''
+    size = 2 * ORIGIN_SHIFT / 2 ** z
+    minx = -ORIGIN_SHIFT + x * size
+    maxy = ORIGIN_SHIFT - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def tiles_for_bounds(bounds, z):
+    '''
+    XYZ tiles covering lon/lat bounds at a zoom level.
+
+    Inputs:
+      bounds (tuple): (min_lon, min_lat, max_lon, max_lat)
+
+    Returns: list of (z, x, y)
+    '''
+    min_lon, min_lat, max_lon, max_lat = bounds
+    n = 2 ** z
+
+    def tile_xy(lon, lat):
+        lat = max(min(lat, 85.0511), -85.0511)
+        x = int((lon + 180.0) / 360.0 * n)
+        y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+        return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+    x0, y0 = tile_xy(min_lon, max_lat)
+    x1, y1 = tile_xy(max_lon, min_lat)
+    return [(z, x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+# Protobuf encoding (the subset used by vector_tile.proto)
+
+def _encode_varint(value):
+    out = bytearray()
+    value &= (1 << 64) - 1
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+# Tile coordinates, tag indices and lengths are mostly small, so their encodings are precomputed
+_SMALL_VARINTS = [_encode_varint(value) for value in range(1 << 14)]
+
+
+def _varint(value):
+    if 0 <= value < 16384:
+        return _SMALL_VARINTS[value]
+    return _encode_varint(value)
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _field(number, wire_type):
+    return _varint((number << 3) | wire_type)
+
+
+def _bytes_field(number, payload):
+    return _field(number, 2) + _varint(len(payload)) + payload
+
+
+def _packed(number, values):
+    return _bytes_field(number, b''.join(_varint(value) for value in values))
+
+
+def _value(value):
+    # vector_tile.Value: string=1, double=3, int=4, sint=6, bool=7
+    if isinstance(value, (bool, np.bool_)):
+        return _field(7, 0) + _varint(int(value))
+    if isinstance(value, (int, np.integer)):
+        value = int(value)
+        if value >= 0:
+            return _field(4, 0) + _varint(value)
+        return _field(6, 0) + _varint(_zigzag(value))
+    if isinstance(value, (float, np.floating)):
+        return _field(3, 1) + struct.pack('<d', float(value))
+    return _bytes_field(1, str(value).encode())
+
+
+class _GeometryEncoder:
+    '''
+    Turns tile-coordinate geometries into MVT command integers. The cursor
+    carries over between the parts and rings of a feature.
+    '''
+
+    def __init__(self):
+        self.commands = []
+        self.x = 0
+        self.y = 0
+
+    def _move(self, points, command):
+        self.commands.append(command | (len(points) << 3))
+        for x, y in points:
+            self.commands.append(_zigzag(int(x) - self.x))
+            self.commands.append(_zigzag(int(y) - self.y))
+            self.x, self.y = int(x), int(y)
+
+    def ring(self, coords, exterior):
+        # Rounded, de-duplicated ring without the closing point; exterior rings have a
+        # positive surveyor's area in tile coordinates (clockwise with y pointing down)
+        coords = np.rint(coords[:-1]).astype(np.int64)
+        keep = np.ones(len(coords), dtype=bool)
+        keep[1:] = np.any(coords[1:] != coords[:-1], axis=1)
+        coords = coords[keep]
+        if len(coords) > 1 and (coords[0] == coords[-1]).all():
+            coords = coords[:-1]
+        if len(coords) < 3:
+            return False
+        area = np.sum(coords[:, 0] * np.roll(coords[:, 1], -1) - np.roll(coords[:, 0], -1) * coords[:, 1])
+        if area == 0:
+            return False
+        if (area > 0) != exterior:
+            coords = coords[::-1]
+        self._move(coords[:1], MOVE_TO)
+        self._move(coords[1:], LINE_TO)
+        self.commands.append(CLOSE_PATH | (1 << 3))
+        return True
+
+    def polygon(self, polygon):
+        start = len(self.commands)
+        cursor = (self.x, self.y)
+        if not self.ring(np.asarray(polygon.exterior.coords), exterior=True):
+            del self.commands[start:]
+            self.x, self.y = cursor
+            return
+        for interior in polygon.interiors:
+            self.ring(np.asarray(interior.coords), exterior=False)
+
+
+def _encode_layer(name, features, keys, values):
+    parts = [_field(15, 0), _varint(2), _bytes_field(1, name.encode())]
+    for feature_id, geometry_type, commands, tags in features:
+        feature = b''.join([_field(1, 0), _varint(feature_id), _packed(2, tags),
+                            _field(3, 0), _varint(geometry_type), _packed(4, commands)])
+        parts.append(_bytes_field(2, feature))
+    parts.extend(_bytes_field(3, key.encode()) for key in keys)
+    parts.extend(_bytes_field(4, _value(value)) for value in values)
+    parts.append(_field(5, 0) + _varint(EXTENT))
+    return _bytes_field(3, b''.join(parts))
+
+
+class TileLayer:
+    '''
+    A point or polygon layer that can be cut into vector tiles.
+
+    Inputs:
+      gdf (geopandas dataframe): features in any CRS
+      name (string): layer name inside the tiles (and in the URL)
+      columns (list of strings): properties written to the tiles
+      max_zoom (int): deepest zoom generated for this layer
+      properties_min_zoom (int): below this zoom features carry no properties,
+        which keeps zoomed-out tiles of dense point layers small
+
+    version is a short hash of the features and settings, used in tile URLs.
+    '''
+
+    def __init__(self, gdf, name, columns=(), max_zoom=MAX_ZOOM, properties_min_zoom=0):
+        self.name = name
+        features = gdf[list(columns) + [gdf.geometry.name]]
+        self.version = data_hash(features, pd.DataFrame({'zoom': [max_zoom, properties_min_zoom]}))[:12]
+        self.max_zoom = max_zoom
+        self.properties_min_zoom = properties_min_zoom
+        self.geometries = np.asarray(gdf.to_crs('EPSG:3857').geometry.values, dtype=object)
+        self.is_points = bool(len(self.geometries)) and bool(
+            (shapely.get_type_id(self.geometries) == shapely.GeometryType.POINT).all())
+        if self.is_points:
+            self.xy = shapely.get_coordinates(self.geometries)
+        self.tree = shapely.STRtree(self.geometries)
+        self.columns = list(columns)
+        # Each property as integer codes into its distinct values (-1 where missing)
+        self.codes, self.uniques = [], []
+        for column in self.columns:
+            codes, uniques = pd.factorize(gdf[column])
+            self.codes.append(codes)
+            self.uniques.append(list(uniques))
+        self.bounds = tuple(gdf.to_crs('EPSG:4326').total_bounds)
+
+    @classmethod
+    def from_points(cls, frame, name, columns=(), latitude='latitude', longitude='longitude', **kwargs):
+        '''
+        Build a point layer from a dataframe with latitude/longitude columns.
+        '''
+        geometry = gpd.points_from_xy(frame[longitude], frame[latitude], crs='EPSG:4326')
+        return cls(gpd.GeoDataFrame(frame[list(columns)].reset_index(drop=True), geometry=geometry), name,
+                   columns, **kwargs)
+
+    def _tags(self, positions, z):
+        '''
+        Tags of the features at positions, with a value table local to the tile.
+
+        Returns: (list of [key, value, key, value, ...] per feature, list of values)
+        '''
+        values, columns = [], []
+        properties = zip(self.codes, self.uniques) if z >= self.properties_min_zoom else []
+        for codes, uniques in properties:
+            codes = codes[positions]
+            present = codes >= 0
+            distinct, inverse = np.unique(codes[present], return_inverse=True)
+            column = np.full(len(positions), -1, dtype=np.int64)
+            column[present] = inverse + len(values)
+            values.extend(uniques[code] for code in distinct)
+            columns.append(column)
+        tags = []
+        for row in (np.column_stack(columns).tolist() if columns else [[] for _ in positions]):
+            feature_tags = []
+            for key, value in enumerate(row):
+                if value >= 0:
+                    feature_tags += (key, value)
+            tags.append(feature_tags)
+        return tags, values
+
+    def encode(self, z, x, y):
+        '''
+        Encode one tile of this layer.
+
+        Returns: MVT bytes (empty if the tile has no features)
+        '''
+        minx, miny, maxx, maxy = tile_bounds(z, x, y)
+        scale = EXTENT / (maxx - minx)
+        margin = BUFFER / scale
+        candidates = self.tree.query(shapely.box(minx - margin, miny - margin, maxx + margin, maxy + margin))
+        if len(candidates) == 0:
+            return b''
+        candidates.sort()
+
+        features = []
+        if self.is_points:
+            tile_xy = np.column_stack([(self.xy[candidates, 0] - minx) * scale, (maxy - self.xy[candidates, 1]) * scale])
+            tile_xy = np.rint(tile_xy).astype(np.int64)
+            # Points landing on the same tile coordinate are drawn once
+            _, first = np.unique(tile_xy, axis=0, return_index=True)
+            first.sort()
+            candidates, tile_xy = candidates[first], tile_xy[first]
+            tags, values = self._tags(candidates, z)
+            commands = (tile_xy << 1) ^ (tile_xy >> 63)
+            for position, (x_command, y_command), feature_tags in zip(candidates.tolist(), commands.tolist(), tags):
+                features.append((position + 1, POINT, [MOVE_TO | (1 << 3), x_command, y_command], feature_tags))
+        else:
+            tags, values = self._tags(candidates, z)
+            clipped = shapely.clip_by_rect(self.geometries[candidates], minx - margin, miny - margin,
+                                           maxx + margin, maxy + margin)
+            simplified = shapely.simplify(clipped, 1.0 / scale, preserve_topology=True)
+            for i, (position, geometry) in enumerate(zip(candidates, simplified)):
+                if geometry is None or geometry.is_empty:
+                    continue
+                encoder = _GeometryEncoder()
+                for polygon in shapely.get_parts(geometry):
+                    if polygon.geom_type != 'Polygon':
+                        continue
+                    polygon = shapely.transform(polygon, lambda coords: np.column_stack(
+                        [(coords[:, 0] - minx) * scale, (maxy - coords[:, 1]) * scale]))
+                    encoder.polygon(polygon)
+                if encoder.commands:
+                    features.append((int(position) + 1, POLYGON, encoder.commands, tags[i]))
+
+        if not features:
+            return b''
+        return _encode_layer(self.name, features, self.columns, values)
+
+
+class TileSource:
+    '''
+    Serves gzipped tiles for several layers from an LRU cache, falling back
+    to pre-seeded MBTiles and then to cutting the tile on demand.
+
+    Inputs:
+      layers (list of TileLayer)
+      mbtiles_dir (string): directory with {layer}.mbtiles files
+      cache_size (int): number of encoded tiles kept in memory
+      region (string): name of the region the layers belong to, if any
+    '''
+
+    def __init__(self, layers, mbtiles_dir=MBTILES_DIR, cache_size=TILE_CACHE_SIZE, region=None):
+        self.layers = {layer.name: layer for layer in layers}
+        self.mbtiles_dir = mbtiles_dir
+        self.cache = LRUCache(maxsize=cache_size)
+        self.region = region
+        # Layer -> MBTiles path, or None when there is no file matching the layer
+        self._mbtiles = {}
+
+    def mbtiles_name(self, layer):
+        '''
+        Returns: file name of the layer's MBTiles
+        '''
+        return f'{layer}.mbtiles' if self.region is None else f'{layer}.{self.region}.mbtiles'
+
+    def _mbtiles_metadata(self, layer):
+        return {'version': self.layers[layer].version, 'region': self.region or ''}
+
+    def _mbtiles_path(self, layer):
+        if not self.mbtiles_dir:
+            return None
+        if layer not in self._mbtiles:
+            path = os.path.join(self.mbtiles_dir, self.mbtiles_name(layer))
+            if os.path.exists(path):
+                with sqlite3.connect(f'file:{path}?mode=ro', uri=True) as connection:
+                    metadata = dict(connection.execute('SELECT name, value FROM metadata').fetchall())
+                expected = self._mbtiles_metadata(layer)
+                if any(metadata.get(name) != value for name, value in expected.items()):
+                    print(f"Ignoring {path}: seeded from version {metadata.get('version')} of "
+                          f"{metadata.get('region') or 'the national layer'}, serving {expected['version']}")
+                    path = None
+            else:
+                path = None
+            self._mbtiles[layer] = path
+        return self._mbtiles[layer]
+
+    def _read_mbtiles(self, layer, z, x, y):
+        path = self._mbtiles_path(layer)
+        if path is None:
+            return None
+        # MBTiles rows are numbered from the bottom (TMS)
+        with sqlite3.connect(f'file:{path}?mode=ro', uri=True) as connection:
+            row = connection.execute(
+                'SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?',
+                (z, x, 2 ** z - 1 - y)).fetchone()
+        return row[0] if row else None
+
+    def _create(self, layer, z, x, y):
+        stored = self._read_mbtiles(layer, z, x, y)
+        if stored is not None:
+            return stored
+        return gzip.compress(self.layers[layer].encode(z, x, y), mtime=0)
+
+    def version(self, layer):
+        '''
+        Returns: the layer's version for tile URLs, or None for an unknown layer
+        '''
+        return self.layers[layer].version if layer in self.layers else None
+
+    def tile(self, layer, z, x, y):
+        '''
+        Returns: gzipped MVT bytes, or None for an unknown layer or a zoom
+        beyond the layer's max_zoom
+        '''
+        if layer not in self.layers or not 0 <= z <= self.layers[layer].max_zoom:
+            return None
+        if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            return None
+        return self.cache.get_or_create((layer, z, x, y), lambda: self._create(layer, z, x, y))
+
+    def seed_mbtiles(self, layer, path, min_zoom=0, max_zoom=None):
+        '''
+        Write every tile of a layer overlapping its bounds, from min_zoom to
+        max_zoom, to an MBTiles file, with the layer's version and region in
+        its metadata.
+
+        Returns: number of tiles written
+        '''
+        tile_layer = self.layers[layer]
+        max_zoom = tile_layer.max_zoom if max_zoom is None else max_zoom
+        count = 0
+        with sqlite3.connect(path) as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT)')
+            connection.execute('CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, tile_column INTEGER, '
+                               'tile_row INTEGER, tile_data BLOB)')
+            connection.execute('CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles '
+                               '(zoom_level, tile_column, tile_row)')
+            connection.execute('DELETE FROM metadata')
+            metadata = {'name': layer, 'format': 'pbf', 'minzoom': str(min_zoom), 'maxzoom': str(max_zoom),
+                        'bounds': ','.join(str(value) for value in tile_layer.bounds),
+                        **self._mbtiles_metadata(layer)}
+            connection.executemany('INSERT INTO metadata VALUES (?, ?)', metadata.items())
+            for z in range(min_zoom, max_zoom + 1):
+                for _, x, y in tiles_for_bounds(tile_layer.bounds, z):
+                    data = tile_layer.encode(z, x, y)
+                    if not data:
+                        continue
+                    connection.execute('INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)',
+                                       (z, x, 2 ** z - 1 - y, gzip.compress(data, mtime=0)))
+                    count += 1
+                print(f"Seeded {layer} zoom {z}: {count} tiles so far")
+        return count
+
+
+def register_tile_routes(server, source):
+    '''
+    Serve a TileSource at /tiles/<layer>/<version>/<z>/<x>/<y>.pbf. Tiles of
+    the layer's current version are cached for good; a page still holding an
+    older version gets the current tiles, revalidated by ETag.
+
+    Inputs:
+      server (flask app): the Dash app's server
+      source (TileSource)
+    '''
+    def vector_tile(layer, version, z, x, y):
+        data = source.tile(layer, z, x, y)
+        if data is None:
+            abort(404)
+        current = source.version(layer)
+        response = Response(data, mimetype='application/vnd.mapbox-vector-tile')
+        response.headers['Content-Encoding'] = 'gzip'
+        response.set_etag(f'{current}-{z}-{x}-{y}')
+        response.headers['Cache-Control'] = IMMUTABLE if version == current else REVALIDATE
+        return response.make_conditional(request)
+
+    server.add_url_rule('/tiles/<layer>/<version>/<int:z>/<int:x>/<int:y>.pbf', 'vector_tile', vector_tile)
+
+
+# Properties written to the tiles of each default layer
+STATION_TILE_COLUMNS = ['id', 'station_name', 'street_address', 'city', 'state', 'zip', 'fuel_type_code',
+                        'access_code']
+TRACT_TILE_COLUMNS = ['GEOID', 'Population_Density']
+ZONE_TILE_COLUMNS = ['LocationID', 'zone', 'borough']
+
+
+# Zoomed out, station tiles hold only positions; popups need zooming in past this level
+STATION_PROPERTIES_MIN_ZOOM = 8
+
+
+def station_tile_layer(stations, name='stations'):
+    '''
+    Point tile layer for a station dataframe with latitude/longitude columns.
+
+    Returns: TileLayer
+    '''
+    columns = [column for column in STATION_TILE_COLUMNS if column in stations.columns]
+    return TileLayer.from_points(stations, name, columns, properties_min_zoom=STATION_PROPERTIES_MIN_ZOOM)
+
+
+def default_layers():
+    '''
+    Tile layers for the bundled stations, census tracts and taxi zones.
+
+    Returns: list of TileLayer
+    '''
+    from elec_transit_y import bundle
+    stations = bundle.load('ev_stations').dropna(subset=['latitude', 'longitude'])
+    return [
+        station_tile_layer(stations),
+        TileLayer(bundle.load('census_tracts'), 'census_tracts', TRACT_TILE_COLUMNS),
+        TileLayer(bundle.load('taxi_zones'), 'taxi_zones', ZONE_TILE_COLUMNS)
+    ]
+
+
+def region_layers(data):
+    '''
+    Tile layers for the stations, census tracts and zones of a region.
+
+    Inputs:
+      data (RegionData): see regions.py
+
+    Returns: list of TileLayer
+    '''
+    return [
+        station_tile_layer(data.stations),
+        TileLayer(data.tracts, 'census_tracts', TRACT_TILE_COLUMNS),
+        TileLayer(data.zones, 'taxi_zones', [column for column in ZONE_TILE_COLUMNS if column in data.zones.columns])
+    ]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Seed MBTiles files for the vector tile endpoint')
+    parser.add_argument('--layer', action='append', help='layer to seed (default: all)')
+    parser.add_argument('--region', help="seed the layers of a region of nyc_app.py instead of the bundle's")
+    parser.add_argument('--min-zoom', type=int, default=0)
+    parser.add_argument('--max-zoom', type=int, default=10)
+    parser.add_argument('--out-dir', default=MBTILES_DIR or os.path.join('data', 'tiles'))
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    if args.region:
+        from elec_transit_y.regions import REGIONS, RegionData
+        tile_source = TileSource(region_layers(RegionData(REGIONS[args.region])), mbtiles_dir=None, region=args.region)
+    else:
+        tile_source = TileSource(default_layers(), mbtiles_dir=None)
+    for layer_name in args.layer or list(tile_source.layers):
+        tile_source.seed_mbtiles(layer_name, os.path.join(args.out_dir, tile_source.mbtiles_name(layer_name)),
+                                 args.min_zoom, args.max_zoom)
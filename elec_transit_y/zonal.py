@@ -0,0 +1,313 @@
+# Zonal statistics of rasters over taxi zones, computed tile by tile in a process pool
+#
+# This is the census/analysis/pop_raster.ipynb workflow (rasterize census tract population
+# density, sum and average it per taxi zone) as a module that scales with the raster:
+#
+#   * rasters live on disk as .npy files (memory-mapped) or GeoTIFFs (windowed reads),
+#     and every step works on one tile (window) at a time, so the full raster is never
+#     held in memory;
+#   * polygons are rasterized tile by tile, and per-zone sums and pixel counts are
+#     bincounts over each tile, both spread over a process pool;
+#   * per-tile results are reduced in tile order, so the output does not depend on the
+#     number of workers and is bit-identical to the serial (workers=1) path;
+#   * per-tile results can be persisted (cache_dir), keyed by the input files' size and
+#     modification time, so rerunning after adding a layer or year only computes new tiles.
+#
+# Usage:
+#   python -m elec_transit_y.zonal [--resolution 10] [--workers 8] [--raster road_density=roads.tif]
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import shapely
+from affine import Affine
+
+from elec_transit_y.cache import LRUCache
+
+TILE_SIZE = 1024
+
+# Open rasters and tile caches of the current process (each pool worker has its own)
+_rasters = {}
+_tile_caches = {}
+
+
+def tile_windows(height, width, tile_size=TILE_SIZE):
+    '''
+    Returns: list of (row_off, col_off, height, width) tiles in row-major order
+    '''
+    return [(row, col, min(tile_size, height - row), min(tile_size, width - col))
+            for row in range(0, height, tile_size) for col in range(0, width, tile_size)]
+
+
+class RasterGrid:
+    '''
+    Pixel grid of a raster: affine transform, shape and CRS.
+
+    Inputs:
+      transform (affine.Affine): maps (col, row) to CRS coordinates
+      height, width (int): raster shape in pixels
+      crs: anything geopandas accepts as a CRS
+    '''
+
+    def __init__(self, transform, height, width, crs):
+        self.transform = transform
+        self.height = height
+        self.width = width
+        self.crs = crs
+
+    @classmethod
+    def covering(cls, gdf, resolution, crs=None):
+        '''
+        North-up grid of resolution-sized pixels covering a layer, in crs
+        (by default the layer's UTM zone, so resolution is in metres).
+        '''
+        crs = crs or gdf.estimate_utm_crs()
+        min_x, min_y, max_x, max_y = gdf.to_crs(crs).total_bounds
+        width = int(np.ceil((max_x - min_x) / resolution))
+        height = int(np.ceil((max_y - min_y) / resolution))
+        return cls(Affine(resolution, 0, min_x, 0, -resolution, max_y), height, width, crs)
+
+    @classmethod
+    def of_raster(cls, path):
+        '''
+        Grid of an existing GeoTIFF.
+        '''
+        import rasterio
+        with rasterio.open(path) as dataset:
+            return cls(dataset.transform, dataset.height, dataset.width, dataset.crs)
+
+    @property
+    def pixel_area(self):
+        return abs(self.transform.a * self.transform.e - self.transform.b * self.transform.d)
+
+    def windows(self, tile_size=TILE_SIZE):
+        return tile_windows(self.height, self.width, tile_size)
+
+    def window_transform(self, window):
+        row, col, _, _ = window
+        return self.transform * Affine.translation(col, row)
+
+    def window_bounds(self, window):
+        row, col, height, width = window
+        transform = self.window_transform(window)
+        x0, y0 = transform * (0, 0)
+        x1, y1 = transform * (width, height)
+        return min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
+
+
+def _fingerprint(path):
+    # Identifies a raster file's contents without reading it
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+
+def _open(path):
+    # Memory-mapped .npy or an open GeoTIFF, kept open until the file changes
+    key = _fingerprint(path)
+    if key not in _rasters:
+        if path.endswith('.npy'):
+            _rasters[key] = np.load(path, mmap_mode='r')
+        else:
+            import rasterio
+            _rasters[key] = rasterio.open(path)
+    return _rasters[key]
+
+
+def read_window(path, window):
+    '''
+    Read one tile of a raster without loading the rest of it.
+
+    Inputs:
+      path (string): .npy file or GeoTIFF (first band)
+      window (tuple): (row_off, col_off, height, width)
+
+    Returns: numpy array of shape (height, width)
+    '''
+    row, col, height, width = window
+    raster = _open(path)
+    if isinstance(raster, np.ndarray):
+        return np.asarray(raster[row:row + height, col:col + width])
+    from rasterio.windows import Window
+    return raster.read(1, window=Window(col, row, width, height))
+
+
+def _rasterize_tile(path, grid, window, geometries, values, fill, dtype):
+    from rasterio.features import rasterize
+    row, col, height, width = window
+    tile = np.full((height, width), fill, dtype=dtype)
+    if len(geometries):
+        tile = rasterize(zip(geometries, values), out_shape=(height, width), fill=fill,
+                         transform=grid.window_transform(window), dtype=dtype)
+    raster = np.load(path, mmap_mode='r+')
+    raster[row:row + height, col:col + width] = tile
+    raster.flush()
+
+
+def rasterize_layer(gdf, values, grid, path, fill=np.nan, dtype='float32', tile_size=TILE_SIZE, workers=None):
+    '''
+    Burn per-polygon values into a .npy raster on grid, tile by tile (a
+    pixel takes the value of the polygon covering its centre).
+
+    Inputs:
+      gdf (geopandas dataframe): polygons in any CRS
+      values (array-like): one value per polygon
+      grid (RasterGrid)
+      path (string): .npy file to write
+      fill: value of pixels outside every polygon
+      dtype (string): raster dtype
+      tile_size (int): tile edge in pixels
+      workers (int): processes (None: one per CPU, 1: serial)
+
+    Returns: path
+    '''
+    geometries = gdf.to_crs(grid.crs).geometry.values
+    values = np.asarray(values)
+    tree = shapely.STRtree(geometries)
+    np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(grid.height, grid.width)).flush()
+
+    jobs = []
+    for window in grid.windows(tile_size):
+        hits = np.sort(tree.query(shapely.box(*grid.window_bounds(window))))
+        jobs.append((path, grid, window, geometries[hits], values[hits], fill, dtype))
+    if workers == 1:
+        for job in jobs:
+            _rasterize_tile(*job)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(_rasterize_tile, *zip(*jobs)))
+    return path
+
+
+def _tile_sums(value_path, zone_path, window, n_zones, nodata, cache_dir, fingerprints):
+    def compute():
+        values = read_window(value_path, window).astype(np.float64)
+        zones = read_window(zone_path, window).astype(np.intp)
+        valid = np.isfinite(values) & (zones > 0)
+        if nodata is not None:
+            valid &= values != nodata
+        zones, values = zones[valid], values[valid]
+        return (np.bincount(zones, weights=values, minlength=n_zones + 1),
+                np.bincount(zones, minlength=n_zones + 1))
+
+    if cache_dir is None:
+        return compute()
+    if cache_dir not in _tile_caches:
+        _tile_caches[cache_dir] = LRUCache(maxsize=256, persist_dir=cache_dir, namespace='zonal')
+    return _tile_caches[cache_dir].get_or_create((fingerprints, window, n_zones, nodata), compute)
+
+
+def zonal_stats(value_path, zone_path, n_zones, tile_size=TILE_SIZE, workers=None, nodata=None, cache_dir=None):
+    '''
+    Per-zone sum, pixel count and mean of a raster.
+
+    Inputs:
+      value_path (string): .npy or GeoTIFF raster of values
+      zone_path (string): raster on the same grid holding zone numbers
+        1..n_zones (0 outside every zone), e.g. from zone_raster()
+      n_zones (int): number of zones
+      tile_size (int): tile edge in pixels
+      workers (int): processes (None: one per CPU, 1: serial)
+      nodata (float): value to skip besides NaN (default: the GeoTIFF's nodata)
+      cache_dir (string): directory for per-tile results
+
+    Returns: dict of numpy arrays 'sum', 'count' and 'mean', one entry per zone
+    '''
+    raster = _open(value_path)
+    if nodata is None:
+        nodata = getattr(raster, 'nodata', None)
+    windows = tile_windows(*raster.shape[-2:], tile_size)
+    fingerprints = (_fingerprint(value_path), _fingerprint(zone_path))
+    arguments = [(value_path, zone_path, window, n_zones, nodata, cache_dir, fingerprints) for window in windows]
+    if workers == 1:
+        tiles = [_tile_sums(*job) for job in arguments]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            tiles = list(pool.map(_tile_sums, *zip(*arguments), chunksize=max(1, len(arguments) // 64)))
+
+    # Reduce in tile order so the result does not depend on scheduling
+    sums = np.zeros(n_zones + 1)
+    counts = np.zeros(n_zones + 1, dtype=np.int64)
+    for tile_sum, tile_count in tiles:
+        sums += tile_sum
+        counts += tile_count
+    sums, counts = sums[1:], counts[1:]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    return {'sum': sums, 'count': counts, 'mean': means}
+
+
+def zone_raster(zones, grid, path, tile_size=TILE_SIZE, workers=None):
+    '''
+    Rasterize zones as 1..len(zones) in row order (0 outside every zone).
+
+    Returns: path
+    '''
+    return rasterize_layer(zones, np.arange(1, len(zones) + 1), grid, path, fill=0, dtype='int32',
+                           tile_size=tile_size, workers=workers)
+
+
+def zonal_table(zones, layers, resolution=10.0, work_dir='zonal', tile_size=TILE_SIZE, workers=None,
+                cache_dir=None, zone_column='LocationID'):
+    '''
+    Zonal statistics of several layers over a set of zones.
+
+    Inputs:
+      zones (geopandas dataframe): zone polygons, e.g. taxi zones
+      layers (dict): name -> (polygon geodataframe, value column) to rasterize
+        at resolution, or name -> path of an existing GeoTIFF
+      resolution (float): pixel size in metres for rasterized layers
+      work_dir (string): directory for the intermediate rasters
+      zone_column (string): zone id column used as the index
+
+    Returns: pandas dataframe with {name}_sum, {name}_mean and {name}_pixels
+    columns per layer (sums are in value units x pixels)
+    '''
+    os.makedirs(work_dir, exist_ok=True)
+    grid = RasterGrid.covering(zones, resolution)
+    zone_paths = {}
+
+    def zones_on(raster_grid, key):
+        # One zone raster per distinct grid
+        if key not in zone_paths:
+            zone_paths[key] = zone_raster(zones, raster_grid, os.path.join(work_dir, f'zones_{key}.npy'),
+                                          tile_size, workers)
+        return zone_paths[key]
+
+    table = pd.DataFrame(index=pd.Index(zones[zone_column].to_numpy(), name=zone_column))
+    for name, layer in layers.items():
+        if isinstance(layer, str):
+            value_path, zone_path = layer, zones_on(RasterGrid.of_raster(layer), name)
+        else:
+            frame, column = layer
+            value_path = rasterize_layer(frame, frame[column].to_numpy(dtype=float), grid,
+                                         os.path.join(work_dir, f'{name}.npy'), tile_size=tile_size,
+                                         workers=workers)
+            zone_path = zones_on(grid, 'grid')
+        stats = zonal_stats(value_path, zone_path, len(zones), tile_size, workers, cache_dir=cache_dir)
+        table[f'{name}_sum'] = stats['sum']
+        table[f'{name}_mean'] = stats['mean']
+        table[f'{name}_pixels'] = stats['count']
+    return table
+
+
+if __name__ == '__main__':
+    from elec_transit_y import bundle
+
+    parser = argparse.ArgumentParser(description='Population density (and other rasters) per taxi zone')
+    parser.add_argument('--resolution', type=float, default=10.0, help='pixel size in metres')
+    parser.add_argument('--workers', type=int, default=None, help='processes (default: one per CPU)')
+    parser.add_argument('--tile-size', type=int, default=TILE_SIZE)
+    parser.add_argument('--raster', action='append', default=[], help='extra layer as name=path.tif')
+    parser.add_argument('--work-dir', default=os.path.join('data', 'zonal'))
+    parser.add_argument('--cache-dir', default=None, help='directory for per-tile results')
+    parser.add_argument('--out', default=os.path.join('data', 'zonal', 'taxi_zone_stats.csv'))
+    args = parser.parse_args()
+
+    layers = {'population_density': (bundle.load('census_tracts'), 'Population_Density')}
+    layers.update(dict(raster.split('=', 1) for raster in args.raster))
+    table = zonal_table(bundle.load('taxi_zones'), layers, args.resolution, args.work_dir, args.tile_size,
+                        args.workers, args.cache_dir)
+    table.to_csv(args.out)
+    print(f"Wrote zonal statistics for {len(table)} zones to {args.out}")
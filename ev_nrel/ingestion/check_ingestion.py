@@ -0,0 +1,216 @@
+# End-to-end check of the NREL ingestion engine (lambda/nrel_ingest.py) against a local
+# stub of the NREL API and moto's in-memory S3
+#
+# The stub serves STATIONS stations in pages of PAGE_SIZE and fails the first request
+# for each page once:
+#   - page 1: the connection is dropped without a response
+#   - page 2: 429 with a Retry-After header
+#   - page 3: 503
+# and the check asserts that:
+#   - every page was requested twice (the failure and its retry) and nothing else
+#   - the retry after the 429 waited at least Retry-After seconds
+#   - every station reached S3, in the state's fuel type partition
+#   - the partition was uploaded in several parts; TRANSFER_CONFIG is lowered to S3's
+#     5 MB minimum part size so a partition of about 12 MB takes three parts
+#
+# It then syncs the stored state (lambda/nrel_sync.py) against the stub, without failures:
+#   - a listing cut short after the first page, while a station on the first page and an
+#     older change on the last page are updated: only the first is stored and the
+#     removals are held back; the next complete listing still stores the second
+#   - a state of a few stations, in its own folder, can lose one of them
+# The exit status is 1 if any check failed, so the script can gate CI.
+#
+# Usage:
+#   python ev_nrel/ingestion/check_ingestion.py
+
+import base64
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lambda'))
+
+STATIONS = 30000
+PAGE_SIZE = 10000
+RETRY_AFTER = 1
+STATE = 'NY'
+BUCKET = 'check-nrel-stations'
+FOLDER = 'station-parquet-files'
+
+
+def make_stations(n, seed=0):
+    '''
+    n EV stations as returned by the NREL API, with a random pricing text so the
+    partition file is large enough to be uploaded in parts.
+
+    Returns: list of dicts
+    '''
+    rng = random.Random(seed)
+    return [{
+        'id': station_id,
+        'station_name': f'Station {station_id}',
+        'city': 'New York',
+        'state': STATE,
+        'fuel_type_code': 'ELEC',
+        'access_code': 'public',
+        'latitude': 40.5 + rng.random() * 0.4,
+        'longitude': -74.2 + rng.random() * 0.5,
+        'open_date': '2020-01-01',
+        'updated_at': '2024-01-01T00:00:00Z',
+        'ev_connector_types': ['J1772'],
+        'ev_pricing': base64.b64encode(rng.randbytes(300)).decode()
+    } for station_id in range(1, n + 1)]
+
+
+class FlakyNREL(BaseHTTPRequestHandler):
+    '''
+    NREL stations endpoint that fails the first request for each page once,
+    recording (offset, time, outcome) of every request in FlakyNREL.log.
+    '''
+    stations = []
+    log = []
+    failures = {0: 'drop', PAGE_SIZE: 'retry_after', 2 * PAGE_SIZE: 'unavailable'}
+    # Offset from which pages come back empty, as when the API cuts a listing short
+    cut_at = None
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        offset, limit = int(query['offset'][0]), int(query['limit'][0])
+        failure = self.failures.pop(offset, None)
+        self.log.append((offset, time.monotonic(), failure or 'ok'))
+        if failure == 'drop':
+            self.close_connection = True
+            return
+        if failure == 'retry_after':
+            self.send_response(429)
+            self.send_header('Retry-After', str(RETRY_AFTER))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if failure == 'unavailable':
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        stations = [] if self.cut_at is not None and offset >= self.cut_at else self.stations[offset:offset + limit]
+        body = json.dumps({'fuel_stations': stations,
+                           'total_results': len(self.stations)}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_checks():
+    '''
+    Run the ingestion against the stub and moto.
+
+    Returns: list of (check description, passed)
+    '''
+    import boto3
+    import pyarrow.parquet as pq
+    from boto3.s3.transfer import TransferConfig
+    from moto import mock_aws
+
+    FlakyNREL.stations = make_stations(STATIONS)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FlakyNREL)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    # nrel_ingest reads the endpoint when it is imported
+    os.environ['NREL_API_URL'] = f'http://127.0.0.1:{server.server_port}/api/alt-fuel-stations/v1.json'
+    for variable in ['AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SESSION_TOKEN']:
+        os.environ[variable] = 'testing'
+
+    import nrel_ingest
+    import nrel_sync
+    import station_dataset
+    station_dataset.TRANSFER_CONFIG = TransferConfig(multipart_threshold=5 * 1024 * 1024,
+                                                     multipart_chunksize=5 * 1024 * 1024)
+    calls = {'CreateMultipartUpload': 0, 'UploadPart': 0, 'PutObject': 0}
+
+    def count(event_name, **kwargs):
+        calls[event_name.rsplit('.', 1)[-1]] += 1
+
+    with mock_aws():
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket=BUCKET)
+        for operation in calls:
+            s3.meta.events.register(f'before-call.s3.{operation}', count)
+        session = nrel_ingest.make_session()
+        result = nrel_ingest.run_states(
+            lambda state: nrel_ingest.ingest_state(state, 'check', session, s3, BUCKET, FOLDER, PAGE_SIZE),
+            [STATE])[0]
+        with tempfile.TemporaryDirectory() as directory:
+            keys = station_dataset.list_state(s3, BUCKET, FOLDER, STATE)
+            rows, ids = 0, set()
+            for position, key in enumerate(keys):
+                path = os.path.join(directory, f'{position}.parquet')
+                s3.download_file(BUCKET, key, path)
+                table = pq.read_table(path, columns=['id'])
+                rows += len(table)
+                ids.update(table.column('id').to_pylist())
+
+        # Incremental sync: a cut-short run must not move the watermark past the
+        # change on the page it never received
+        offsets_logged, ingest_calls = len(FlakyNREL.log), dict(calls)
+        nrel_sync.sync_state(STATE, 'check', session, s3, BUCKET, FOLDER, PAGE_SIZE, last_updated='v1')
+        first, last = FlakyNREL.stations[0], FlakyNREL.stations[-1]
+        first['updated_at'], last['updated_at'] = '2024-03-01T00:00:00Z', '2024-02-01T00:00:00Z'
+        FlakyNREL.cut_at = PAGE_SIZE
+        cut_short = nrel_sync.sync_state(STATE, 'check', session, s3, BUCKET, FOLDER, PAGE_SIZE, last_updated='v2')
+        FlakyNREL.cut_at = None
+        complete = nrel_sync.sync_state(STATE, 'check', session, s3, BUCKET, FOLDER, PAGE_SIZE, last_updated='v2')
+        with tempfile.TemporaryDirectory() as directory:
+            synced = station_dataset.read_state(s3, BUCKET, FOLDER, STATE, directory)
+            stored = dict(zip(synced.column('id').to_pylist(), synced.column('updated_at').to_pylist()))
+        watermark = nrel_sync.read_watermark(s3, BUCKET, FOLDER, STATE)
+
+        # A state smaller than 1 / MAX_REMOVED_SHARE stations can still lose one
+        FlakyNREL.stations = make_stations(5)
+        small_folder = f'{FOLDER}-small'
+        nrel_sync.sync_state(STATE, 'check', session, s3, BUCKET, small_folder, PAGE_SIZE)
+        FlakyNREL.stations = FlakyNREL.stations[:-1]
+        small = nrel_sync.sync_state(STATE, 'check', session, s3, BUCKET, small_folder, PAGE_SIZE)
+    server.shutdown()
+
+    offsets = [offset for offset, _, _ in FlakyNREL.log[:offsets_logged]]
+    expected_offsets = [offset for offset in range(0, STATIONS, PAGE_SIZE) for _ in range(2)]
+    rate_limited = [moment for offset, moment, outcome in FlakyNREL.log[:offsets_logged] if offset == PAGE_SIZE]
+    return [
+        (f"ingestion succeeded ({result.get('error', result['status'])})", result['status'] == 'SUCCEEDED'),
+        (f"{STATIONS // PAGE_SIZE} pages written (got {result.get('pages')})", result.get('pages') == STATIONS // PAGE_SIZE),
+        (f"each page requested twice, in order (got offsets {offsets})", offsets == expected_offsets),
+        (f"retry after the 429 waited at least {RETRY_AFTER} s",
+         len(rate_limited) == 2 and rate_limited[1] - rate_limited[0] >= RETRY_AFTER),
+        (f"one ELEC partition uploaded (got {keys})", keys == [station_dataset.partition_key(FOLDER, STATE, 'ELEC')]),
+        (f"all {STATIONS} stations stored once (got {rows} rows, {len(ids)} ids)", rows == STATIONS and len(ids) == STATIONS),
+        (f"partition uploaded in parts (got {ingest_calls})",
+         ingest_calls['CreateMultipartUpload'] == 1 and ingest_calls['UploadPart'] >= 2 and ingest_calls['PutObject'] == 0),
+        (f"cut-short sync stored the first page's change and held the removals (got {cut_short})",
+         cut_short['updated'] == 1 and cut_short['removed'] == 0 and cut_short['held'] == STATIONS - PAGE_SIZE),
+        (f"next complete sync stored the last page's older change (got {complete})",
+         complete['updated'] == 1 and complete['removed'] == 0 and complete['held'] == 0
+         and nrel_sync._timestamp(last['updated_at']) == stored[last['id']]),
+        (f"watermark at the latest change once the listing completed (got {watermark})",
+         nrel_sync._timestamp(watermark['updated_at']) == nrel_sync._timestamp(first['updated_at'])
+         and watermark['last_updated'] == 'v2'),
+        (f"a 5-station state removed a missing station (got {small})", small['removed'] == 1 and small['held'] == 0),
+    ]
+
+
+if __name__ == '__main__':
+    checks = run_checks()
+    for description, passed in checks:
+        print(f"{'ok  ' if passed else 'FAIL'} {description}")
+    failed = [description for description, passed in checks if not passed]
+    print(f"{len(failed)} of {len(checks)} checks failed")
+    sys.exit(1 if failed else 0)
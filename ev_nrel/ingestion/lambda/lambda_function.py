@@ -2,31 +2,31 @@
 # Author: Eshan
 # Status: WIP
 
-import pandas as pd
 import json
-import requests
+import os
 import time
 import boto3
-import pyarrow.parquet as pq
 
+from nrel_ingest import ingest_states
+from nrel_sync import sync_states
 
-# Initialize the clients for S3 and DynamoDB
+
+# Initialize the client for S3 (S3_ENDPOINT_URL points it at a local S3 stand-in such as MinIO)
 from botocore.client import Config
-s3 = boto3.client('s3', region_name= "us-east-1",config=Config(signature_version='s3v4'))
-s3_resource = boto3.resource('s3')
+s3 = boto3.client('s3', region_name= "us-east-1", endpoint_url=os.environ.get('S3_ENDPOINT_URL'),
+                  config=Config(signature_version='s3v4'))
 
 # Define S3 bucket name for project
-bucket_name = 'final-project-nrel-stations'
+bucket_name = os.environ.get('NREL_BUCKET', 'final-project-nrel-stations')
 
 # define folder name inside s3 bucket
 folder_name = 'station-parquet-files'
 
-# Check if s3 bucket exists; if not, create 
-if 'Buckets' in s3.list_buckets():
-    for bucket in s3.list_buckets()['Buckets']:
-        if bucket['Name'] == 'final-project-nrel-stations':
-            print('S3 bucket exists')
-            break
+# Check if s3 bucket exists; if not, create
+def ensure_bucket():
+    existing = [bucket['Name'] for bucket in s3.list_buckets().get('Buckets', [])]
+    if bucket_name in existing:
+        print('S3 bucket exists')
     else:
         s3.create_bucket(Bucket=bucket_name)
 
@@ -36,45 +36,41 @@ def lambda_handler(event,context):
     # Define start time
     start_time = time.time()
 
-    # Extract relevant attributes from the event
+    # Extract relevant attributes from the event; either a single 'state' or a list of 'states'.
+    # mode 'incremental' upserts only new/changed stations into the partitioned dataset
     api_key = event['api_key']
-    state=event['state']
+    states = event.get('states') or [event['state']]
+    max_workers = int(event.get('max_workers', 4))
+    mode = event.get('mode', 'full')
+
+    ensure_bucket()
 
-    url = f"https://developer.nrel.gov/api/alt-fuel-stations/v1.json?api_key={api_key}&state={state}"
-    response = requests.get(url)
-    data = response.json()
-    
-    # Count the number of fuel stations returned
-    print(f"Number of fuel stations in {state}: {data['total_results']}")
-    
-    # Extract the list of fuel stations
-    stations = data['fuel_stations']
-    stations_df = pd.DataFrame(stations)
+    # Fetch, stream to parquet and upload each state, several states at a time
+    if mode == 'incremental':
+        results = sync_states(states, api_key, s3, bucket_name, folder_name, max_workers=max_workers)
+    else:
+        results = ingest_states(states, api_key, s3, bucket_name, folder_name, max_workers=max_workers)
+    failed = [result['state'] for result in results if result['status'] == 'FAILED']
 
-    # Upload stations dataframe to S3 bucket as parquet with state initials
-    try:
-        stations_df.to_parquet(f"/tmp/{state}_stations.parquet")
-        s3.upload_file(f"/tmp/{state}_stations.parquet", bucket_name, f"{folder_name}/{state}_stations.parquet")
-        print(f'parquet file uploaded for state {state} to S3')
-        
-        # Define end time
-        end_time = time.time()
-        
-        # Construct a success response
+    # Define end time
+    end_time = time.time()
+
+    if failed:
         return {
-            "statusCode": 200,
+            "statusCode": 500,
             "body": json.dumps({
-                "message": f"Success! Parquet file uploaded for state {state} to S3",
+                "message": f"Failed to upload parquet files to S3 for {', '.join(failed)}",
+                "results": results,
                 "processingTime": f"{end_time - start_time:.2f} seconds"
             })
         }
-    except Exception as e:
-        print(e)
-        print('Error uploading file to S3')
-        return {
-            "statusCode": 500,
-            "body": json.dumps({
-                "message": "Failed to upload parquet file to S3",
-                "error": str(e)
-            })
-        }
\ No newline at end of file
+
+    # Construct a success response
+    return {
+        "statusCode": 200,
+        "body": json.dumps({
+            "message": f"Success! Parquet files uploaded for {', '.join(states)} to S3",
+            "results": results,
+            "processingTime": f"{end_time - start_time:.2f} seconds"
+        })
+    }
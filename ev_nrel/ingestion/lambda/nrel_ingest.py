@@ -0,0 +1,210 @@
+# Ingestion engine for NREL alternative fuel stations
+# Pages through the NREL API with a pooled, retrying HTTP session, normalizes each page
+# to the canonical station schema, streams it into the state's fuel type partitions as
+# a row group and uploads the files to S3 in parts, so memory use stays flat regardless
+# of how many stations a state has.
+
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from station_dataset import PartitionedWriter, upload_state
+from station_schema import normalize_stations
+
+# NREL endpoint (overridable so the engine can run against a local stub)
+NREL_API_URL = os.environ.get('NREL_API_URL', 'https://developer.nrel.gov/api/alt-fuel-stations/v1.json')
+
+# Stations requested per API call
+PAGE_SIZE = int(os.environ.get('NREL_PAGE_SIZE', 1000))
+
+# HTTP statuses worth retrying
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def make_session(pool_size=10):
+    '''
+    Create an HTTP session whose connection pool is shared by all requests
+    (and threads) of an invocation.
+
+    Inputs:
+      pool_size (int): maximum number of pooled connections
+
+    Returns: requests.Session
+    '''
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_with_retry(session, url, params, retries=5, backoff=0.5, timeout=60):
+    '''
+    GET a JSON document, retrying connection errors, timeouts, 429s and 5xx
+    responses with exponential backoff and full jitter. A Retry-After header
+    from the server takes precedence over the computed delay.
+
+    Returns: parsed JSON response
+    '''
+    for attempt in range(retries + 1):
+        retry_after = None
+        try:
+            response = session.get(url, params=params, timeout=timeout)
+            if response.status_code not in RETRY_STATUSES:
+                response.raise_for_status()
+                return response.json()
+            retry_after = response.headers.get('Retry-After')
+            error = requests.HTTPError(f"{response.status_code} from {url}", response=response)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = e
+        if attempt == retries:
+            raise error
+        delay = random.uniform(0, backoff * 2 ** attempt)
+        if retry_after is not None and retry_after.isdigit():
+            delay = float(retry_after)
+        time.sleep(delay)
+
+
+class Pages:
+    '''
+    Iterable over pages of stations for a state, using limit/offset paging.
+    Paging stops at an empty page or once total_results stations were
+    received, so after iterating, complete tells a full listing from one
+    cut short by the API.
+
+    Attributes:
+      total_results (int): stations the API reported for the state (None
+        before the first page)
+      rows (int): stations received
+    '''
+
+    def __init__(self, session, api_key, state, page_size, url, params):
+        self.session = session
+        self.query = dict(params or {}, api_key=api_key, state=state, limit=page_size)
+        self.url = url
+        self.total_results = None
+        self.rows = 0
+
+    def __iter__(self):
+        while True:
+            data = get_with_retry(self.session, self.url, dict(self.query, offset=self.rows))
+            self.total_results = data.get('total_results', 0)
+            stations = data.get('fuel_stations', [])
+            if not stations:
+                return
+            yield stations
+            self.rows += len(stations)
+            if self.rows >= self.total_results:
+                return
+
+    @property
+    def complete(self):
+        '''
+        Returns: True once every station the API reported was received
+        '''
+        return self.total_results is not None and self.rows >= self.total_results
+
+
+def fetch_pages(session, api_key, state, page_size=PAGE_SIZE, url=NREL_API_URL, params=None):
+    '''
+    Pages of stations for a state.
+
+    Inputs:
+      session (requests.Session): pooled session from make_session()
+      api_key (string): NREL API key
+      state (string): two-letter state code
+      page_size (int): stations per request
+      params (dict): extra query parameters passed to the API
+
+    Returns: Pages, yielding a list of station dicts per page
+    '''
+    return Pages(session, api_key, state, page_size, url, params)
+
+
+def write_pages(pages, directory):
+    '''
+    Stream pages of stations into one Parquet file per fuel type under
+    directory, one row group per page. Every page is normalized to the
+    canonical station schema, so all files share the same types.
+
+    Returns: (dict of fuel_type_code -> file path, rows written, pages written)
+    '''
+    writer = PartitionedWriter(directory)
+    count = 0
+    try:
+        for stations in pages:
+            writer.write(normalize_stations(stations))
+            count += 1
+    finally:
+        paths = writer.close()
+    return paths, writer.rows, count
+
+
+def ingest_state(state, api_key, session, s3, bucket_name, folder_name, page_size=PAGE_SIZE):
+    '''
+    Fetch all stations for one state and upload them to the partitioned
+    dataset, s3://bucket_name/folder_name/stations/state={state}/fuel_type_code={FT}/.
+    The upload replaces the state's partitions, so a listing the API cut
+    short fails the state and leaves its partitions as they were.
+
+    Returns: dict with the state, row/page counts and processing time
+    '''
+    start_time = time.time()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        listing = fetch_pages(session, api_key, state, page_size)
+        paths, rows, pages = write_pages(listing, tmp_dir)
+        if not listing.complete:
+            raise RuntimeError(f"API returned {rows} of {listing.total_results} stations for {state}")
+        if rows == 0:
+            print(f"No fuel stations returned for {state}")
+        else:
+            upload_state(s3, bucket_name, folder_name, state, paths)
+            print(f"Number of fuel stations in {state}: {rows}; {len(paths)} parquet partitions uploaded to S3")
+    return {
+        'state': state,
+        'status': 'SUCCEEDED',
+        'rows': rows,
+        'pages': pages,
+        'partitions': sorted(paths),
+        'processingTime': f"{time.time() - start_time:.2f} seconds"
+    }
+
+
+def run_states(task, states, max_workers=4):
+    '''
+    Run task(state) for several states concurrently. A failing state is
+    reported in the results instead of aborting the others.
+
+    Returns: list of per-state result dicts, in the order of states
+    '''
+    def run(state):
+        try:
+            return task(state)
+        except Exception as e:
+            print(f"Failed to process {state}: {e}")
+            return {'state': state, 'status': 'FAILED', 'error': str(e)}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(run, states))
+
+
+def ingest_states(states, api_key, s3, bucket_name, folder_name, max_workers=4, page_size=PAGE_SIZE, session=None):
+    '''
+    Ingest several states concurrently, sharing one HTTP connection pool.
+
+    Inputs:
+      states (list of strings): two-letter state codes
+      max_workers (int): number of states fetched at the same time
+
+    Returns: list of per-state result dicts, in the order of states
+    '''
+    session = session or make_session(pool_size=max_workers)
+    return run_states(
+        lambda state: ingest_state(state, api_key, session, s3, bucket_name, folder_name, page_size),
+        states, max_workers
+    )
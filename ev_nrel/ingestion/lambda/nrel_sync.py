@@ -0,0 +1,203 @@
+# Incremental (delta) sync of NREL stations into the partitioned Parquet dataset on S3
+#
+# Layout under the folder:
+#   stations/state={ST}/fuel_type_code={FT}/stations.parquet   see station_dataset.py
+#   _watermarks/{ST}.json                                      per-state sync watermark
+#
+# The stations API has no server-side "changed since" filter, so a sync works in two steps:
+#   1. Ask the last-updated endpoint when the NREL dataset last changed. If that matches
+#      the state's watermark nothing is fetched or uploaded.
+#   2. Otherwise page through the state, keeping only stations that are new or whose
+#      updated_at is past the watermark, and upsert them by id into the state partition.
+#      Stations no longer returned by the API are removed, but only when the run received
+#      every station the API reported (total_results) and the removals are at most
+#      MAX_REMOVED_SHARE of the state (or MIN_REMOVED stations, for small states);
+#      otherwise they are held back, reported, and the dataset timestamp is left unset so
+#      the next run lists the state again. The state's partitions are rewritten only when
+#      something changed. The updated_at watermark only moves after a complete listing, so
+#      stations on pages a cut-short run never received are still picked up as changed.
+#
+# Every run that is not skipped still pages through the whole state and downloads its
+# partitions; fetching only the stations changed since the watermark is out of scope.
+
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.compute as pc
+from botocore.exceptions import ClientError
+
+from nrel_ingest import NREL_API_URL, PAGE_SIZE, fetch_pages, get_with_retry, make_session, run_states
+from station_dataset import PartitionedWriter, read_state, upload_state
+from station_schema import normalize_stations
+
+# Endpoint reporting when the station dataset was last updated
+LAST_UPDATED_URL = os.environ.get('NREL_LAST_UPDATED_URL', NREL_API_URL.replace('.json', '/last-updated.json'))
+
+# Largest share of a state's stations one run may remove
+MAX_REMOVED_SHARE = float(os.environ.get('NREL_MAX_REMOVED_SHARE', 0.1))
+# Removals allowed in one run however small the state
+MIN_REMOVED = int(os.environ.get('NREL_MIN_REMOVED', 1))
+
+
+def watermark_key(folder_name, state):
+    return f"{folder_name}/_watermarks/{state}.json"
+
+
+def _get_object(s3, bucket_name, key):
+    try:
+        return s3.get_object(Bucket=bucket_name, Key=key)['Body'].read()
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise
+
+
+def read_watermark(s3, bucket_name, folder_name, state):
+    '''
+    Returns: dict with 'updated_at' (latest station updated_at seen),
+    'last_updated' (dataset timestamp at the last sync) and 'rows', or an
+    empty dict for a state that was never synced
+    '''
+    body = _get_object(s3, bucket_name, watermark_key(folder_name, state))
+    return json.loads(body) if body else {}
+
+
+def write_watermark(s3, bucket_name, folder_name, state, watermark):
+    s3.put_object(Bucket=bucket_name, Key=watermark_key(folder_name, state), Body=json.dumps(watermark).encode())
+
+
+def _timestamp(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00')) if value else None
+
+
+def dataset_last_updated(session, api_key):
+    return get_with_retry(session, LAST_UPDATED_URL, {'api_key': api_key}).get('last_updated')
+
+
+def upsert(existing, changes):
+    '''
+    Replace the rows of existing whose id appears in changes and append the
+    rest of changes. Both tables conform to the canonical station schema.
+
+    Inputs:
+      existing (pyarrow table or None)
+      changes (pyarrow table with the same schema)
+
+    Returns: pyarrow table
+    '''
+    if existing is None:
+        return changes
+    keep = pc.invert(pc.is_in(existing.column('id'), value_set=changes.column('id')))
+    return pa.concat_tables([existing.filter(keep), changes]).unify_dictionaries()
+
+
+def sync_state(state, api_key, session, s3, bucket_name, folder_name, page_size=PAGE_SIZE, last_updated=None):
+    '''
+    Bring one state's partition up to date with the API.
+
+    Returns: dict with the number of stations added, updated, unchanged,
+    removed and held back from removal, whether the state was skipped, and
+    the processing time
+    '''
+    start_time = time.time()
+    watermark = read_watermark(s3, bucket_name, folder_name, state)
+    if last_updated is not None and watermark.get('last_updated') == last_updated:
+        print(f"{state} unchanged since {last_updated}, skipping")
+        return {'state': state, 'status': 'SUCCEEDED', 'skipped': True, 'added': 0, 'updated': 0,
+                'unchanged': watermark.get('rows', 0), 'removed': 0, 'held': 0,
+                'processingTime': f"{time.time() - start_time:.2f} seconds"}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        existing = read_state(s3, bucket_name, folder_name, state, tmp_dir)
+        if existing is not None:
+            known = dict(zip(existing.column('id').to_pylist(), existing.column('updated_at').to_pylist()))
+        else:
+            known = {}
+        since = _timestamp(watermark.get('updated_at'))
+
+        # Stream the pages, holding on only to new and changed stations
+        changed, seen = [], set()
+        added = updated = 0
+        latest = since
+        listing = fetch_pages(session, api_key, state, page_size)
+        for stations in listing:
+            page = normalize_stations(stations)
+            keep = []
+            for station_id, updated_at in zip(page.column('id').to_pylist(), page.column('updated_at').to_pylist()):
+                seen.add(station_id)
+                if updated_at is not None:
+                    latest = max(latest, updated_at) if latest is not None else updated_at
+                if station_id not in known:
+                    added += 1
+                    keep.append(True)
+                elif updated_at is not None and (since is None or updated_at > since) and updated_at != known[station_id]:
+                    updated += 1
+                    keep.append(True)
+                else:
+                    keep.append(False)
+            if any(keep):
+                changed.append(page.filter(pa.array(keep)))
+        removed = [station_id for station_id in known if station_id not in seen]
+
+        # A short listing or a large drop is more likely an API problem than real closures
+        held = []
+        if removed and not listing.complete:
+            print(f"{state}: API returned {listing.rows} of {listing.total_results} stations, "
+                  f"holding back {len(removed)} removals")
+            held, removed = removed, []
+        elif len(removed) > max(MIN_REMOVED, MAX_REMOVED_SHARE * len(known)):
+            print(f"{state}: {len(removed)} of {len(known)} stations missing, more than "
+                  f"{MAX_REMOVED_SHARE:.0%}; holding back the removals")
+            held, removed = removed, []
+
+        if changed or removed:
+            table = existing
+            if changed:
+                table = upsert(existing, pa.concat_tables(changed).unify_dictionaries())
+            if removed:
+                table = table.filter(pc.invert(pc.is_in(table.column('id'), value_set=pa.array(removed, pa.int64()))))
+            writer = PartitionedWriter(tmp_dir)
+            writer.write(table)
+            upload_state(s3, bucket_name, folder_name, state, writer.close())
+            rows = len(table)
+        else:
+            rows = len(known)
+
+    # A cut-short listing keeps the previous watermark: the stations it did not receive may
+    # have changed before the latest updated_at it saw
+    if not listing.complete:
+        latest = since
+    write_watermark(s3, bucket_name, folder_name, state,
+                    {'updated_at': latest.isoformat() if latest is not None else None,
+                     'last_updated': None if held or not listing.complete else last_updated, 'rows': rows})
+    print(f"{state}: {added} added, {updated} updated, {len(removed)} removed")
+    return {
+        'state': state,
+        'status': 'SUCCEEDED',
+        'skipped': False,
+        'added': added,
+        'updated': updated,
+        'unchanged': len(known) - updated - len(removed),
+        'removed': len(removed),
+        'held': len(held),
+        'processingTime': f"{time.time() - start_time:.2f} seconds"
+    }
+
+
+def sync_states(states, api_key, s3, bucket_name, folder_name, max_workers=4, page_size=PAGE_SIZE, session=None):
+    '''
+    Incrementally sync several states concurrently. The dataset's
+    last-updated timestamp is fetched once and shared by all states.
+
+    Returns: list of per-state result dicts, in the order of states
+    '''
+    session = session or make_session(pool_size=max_workers)
+    last_updated = dataset_last_updated(session, api_key)
+    return run_states(
+        lambda state: sync_state(state, api_key, session, s3, bucket_name, folder_name, page_size, last_updated),
+        states, max_workers
+    )
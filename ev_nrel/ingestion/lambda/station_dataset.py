@@ -0,0 +1,137 @@
+# Hive-partitioned station dataset on S3
+#
+# Layout under the folder:
+#   stations/state={ST}/fuel_type_code={FT}/stations.parquet
+#
+# Files follow station_schema.FILE_SCHEMA; the partition columns are encoded in the
+# path, so pyarrow.dataset (and Athena/Spark/DuckDB) can skip whole states and fuel
+# types. Each write_table call becomes its own row group, and Parquet column
+# statistics (min/max of id, latitude, longitude, updated_at, ...) are written per
+# row group so readers can also skip row groups inside a file.
+
+import os
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from boto3.s3.transfer import TransferConfig
+
+from station_schema import FILE_SCHEMA, STATION_SCHEMA, conform
+
+# Multipart upload settings; files above the threshold are uploaded in parallel parts
+TRANSFER_CONFIG = TransferConfig(multipart_threshold=8 * 1024 * 1024,
+                                 multipart_chunksize=8 * 1024 * 1024,
+                                 max_concurrency=4)
+
+
+def state_prefix(folder_name, state):
+    return f"{folder_name}/stations/state={state}/"
+
+
+def partition_key(folder_name, state, fuel_type_code):
+    return f"{state_prefix(folder_name, state)}fuel_type_code={fuel_type_code}/stations.parquet"
+
+
+class PartitionedWriter:
+    '''
+    Stream station tables for one state into one local Parquet file per fuel
+    type. Only one row group per fuel type and page is held in memory.
+
+    Inputs:
+      directory (string): local directory for the partition files
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.writers = {}
+        self.paths = {}
+        self.rows = 0
+
+    def write(self, table):
+        '''
+        Append a table conforming to STATION_SCHEMA, split by fuel type.
+        '''
+        fuel_types = table.column('fuel_type_code').combine_chunks()
+        for fuel_type_code in pc.unique(fuel_types.dictionary_decode()).to_pylist():
+            if fuel_type_code is None:
+                mask = pc.is_null(fuel_types)
+                fuel_type_code = '__HIVE_DEFAULT_PARTITION__'
+            else:
+                mask = pc.equal(fuel_types.dictionary_decode(), fuel_type_code)
+            part = table.filter(mask).select(FILE_SCHEMA.names)
+            if fuel_type_code not in self.writers:
+                path = os.path.join(self.directory, f"{fuel_type_code}.parquet")
+                self.paths[fuel_type_code] = path
+                self.writers[fuel_type_code] = pq.ParquetWriter(path, FILE_SCHEMA, write_statistics=True)
+            self.writers[fuel_type_code].write_table(part)
+        self.rows += len(table)
+
+    def close(self):
+        '''
+        Returns: dict of fuel_type_code -> local file path
+        '''
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+        return self.paths
+
+
+def upload_state(s3, bucket_name, folder_name, state, paths):
+    '''
+    Upload a state's partition files and delete partitions of fuel types the
+    state no longer has.
+
+    Inputs:
+      paths (dict): fuel_type_code -> local file path, from PartitionedWriter.close()
+
+    Returns: list of uploaded keys
+    '''
+    keys = []
+    for fuel_type_code, path in paths.items():
+        key = partition_key(folder_name, state, fuel_type_code)
+        s3.upload_file(path, bucket_name, key, Config=TRANSFER_CONFIG)
+        keys.append(key)
+    stale = [key for key in list_state(s3, bucket_name, folder_name, state) if key not in keys]
+    if stale:
+        s3.delete_objects(Bucket=bucket_name, Delete={'Objects': [{'Key': key} for key in stale]})
+    return keys
+
+
+def list_state(s3, bucket_name, folder_name, state):
+    '''
+    Returns: list of the partition file keys of a state
+    '''
+    keys = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=state_prefix(folder_name, state)):
+        keys.extend(item['Key'] for item in page.get('Contents', []) if item['Key'].endswith('.parquet'))
+    return keys
+
+
+def read_state(s3, bucket_name, folder_name, state, directory):
+    '''
+    Download and read all partitions of a state, restoring the partition
+    columns from the keys.
+
+    Inputs:
+      directory (string): local directory the files are downloaded to
+
+    Returns: pyarrow table conforming to STATION_SCHEMA, or None if the state
+    has no partitions yet
+    '''
+    tables = []
+    for i, key in enumerate(list_state(s3, bucket_name, folder_name, state)):
+        path = os.path.join(directory, f"existing_{i}.parquet")
+        s3.download_file(bucket_name, key, path)
+        table = pq.read_table(path)
+        # Partition values come from the key; files from the older one-file-per-state
+        # layout still carry the columns themselves
+        partition = dict(part.split('=', 1) for part in key.split('/') if '=' in part)
+        for name, value in partition.items():
+            if name not in table.column_names:
+                value = None if value == '__HIVE_DEFAULT_PARTITION__' else value
+                table = table.append_column(name, pa.array([value] * len(table), pa.string()))
+        tables.append(conform(table, STATION_SCHEMA))
+    if not tables:
+        return None
+    return pa.concat_tables(tables).unify_dictionaries()
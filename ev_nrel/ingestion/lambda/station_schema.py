@@ -0,0 +1,137 @@
+# Canonical Arrow schema for NREL alternative fuel stations
+# Every page, state and sync run is normalized to STATION_SCHEMA, so the types of a
+# column never depend on which stations happened to be on the first page.
+#   - enums (state, fuel_type_code, access_code, ...) are dictionary encoded
+#   - counts are int32, dates are date32 and updated_at is a UTC timestamp
+#   - ev_connector_types is flattened into one boolean column per connector type
+#     plus ev_connector_count; the raw list is kept as a comma-separated string
+#   - fields the schema does not know about are kept as JSON in 'extra'
+
+import json
+
+import pyarrow as pa
+
+# Hive partition columns of the station dataset, outermost first
+PARTITION_FIELDS = ['state', 'fuel_type_code']
+
+# Connector types listed by the NREL API, flattened into ev_connector_{type} columns
+CONNECTOR_TYPES = ['NEMA1450', 'NEMA515', 'NEMA520', 'J1772', 'J1772COMBO', 'CHADEMO', 'TESLA', 'J3400']
+
+ENUM = pa.dictionary(pa.int32(), pa.string())
+
+STATION_FIELDS = [
+    ('id', pa.int64()),
+    ('station_name', pa.string()),
+    ('street_address', pa.string()),
+    ('intersection_directions', pa.string()),
+    ('city', pa.string()),
+    ('state', ENUM),
+    ('zip', pa.string()),
+    ('plus4', pa.string()),
+    ('country', ENUM),
+    ('station_phone', pa.string()),
+    ('status_code', ENUM),
+    ('expected_date', pa.date32()),
+    ('groups_with_access_code', pa.string()),
+    ('access_code', ENUM),
+    ('access_detail_code', ENUM),
+    ('access_days_time', pa.string()),
+    ('cards_accepted', pa.string()),
+    ('owner_type_code', ENUM),
+    ('facility_type', ENUM),
+    ('fuel_type_code', ENUM),
+    ('ev_level1_evse_num', pa.int32()),
+    ('ev_level2_evse_num', pa.int32()),
+    ('ev_dc_fast_num', pa.int32()),
+    ('ev_other_evse', pa.string()),
+    ('ev_network', ENUM),
+    ('ev_network_web', pa.string()),
+    ('ev_pricing', pa.string()),
+    ('ev_connector_types', pa.string()),
+    ('latitude', pa.float64()),
+    ('longitude', pa.float64()),
+    ('geocode_status', ENUM),
+    ('open_date', pa.date32()),
+    ('date_last_confirmed', pa.date32()),
+    ('updated_at', pa.timestamp('s', tz='UTC')),
+    ('maximum_vehicle_class', ENUM),
+]
+
+CONNECTOR_FIELDS = ([(f"ev_connector_{connector.lower()}", pa.bool_()) for connector in CONNECTOR_TYPES]
+                    + [('ev_connector_count', pa.int8())])
+
+STATION_SCHEMA = pa.schema(STATION_FIELDS + CONNECTOR_FIELDS + [('extra', pa.string())])
+
+# Schema of the files inside a partition; the partition columns live in the path
+FILE_SCHEMA = pa.schema([field for field in STATION_SCHEMA if field.name not in PARTITION_FIELDS])
+
+_KNOWN = {name for name, _ in STATION_FIELDS}
+
+
+def _text(value):
+    if value is None or value == '' or value != value:
+        return None
+    return json.dumps(value) if isinstance(value, (list, dict)) else str(value)
+
+
+def _column(values, arrow_type):
+    '''
+    Convert the raw API values of one field to its Arrow type. Values are
+    passed through as strings and cast, so numbers and dates sent as strings
+    convert the same way as native ones.
+    '''
+    if pa.types.is_dictionary(arrow_type):
+        return pa.array([_text(value) for value in values], pa.string()).dictionary_encode()
+    if pa.types.is_floating(arrow_type):
+        return pa.array([None if _text(value) is None else float(value) for value in values], arrow_type)
+    return pa.array([_text(value) for value in values], pa.string()).cast(arrow_type)
+
+
+def _connectors(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [connector.strip() for connector in value.split(',') if connector.strip()]
+    return list(value)
+
+
+def normalize_stations(stations):
+    '''
+    Build a table conforming to STATION_SCHEMA from station dicts as returned
+    by the NREL API.
+
+    Inputs:
+      stations (list of dicts): one page of stations
+
+    Returns: pyarrow table
+    '''
+    columns = {name: _column([station.get(name) for station in stations], arrow_type)
+               for name, arrow_type in STATION_FIELDS if name != 'ev_connector_types'}
+
+    connectors = [_connectors(station.get('ev_connector_types')) for station in stations]
+    columns['ev_connector_types'] = pa.array([','.join(types) if types else None for types in connectors], pa.string())
+    for connector in CONNECTOR_TYPES:
+        columns[f"ev_connector_{connector.lower()}"] = pa.array([connector in types for types in connectors])
+    columns['ev_connector_count'] = pa.array([len(types) for types in connectors], pa.int8())
+
+    extras = [{key: value for key, value in station.items() if key not in _KNOWN} for station in stations]
+    columns['extra'] = pa.array([json.dumps(extra, sort_keys=True) if extra else None for extra in extras], pa.string())
+
+    return pa.Table.from_pydict({field.name: columns[field.name] for field in STATION_SCHEMA}, schema=STATION_SCHEMA)
+
+
+def conform(table, schema=STATION_SCHEMA):
+    '''
+    Cast a table read back from storage to schema, adding missing columns as
+    nulls, so files written by older versions still line up.
+
+    Returns: pyarrow table
+    '''
+    columns = []
+    for field in schema:
+        if field.name in table.column_names:
+            column = table.column(field.name)
+            columns.append(column if column.type == field.type else column.cast(field.type))
+        else:
+            columns.append(pa.nulls(len(table), field.type))
+    return pa.Table.from_arrays(columns, schema=schema)
@@ -0,0 +1,79 @@
+# Build the deployment packages of the NREL ingestion Lambda
+#
+#   - lambda/lambda_function.py.zip: the handler and the modules it imports
+#     (MODULES), with fixed timestamps so an unchanged source gives the same zip
+#   - with --layer, a Lambda layer zip of the third-party packages the modules need
+#     besides the runtime's boto3 (LAYER_PACKAGES), installed from manylinux wheels for
+#     the Lambda platform; attach it to the function next to the code zip
+#
+# Usage:
+#   python ev_nrel/ingestion/package_lambda.py [--layer nrel_layer.zip] [--python 3.11]
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import zipfile
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lambda')
+MODULES = ['lambda_function.py', 'nrel_ingest.py', 'nrel_sync.py', 'station_dataset.py', 'station_schema.py']
+LAYER_PACKAGES = ['pyarrow>=14.0', 'requests']
+PLATFORM = 'manylinux2014_x86_64'
+TIMESTAMP = (2024, 1, 1, 0, 0, 0)
+
+
+def write_zip(path, files):
+    '''
+    Write a zip with fixed timestamps and permissions.
+
+    Inputs:
+      path (string): zip to write
+      files (list of tuples): (path on disk, name in the zip), in zip order
+    '''
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for source, name in files:
+            info = zipfile.ZipInfo(name, date_time=TIMESTAMP)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            with open(source, 'rb') as file:
+                archive.writestr(info, file.read())
+
+
+def build_function(path=os.path.join(LAMBDA_DIR, 'lambda_function.py.zip')):
+    '''
+    Returns: path of the function zip
+    '''
+    write_zip(path, [(os.path.join(LAMBDA_DIR, module), module) for module in MODULES])
+    return path
+
+
+def build_layer(path, python_version):
+    '''
+    Install LAYER_PACKAGES for the Lambda platform under python/ and zip them.
+
+    Returns: path of the layer zip
+    '''
+    with tempfile.TemporaryDirectory() as directory:
+        target = os.path.join(directory, 'python')
+        subprocess.run([sys.executable, '-m', 'pip', 'install', '--quiet', '--target', target,
+                        '--platform', PLATFORM, '--implementation', 'cp', '--python-version', python_version,
+                        '--only-binary=:all:'] + LAYER_PACKAGES, check=True)
+        files = []
+        for root, directories, names in os.walk(target):
+            directories[:] = sorted(name for name in directories if name != '__pycache__')
+            for name in sorted(names):
+                source = os.path.join(root, name)
+                files.append((source, os.path.relpath(source, directory)))
+        write_zip(path, files)
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the NREL ingestion Lambda packages')
+    parser.add_argument('--layer', help='also build a layer zip of LAYER_PACKAGES at this path')
+    parser.add_argument('--python', default='3.11', help='Lambda runtime version of the layer')
+    args = parser.parse_args()
+    print(f'Wrote {build_function()}')
+    if args.layer:
+        print(f'Wrote {build_layer(args.layer, args.python)}')
@@ -0,0 +1,28 @@
+# Gunicorn settings for the dashboards:
+#   gunicorn nyc_app:server
+#   gunicorn app:server
+import gc
+import multiprocessing
+import os
+import tempfile
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8050')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+
+# Import the app (and load all of its data) once in the master process; forked workers
+# then share those pages copy-on-write instead of each holding a private copy
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+# One metrics directory for the master, the workers and their background jobs, so any
+# worker's /metrics reports all of them (see elec_transit_y/metrics.py)
+if os.environ.get('METRICS', '1') == '1':
+    os.environ.setdefault('METRICS_DIR', tempfile.mkdtemp(prefix='elec_transit_y_metrics-'))
+
+
+def pre_fork(server, worker):
+    # Move everything the master has loaded into the permanent generation, so the
+    # garbage collector in each worker doesn't write to (and so copy) the shared pages
+    if preload_app:
+        gc.collect()
+        gc.freeze()
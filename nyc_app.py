@@ -1,212 +1,268 @@
 import dash
 from dash import dcc, html, Input, Output, State
-import pandas as pd
 import folium
-from folium.plugins import MarkerCluster
+import hashlib
+import json
 import os
-import geopandas as gpd
-from shapely.geometry import Polygon
+import pandas as pd
+import threading
+from types import SimpleNamespace
+from elec_transit_y.areal import areal_weights
+from elec_transit_y.background import background_manager, slow_callback
+from elec_transit_y.cache import LRUCache, data_hash
+from elec_transit_y.demand_cube import METRICS, DemandCube, load_or_build, zone_totals
+from elec_transit_y.geometry import prepared_tiers, register_geometry_routes
+from elec_transit_y.map_layers import RestylableChoropleth, VectorTileLayer, choropleth_frame
+from elec_transit_y.metrics import register_metrics_routes, stage, watch_cache
+from elec_transit_y.regions import (DEFAULT_REGION, REGION_CACHE_SIZE, REGIONS, RegionLayers, RegionLoader,
+                                    RegionTileSource)
+from elec_transit_y.siting import GRID_SPACING_M, SERVICE_RADIUS_M, nyc_siting_model, unproject
+from elec_transit_y.station_layer import POPUP_FIELDS, station_layer
+from elec_transit_y.tiles import TileSource, region_layers, register_tile_routes
 
 # Set base directory
 base_dir = os.path.dirname(os.path.abspath(__file__))
 
-# Load the data
-data_path = os.path.join(base_dir, 'data', 'ev_stations_v1.csv')
-ev_data = pd.read_csv(data_path, low_memory=False)
-
-# Load NYC Taxi data for pickups and drop-offs
-data_do = pd.read_csv(os.path.join(base_dir, 'data', 'nyc_taxi_rides_2019_aggByDOandHour.csv'))
-data_pu = pd.read_csv(os.path.join(base_dir, 'data', 'nyc_taxi_rides_2019_aggByPUandHour.csv'))
-
-# Load taxi zone shapefile
-taxi_zone_shapefile_path = os.path.join(base_dir, 'data', 'zone_shape_files', 'taxi_zones.shp')
-taxi_zones_gdf = gpd.read_file(taxi_zone_shapefile_path)
-
-# Ensure the taxi zone GeoDataFrame has a consistent CRS
-taxi_zones_gdf = taxi_zones_gdf.to_crs("EPSG:4326")
-
-# Filter for New York City only
-nyc_cities = ['New York', 'Brooklyn', 'Queens', 'Bronx', 'Staten Island']
-ev_data_nyc = ev_data[ev_data['city'].isin(nyc_cities)]
-
-# Load the census tract shapefile
-shapefile_path = os.path.join(base_dir, 'data', 'nyct2020_24b', 'nyct2020.shp')
-gdf = gpd.read_file(shapefile_path)
+# Send the taxi zone map to the browser once and only push per-hour counts on each tick
+# (set CLIENTSIDE_RESTYLE=0 to swap pre-rendered full maps instead)
+clientside_restyle = os.environ.get('CLIENTSIDE_RESTYLE', '1') == '1'
 
-# Clean up the GeoDataFrame (remove gibberish rows manually inspected in the CSV)
-gdf = gdf[gdf['BoroName'].isin(['Manhattan', 'Brooklyn', 'Queens', 'Bronx', 'Staten Island'])]
+# Draw stations and census tracts from the /tiles vector tile endpoint instead of
+# embedding every feature in the page (set VECTOR_TILES=1)
+vector_tiles = os.environ.get('VECTOR_TILES', '0') == '1'
 
-# Ensure CTLabel and BoroCode are strings
-gdf['CTLabel'] = gdf['CTLabel'].astype(str)
-gdf['BoroCode'] = gdf['BoroCode'].astype(str)
-
-# Format CTLabel to have two decimal places
-gdf['CTLabel'] = gdf['CTLabel'].apply(lambda x: f"{float(x):.2f}")
-
-# Create a "Key" column in gdf
-gdf['Key'] = gdf['CTLabel'] + '-' + gdf['BoroCode']
-
-# Change the area to km^2 instead of m^2
-gdf['Shape_Area'] = gdf['Shape_Area'] / 10**6
-
-# Read the NYC population csv
-pop_df = pd.read_csv(os.path.join(base_dir, 'data', 'nyc_census_tract_population.csv'))
-
-# Split the NAME column to 3 columns based on the comma separator
-pop_df[['CTLabel', 'County', 'StateName']] = pop_df['NAME'].str.split(',', expand=True)
-pop_df['County'] = pop_df['County'].str.strip()
-
-# Create the county to borough mapping dictionary
-county_borough_mapping = {
-    "New York County": "Manhattan",
-    "Kings County": "Brooklyn",
-    "Bronx County": "Bronx",
-    "Richmond County": "Staten Island",
-    "Queens County": "Queens"
-}
+# Every region in elec_transit_y/regions.py can be picked on the dashboard. A region's data
+# (from the prebuilt bundle for NYC, see elec_transit_y/bundle.py) is loaded and prepared
+# the first time it is picked, and at most REGION_CACHE_SIZE regions besides the default
+# one stay in memory
 
-# Map the County to Borough
-pop_df['Borough'] = pop_df['County'].map(county_borough_mapping)
-
-# Check if 'Borough' column is created successfully
-if 'Borough' in pop_df.columns:
-    # BoroCode mapping
-    borough_code_mapping = {
-        "Manhattan": "1",
-        "Brooklyn": "3",
-        "Bronx": "2",
-        "Queens": "4",
-        "Staten Island": "5"
+# Text shown next to the maps, per region; other regions get the generic text
+region_texts = {
+    'nyc': {
+        'density': "We tried to visualize population density to see whether there are enough stations in densely populated areas or if particular areas have more. Notably, Lower Manhattan seems to have a high number of stations. This could be due to various factors such as higher demand, availability of space, or policy decisions.",
+        'trips': "We used NYC Taxi data from 2019 as a proxy for traffic patterns, illustrating the number of trips throughout the day and overlaying EV charging stations to highlight areas of need. Black zones indicate no trips during specific times of the day, with Staten Island having more black zones, possibly due to residents primarily commuting by car and taking a ferry to other parts of NYC. To animate the graph and view trip density throughout the day, click 'Play'. To focus on a specific time of day, click 'Pause'."
     }
+}
+generic_texts = {
+    'density': "Census tracts colored by population density, with the region's EV charging stations, to see whether there are enough stations in densely populated areas or if particular areas have more.",
+    'trips': "Trips per zone throughout the day, with the region's EV charging stations, to highlight areas of need. Zones without trips are left uncolored. To animate the graph, click 'Play'. To focus on a specific time of day, click 'Pause'."
+}
 
-    # Map Borough to BoroCode
-    pop_df['BoroCode'] = pop_df['Borough'].map(borough_code_mapping)
-else:
-    raise KeyError("'Borough' column not found. Check the mapping step for errors.")
-
-# Extract the numeric values from CTLabel using regex
-pop_df['CTLabelNumeric'] = pop_df['CTLabel'].str.extract(r'(\d+\.\d+|\d+)')
-pop_df['CTLabelNumeric'] = pd.to_numeric(pop_df['CTLabelNumeric'])
-pop_df['CTLabelNumeric'] = pop_df['CTLabelNumeric'].apply(lambda x: f"{x:.2f}")
-
-# Create a "Key" column in pop_df
-pop_df['Key'] = pop_df['CTLabelNumeric'] + '-' + pop_df['BoroCode']
-
-# Merge the GeoDataFrame and population DataFrame on the "Key" column
-merged_gdf = gdf.merge(pop_df, on='Key', how='inner')
-
-# Calculate population density and add it as a column
-merged_gdf['Population_Density'] = merged_gdf['P1_001N'] / merged_gdf['Shape_Area']
+# Function to get the text shown next to the maps for a region
+def region_text(view, kind):
+    return region_texts.get(view.name, generic_texts)[kind]
 
 # Function to create the population density map
-def create_population_density_map():
-    map_center = [40.7128, -74.0060]  # Center of NYC
-    ev_map = folium.Map(location=map_center, zoom_start=10, tiles='cartodbpositron')
+def create_population_density_map(view):
+    ev_map = folium.Map(location=view.center, zoom_start=view.zoom, tiles='cartodbpositron')
 
-    # Add a white polygon to mask the whole world
-    world_polygon = Polygon([[-180, 90], [-180, -90], [180, -90], [180, 90]])
-    nyc_polygon = merged_gdf.unary_union
-
-    # Set the CRS for both polygons
-    world_gdf = gpd.GeoSeries([world_polygon], crs="EPSG:4326")
-    nyc_gdf = gpd.GeoSeries([nyc_polygon], crs="EPSG:4326")
-
-    # Create the mask GeoJson
-    mask_gdf = gpd.GeoSeries([world_polygon, nyc_polygon], crs="EPSG:4326")
-    mask = folium.GeoJson(data=mask_gdf.__geo_interface__, style_function=lambda x: {'fillColor': 'white', 'color': 'white', 'fillOpacity': 1})
+    # Add a white polygon masking the whole world outside the region
+    mask = folium.GeoJson(data=view.census_tiers.mask_geojson, style_function=lambda x: {'fillColor': 'white', 'color': 'white', 'fillOpacity': 1})
     mask.add_to(ev_map)
 
-    # Add the census tracts colored by population density
-    folium.Choropleth(
-        geo_data=merged_gdf,
-        data=merged_gdf,
-        columns=['GEOID', 'Population_Density'],
-        key_on='feature.properties.GEOID',
-        fill_color='OrRd',
-        fill_opacity=0.7,
-        line_opacity=0.2,
-        legend_name='Population Density (per km²)',
-        highlight=True
-    ).add_to(ev_map)
+    # Add the census tracts colored by population density; finer geometry is fetched when zooming in
+    tracts = view.data.tracts
+    density_frame = choropleth_frame(tracts['Population_Density'], 'Population Density (per km²)')
+    if vector_tiles:
+        VectorTileLayer(
+            f'/tiles/census_tracts.{view.name}/{view.tile_source.version("census_tracts")}/{{z}}/{{x}}/{{y}}.pbf', 'census_tracts',
+            popup_fields=[('GEOID', 'GEOID'), ('Population Density (per km²)', 'Population_Density')],
+            value_field='Population_Density', bins=density_frame['bins']
+        ).add_to(ev_map)
+    else:
+        RestylableChoropleth(
+            tracts,
+            initial_frame=density_frame,
+            tiers=view.census_tiers,
+            tiers_url=f'/geometry/census_tracts.{view.name}/{view.census_tiers.version}/{{tier}}.json',
+            follow_parent=False
+        ).add_to(ev_map)
 
     # Add EV charging stations
-    marker_cluster = MarkerCluster().add_to(ev_map)
-    for idx, row in ev_data_nyc.iterrows():
-        popup_text = f"""
-        <b>Station Name:</b> {row['station_name']}<br>
-        <b>Street Address:</b> {row['street_address']}<br>
-        <b>City:</b> {row['city']}<br>
-        <b>State:</b> {row['state']}<br>
-        <b>ZIP Code:</b> {row['zip']}<br>
-        <b>Fuel Type:</b> {row['fuel_type_code']}<br>
-        <b>Access Code:</b> {row['access_code']}
-        """
-        iframe = folium.IFrame(html=popup_text, width=300, height=200)
-        popup = folium.Popup(iframe, max_width=500)
-        folium.Marker(
-            location=[row['latitude'], row['longitude']],
-            popup=popup
-        ).add_to(marker_cluster)
+    add_station_markers(view, ev_map)
 
     return ev_map
 
 # Function to create the pickup and dropoff map
-def create_pickup_dropoff_map(data, data_type):
-    map_center = [40.7128, -74.0060]  # Center of NYC
-    ev_map = folium.Map(location=map_center, zoom_start=11, tiles='cartodbpositron')
+def create_pickup_dropoff_map(view, data, data_type):
+    ev_map = folium.Map(location=view.center, zoom_start=view.zoom + 1, tiles='cartodbpositron')
 
     # Add the taxi zones colored by the selected data type
     folium.Choropleth(
-        geo_data=taxi_zones_gdf,
+        geo_data=view.data.zones,
         data=data,
         columns=['LocationID', data_type],
         key_on='feature.properties.LocationID',
         fill_color='OrRd',
         fill_opacity=0.7,
         line_opacity=0.2,
-        legend_name=f'{data_type} Count',
+        bins=view.demand.bins[data_type],
+        legend_name=METRICS[data_type],
         highlight=True
     ).add_to(ev_map)
 
     # Add EV charging stations
-    marker_cluster = MarkerCluster().add_to(ev_map)
-    for idx, row in ev_data_nyc.iterrows():
-        popup_text = f"""
-        <b>Station Name:</b> {row['station_name']}<br>
-        <b>Street Address:</b> {row['street_address']}<br>
-        <b>City:</b> {row['city']}<br>
-        <b>State:</b> {row['state']}<br>
-        <b>ZIP Code:</b> {row['zip']}<br>
-        <b>Fuel Type:</b> {row['fuel_type_code']}<br>
-        <b>Access Code:</b> {row['access_code']}
-        """
-        iframe = folium.IFrame(html=popup_text, width=300, height=200)
-        popup = folium.Popup(iframe, max_width=500)
-        folium.Marker(
-            location=[row['latitude'], row['longitude']],
-            popup=popup
-        ).add_to(marker_cluster)
+    add_station_markers(view, ev_map)
 
     return ev_map
 
-# Function to update the pickup and dropoff map based on selected data type and hour
-def update_pickup_dropoff_map(data_type, hour):
-    if data_type == 'pickup_count':
-        data = data_pu[data_pu['hour_of_day'] == hour]
-        data = data.rename(columns={'PULocationID': 'LocationID'})
-    elif data_type == 'dropoff_count':
-        data = data_do[data_do['hour_of_day'] == hour]
-        data = data.rename(columns={'DOLocationID': 'LocationID'})
-    
-    ev_map = create_pickup_dropoff_map(data, data_type)
-    ev_map.save(os.path.join(base_dir, 'maps', 'pickup_dropoff_map.html'))
-
-# Generate initial maps
-if not os.path.exists(os.path.join(base_dir, 'maps')):
-    os.makedirs(os.path.join(base_dir, 'maps'))
-
-create_population_density_map().save(os.path.join(base_dir, 'maps', 'population_density_map.html'))
-update_pickup_dropoff_map('pickup_count', 0)
+# Function to add a region's EV charging stations to a map
+def add_station_markers(view, ev_map):
+    if vector_tiles:
+        VectorTileLayer(f'/tiles/stations.{view.name}/{view.tile_source.version("stations")}/{{z}}/{{x}}/{{y}}.pbf', 'stations', popup_fields=POPUP_FIELDS).add_to(ev_map)
+    else:
+        station_layer(view.data.stations).add_to(ev_map)
+
+# Taxi demand per metric, zone and hour (see elec_transit_y/demand_cube.py), with trips per
+# charging station and per 1,000 residents (tract population reallocated to zones by area).
+# Built once per region, and memory-mapped from DEMAND_CUBE_DIR when that is set
+def build_demand_cube(data):
+    chargers = data.stations[data.stations['fuel_type_code'] == 'ELEC']
+    residents = areal_weights(data.tracts, data.zones).extensive(data.tracts['P1_001N'])
+    return DemandCube.from_tables(data.pickups, data.dropoffs, zone_totals(chargers['taxi_zone_id'], n_zones=data.n_zones),
+                                  zone_totals(data.zones['LocationID'], residents, n_zones=data.n_zones),
+                                  n_zones=data.n_zones)
+
+# Function to get a metric for an hour, one value per zone (NaN where there were no trips)
+def pickup_dropoff_values(view, data_type, hour):
+    return view.demand.zone_values(data_type, hour)[view.zone_location_ids]
+
+# Function to build the per-hour payload pushed to the browser in clientside restyle mode;
+# the bins are shared by every hour so colors can be compared between hours
+@stage('nyc.pickup_dropoff_frame')
+def pickup_dropoff_frame(view, data_type, hour):
+    return choropleth_frame(pickup_dropoff_values(view, data_type, hour), METRICS[data_type], bins=view.demand.bins[data_type])
+
+# Function to create the pickup and dropoff map once, to be recolored in the browser
+def create_restylable_pickup_dropoff_map(view, data_type, hour):
+    ev_map = folium.Map(location=view.center, zoom_start=view.zoom + 1, tiles='cartodbpositron')
+    RestylableChoropleth(
+        view.data.zones,
+        tooltip_field='zone',
+        initial_frame=pickup_dropoff_frame(view, data_type, hour)
+    ).add_to(ev_map)
+    add_station_markers(view, ev_map)
+    return ev_map
+
+# Rendered pickup/dropoff maps, one per (region, data type, hour). Frames are held in memory
+# and, if FRAME_CACHE_DIR is set, persisted there keyed by a hash of the region's data
+pickup_dropoff_frames = LRUCache(
+    maxsize=len(METRICS) * 24 * (REGION_CACHE_SIZE + 1),
+    persist_dir=os.environ.get('FRAME_CACHE_DIR'),
+    namespace='pickup_dropoff'
+)
+watch_cache('pickup_dropoff_frames', pickup_dropoff_frames)
+
+# Function to render the pickup and dropoff map for the selected data type and hour as HTML
+def render_pickup_dropoff_map(view, data_type, hour):
+    values = view.demand.zone_values(data_type, hour)
+    data = pd.DataFrame({'LocationID': range(len(values)), data_type: values}).dropna()
+
+    with stage('nyc.pickup_dropoff_map.build'):
+        ev_map = create_pickup_dropoff_map(view, data, data_type)
+    with stage('nyc.pickup_dropoff_map.html'):
+        return ev_map.get_root().render()
+
+# Function to get the pickup and dropoff map based on selected data type and hour
+def update_pickup_dropoff_map(view, data_type, hour):
+    return pickup_dropoff_frames.get_or_create((view.frames_namespace, data_type, hour),
+                                               lambda: render_pickup_dropoff_map(view, data_type, hour))
+
+# Function to render every animation frame of a region so Play never waits on folium
+def prerender_pickup_dropoff_maps(view):
+    for data_type in view.demand.metrics:
+        for hour in range(24):
+            update_pickup_dropoff_map(view, data_type, hour)
+
+# Function to prepare what the dashboard shows for a region (see elec_transit_y/regions.py):
+# simplified census tract geometry per zoom tier and the region outline for the world mask,
+# vector tile layers cut on demand (see elec_transit_y/tiles.py), the demand cube and the
+# initial maps
+def prepare_region(data):
+    region = data.region
+    view = SimpleNamespace(name=region.name, title=region.title, data=data, center=data.center, zoom=region.zoom)
+    with stage('nyc.census_tiers'):
+        view.census_tiers = prepared_tiers(data.tracts)
+    if vector_tiles:
+        view.tile_source = TileSource(region_layers(data), region=region.name)
+
+    demand_key = data_hash(data.pickups, data.dropoffs, data.zones, data.tracts[['GEOID', 'P1_001N']],
+                           data.stations[['taxi_zone_id', 'fuel_type_code']])
+    with stage('nyc.demand_cube'):
+        view.demand = load_or_build(demand_key, lambda: build_demand_cube(data))
+    view.zone_location_ids = data.zones['LocationID'].to_numpy()
+    view.frames_namespace = hashlib.sha1(
+        json.dumps([region.name, data_hash(data.pickups, data.dropoffs, data.zones, data.stations), demand_key,
+                    view.demand.bins]).encode()
+    ).hexdigest()
+
+    # Generate initial maps; without clientside restyling the remaining frames of the default
+    # region are rendered in the background
+    with stage('nyc.population_density_map'):
+        view.population_density_map_html = create_population_density_map(view).get_root().render()
+    with stage('nyc.initial_pickup_dropoff_map'):
+        if clientside_restyle:
+            view.pickup_dropoff_map_html = create_restylable_pickup_dropoff_map(view, 'pickup_count', 0).get_root().render()
+        else:
+            view.pickup_dropoff_map_html = update_pickup_dropoff_map(view, 'pickup_count', 0)
+    return view
+
+region_loader = RegionLoader(prepare_region, pinned=[DEFAULT_REGION])
+watch_cache('regions', region_loader.cache)
+default_view = region_loader.get(DEFAULT_REGION)
+data_types = default_view.demand.metrics
+
+# Without clientside restyling every hour change renders a full map, so that callback runs as
+# a background job (see elec_transit_y/background.py) with results memoized per frame
+regions_key = hashlib.sha1(json.dumps([region.spec() for region in REGIONS.values()]).encode()).hexdigest()
+callback_manager = None if clientside_restyle else background_manager(
+    namespace=hashlib.sha1(f'{default_view.frames_namespace}{regions_key}'.encode()).hexdigest())
+
+# Function to get the dropdown options of the metrics in a region's demand cube
+def data_type_options(view):
+    return [
+        {'label': 'Number of Pickups', 'value': 'pickup_count'},
+        {'label': 'Number of Drop Offs', 'value': 'dropoff_count'}
+    ] + [{'label': METRICS[metric], 'value': metric} for metric in view.demand.metrics[2:]]
+
+# Sites for new chargers picked by maximal coverage of taxi trips and population (see
+# elec_transit_y/siting.py). Greedy picks are nested, so each combination of options is
+# solved once for the most sites offered and the plan is cut to the requested number
+siting_max_sites = 500
+siting_plans = LRUCache(maxsize=16)
+siting_maps = LRUCache(maxsize=64)
+watch_cache('siting_plans', siting_plans)
+watch_cache('siting_maps', siting_maps)
+
+# Function to get the siting plan for the selected region, candidates, service radius and demand weighting
+def siting_plan(view, candidates, radius, trip_share):
+    def build():
+        data = view.data
+        chargers = data.stations[data.stations['fuel_type_code'] == 'ELEC']
+        with stage('siting.model'):
+            model, crs = nyc_siting_model(data.zones, data.tracts, chargers, data.pickups, data.dropoffs,
+                                          trip_share, candidates, radius)
+        with stage('siting.plan'):
+            plan = model.plan(siting_max_sites)
+        plan['latitude'], plan['longitude'] = unproject(plan[['x', 'y']].to_numpy(), crs)
+        return model.existing_share(), plan
+    return siting_plans.get_or_create((view.frames_namespace, candidates, radius, trip_share), build)
+
+# Function to render the existing stations and the first n_sites new sites with their service areas
+def render_siting_map(view, candidates, radius, trip_share, n_sites):
+    existing_share, plan = siting_plan(view, candidates, radius, trip_share)
+    with stage('siting.map_build'):
+        ev_map = folium.Map(location=view.center, zoom_start=view.zoom + 1, tiles='cartodbpositron')
+        add_station_markers(view, ev_map)
+        new_sites = folium.FeatureGroup(name='New sites')
+        for rank, site in enumerate(plan.head(n_sites).itertuples(), 1):
+            folium.Circle([site.latitude, site.longitude], radius=radius, color='green', weight=1,
+                          fill=True, fill_opacity=0.15).add_to(new_sites)
+            folium.CircleMarker([site.latitude, site.longitude], radius=5, color='darkgreen', fill=True, fill_opacity=1,
+                                tooltip=f'Site {rank}', popup=f'Site {rank}: covers {site.added_share:.2%} more of the demand').add_to(new_sites)
+        new_sites.add_to(ev_map)
+    with stage('siting.map_html'):
+        return ev_map.get_root().render()
 
 # Initialize the Dash app
 app = dash.Dash(__name__, external_stylesheets=[
@@ -214,22 +270,51 @@ app = dash.Dash(__name__, external_stylesheets=[
     '/assets/styles.css'
 ])
 
+# Expose the Flask server for gunicorn (see gunicorn.conf.py)
+server = app.server
+
+# Serve the census tract geometry tiers fetched by the density map on zoom, and the vector
+# tiles, of every region as layers named '<layer>.<region>' (e.g. census_tracts.nyc)
+register_geometry_routes(server, RegionLayers(region_loader, {'census_tracts': 'census_tiers'}))
+if vector_tiles:
+    register_tile_routes(server, RegionTileSource(region_loader))
+    watch_cache('tiles', default_view.tile_source.cache)
+
+# Serve request latencies, payload sizes, stage timings and cache hit rates at /metrics
+# (see elec_transit_y/metrics.py)
+register_metrics_routes(server)
+
+# Render the remaining frames in a background thread, started on the first request in each
+# process so it also runs in gunicorn workers forked from a preloaded master
+prerender_started_in = []
+
+@server.before_request
+def start_prerender():
+    if not clientside_restyle and os.getpid() not in prerender_started_in:
+        prerender_started_in.append(os.getpid())
+        threading.Thread(target=prerender_pickup_dropoff_maps, args=(default_view,), daemon=True).start()
+
 # Define the app layout
 app.layout = html.Div(className='container', children=[
-    html.H1('NYC EV Charging Stations and Data Maps', style={'textAlign': 'center'}),
+    html.H1(f'{default_view.title} EV Charging Stations and Data Maps', id='region-title', style={'textAlign': 'center'}),
+    # The region picker is only shown when there is more than one region
+    dcc.Dropdown(
+        id='region-dropdown',
+        options=[{'label': region.title, 'value': name} for name, region in REGIONS.items()],
+        value=DEFAULT_REGION,
+        clearable=False,
+        style={'display': 'none'} if len(REGIONS) == 1 else {}
+    ),
     html.Div(className='row', children=[
         html.Div(className='map-container', children=[
             dcc.Tabs([
                 dcc.Tab(label='Population Density', children=[
-                    html.Iframe(id='population-density-map', srcDoc=open(os.path.join(base_dir, 'maps', 'population_density_map.html'), 'r').read(), width='100%', height='800', style={'display': 'block', 'margin-left': 'auto', 'margin-right': 'auto'})
+                    html.Iframe(id='population-density-map', srcDoc=default_view.population_density_map_html, width='100%', height='800', style={'display': 'block', 'margin-left': 'auto', 'margin-right': 'auto'})
                 ]),
                 dcc.Tab(label='Pickups and Dropoffs', children=[
                     dcc.Dropdown(
                         id='data-type-dropdown',
-                        options=[
-                            {'label': 'Number of Pickups', 'value': 'pickup_count'},
-                            {'label': 'Number of Drop Offs', 'value': 'dropoff_count'}
-                        ],
+                        options=data_type_options(default_view),
                         value='pickup_count'
                     ),
                     dcc.Slider(
@@ -242,19 +327,48 @@ app.layout = html.Div(className='container', children=[
                     ),
                     dcc.Interval(
                         id='interval-component',
-                        interval=1*1000,  # in milliseconds
+                        interval=500 if clientside_restyle else 1*1000,  # in milliseconds
                         n_intervals=0,
                         disabled=True
                     ),
                     html.Button('Play', id='play-button', n_clicks=0),
                     html.Button('Pause', id='pause-button', n_clicks=0),
-                    html.Iframe(id='pickup-dropoff-map', srcDoc=open(os.path.join(base_dir, 'maps', 'pickup_dropoff_map.html'), 'r').read(), width='100%', height='800', style={'display': 'block', 'margin-left': 'auto', 'margin-right': 'auto'})
+                    html.Div(id='pickup-dropoff-progress', style={'display': 'none'}),
+                    html.Iframe(id='pickup-dropoff-map', srcDoc=default_view.pickup_dropoff_map_html, width='100%', height='800', style={'display': 'block', 'margin-left': 'auto', 'margin-right': 'auto'}),
+                    dcc.Store(id='pickup-dropoff-frame'),
+                    html.Div(id='pickup-dropoff-frame-applied', style={'display': 'none'})
+                ]),
+                dcc.Tab(label='Charger Siting', children=[
+                    html.Label('New sites'),
+                    dcc.Input(id='siting-sites', type='number', min=1, max=siting_max_sites, step=1, value=25, debounce=True),
+                    html.Label('Candidate sites'),
+                    dcc.Dropdown(
+                        id='siting-candidates',
+                        options=[
+                            {'label': f'Grid points ({GRID_SPACING_M} m apart)', 'value': 'hex'},
+                            {'label': 'One per taxi zone', 'value': 'zones'}
+                        ],
+                        value='hex',
+                        clearable=False
+                    ),
+                    html.Label('Service radius'),
+                    dcc.Dropdown(
+                        id='siting-radius',
+                        options=[{'label': f'{radius} m', 'value': radius} for radius in [400, SERVICE_RADIUS_M, 1600]],
+                        value=SERVICE_RADIUS_M,
+                        clearable=False
+                    ),
+                    html.Label('Demand'),
+                    dcc.Slider(id='siting-trip-share', min=0, max=1, step=0.25, value=0.5,
+                               marks={0: 'Population', 0.5: 'Both', 1: 'Taxi trips'}),
+                    html.Div(id='siting-summary'),
+                    html.Iframe(id='siting-map', width='100%', height='800', style={'display': 'block', 'margin-left': 'auto', 'margin-right': 'auto'})
                 ])
             ])
         ], style={'width': '70%', 'display': 'inline-block', 'vertical-align': 'top'}),
         html.Div(className='text-container', children=[
             html.Div(id='text-content', children=[
-                html.P("We tried to visualize population density to see whether there are enough stations in densely populated areas or if particular areas have more. Notably, Lower Manhattan seems to have a high number of stations. This could be due to various factors such as higher demand, availability of space, or policy decisions.")
+                html.P(region_text(default_view, 'density'))
             ], style={'display': 'flex', 'justify-content': 'center', 'align-items': 'center', 'height': '100%'})
         ], style={'width': '30%', 'display': 'inline-block', 'vertical-align': 'top', 'padding-left': '20px'})
     ])
@@ -267,20 +381,79 @@ app.layout = html.Div(className='container', children=[
 def toggle_interval(play_clicks, pause_clicks):
     return pause_clicks > play_clicks
 
-@app.callback(
-    [Output('hour-slider', 'value'), Output('pickup-dropoff-map', 'srcDoc'), Output('text-content', 'children')],
+# In clientside restyle mode the callback only returns the counts for the hour; the browser recolors the zones
+app.clientside_callback(
+    dash.ClientsideFunction(namespace='maps', function_name='restyleChoropleth'),
+    Output('pickup-dropoff-frame-applied', 'children'),
+    [Input('pickup-dropoff-frame', 'data')],
+    [State('pickup-dropoff-map', 'id')]
+)
+
+if clientside_restyle:
+    pickup_dropoff_output = Output('pickup-dropoff-frame', 'data')
+else:
+    pickup_dropoff_output = Output('pickup-dropoff-map', 'srcDoc')
+
+# Picking a region loads it on first use and swaps the maps; resetting the data type and hour
+# then redraws the pickup and dropoff map for the region
+region_outputs = [Output('region-title', 'children'), Output('population-density-map', 'srcDoc'),
+                  Output('data-type-dropdown', 'options'), Output('data-type-dropdown', 'value'),
+                  Output('hour-slider', 'value', allow_duplicate=True)]
+if clientside_restyle:
+    region_outputs.append(Output('pickup-dropoff-map', 'srcDoc'))
+
+@app.callback(region_outputs, [Input('region-dropdown', 'value')], prevent_initial_call=True)
+def update_region(region):
+    view = region_loader.get(region)
+    outputs = [f'{view.title} EV Charging Stations and Data Maps', view.population_density_map_html,
+               data_type_options(view), 'pickup_count', 0]
+    if clientside_restyle:
+        outputs.append(view.pickup_dropoff_map_html)
+    return outputs
+
+# In background mode a newer hour or data type terminates the job it replaces
+@slow_callback(
+    app, callback_manager,
+    [Output('hour-slider', 'value'), pickup_dropoff_output, Output('text-content', 'children')],
     [Input('data-type-dropdown', 'value'), Input('hour-slider', 'value'), Input('interval-component', 'n_intervals')],
-    [State('play-button', 'n_clicks'), State('pause-button', 'n_clicks')]
+    [State('play-button', 'n_clicks'), State('pause-button', 'n_clicks'), State('region-dropdown', 'value')],
+    progress=Output('pickup-dropoff-progress', 'children'),
+    running=[(Output('pickup-dropoff-progress', 'style'), {'display': 'block'}, {'display': 'none'})],
+    interval=250
 )
-def update_output(data_type, hour, n_intervals, play_clicks, pause_clicks):
+def update_output(set_progress, data_type, hour, n_intervals, play_clicks, pause_clicks, region):
+    view = region_loader.get(region)
     if play_clicks > pause_clicks:
         hour = n_intervals % 24
-    update_pickup_dropoff_map(data_type, hour)
-    if data_type == 'pickup_count':
-        text_content = "We used NYC Taxi data from 2019 as a proxy for traffic patterns, illustrating the number of trips throughout the day and overlaying EV charging stations to highlight areas of need. Black zones indicate no trips during specific times of the day, with Staten Island having more black zones, possibly due to residents primarily commuting by car and taking a ferry to other parts of NYC. To animate the graph and view trip density throughout the day, click 'Play'. To focus on a specific time of day, click 'Pause'."
+    if clientside_restyle:
+        map_content = pickup_dropoff_frame(view, data_type, hour)
     else:
-        text_content = "We tried to visualize population density to see whether there are enough stations in densely populated areas or if particular areas have more. Notably, Lower Manhattan seems to have a high number of stations. This could be due to various factors such as higher demand, availability of space, or policy decisions."
-    return hour, open(os.path.join(base_dir, 'maps', 'pickup_dropoff_map.html'), 'r').read(), html.P(text_content, style={'display': 'flex', 'justify-content': 'center', 'align-items': 'center', 'height': '100%'})
+        set_progress(f'Rendering the map for hour {hour}...')
+        map_content = update_pickup_dropoff_map(view, data_type, hour)
+    text_content = region_text(view, 'trips' if data_type.startswith('pickup') else 'density')
+    return hour, map_content, html.P(text_content, style={'display': 'flex', 'justify-content': 'center', 'align-items': 'center', 'height': '100%'})
+
+# Solving a new combination of options takes about a second, after which changing the number of sites only redraws the map
+@app.callback(
+    [Output('siting-map', 'srcDoc'), Output('siting-summary', 'children')],
+    [Input('siting-candidates', 'value'), Input('siting-radius', 'value'), Input('siting-trip-share', 'value'), Input('siting-sites', 'value'),
+     Input('region-dropdown', 'value')]
+)
+def update_siting(candidates, radius, trip_share, n_sites, region):
+    view = region_loader.get(region)
+    n_sites = max(1, min(int(n_sites or 1), siting_max_sites))
+    try:
+        existing_share, plan = siting_plan(view, candidates, radius, trip_share)
+    except ValueError as error:
+        # e.g. only weighting taxi trips in a region without trip data
+        return None, html.P(f"{error}. Try another demand weighting.")
+    plan = plan.head(n_sites)
+    covered_share = plan['covered_share'].iloc[-1] if len(plan) else existing_share
+    summary = (f"Existing chargers are within {radius} m of {existing_share:.1%} of the demand. "
+               f"{len(plan)} new site{'s' if len(plan) != 1 else ''} would raise that to {covered_share:.1%}.")
+    map_html = siting_maps.get_or_create((view.frames_namespace, candidates, radius, trip_share, n_sites),
+                                         lambda: render_siting_map(view, candidates, radius, trip_share, n_sites))
+    return map_html, html.P(summary)
 
 # Run the app
 if __name__ == '__main__':